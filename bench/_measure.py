@@ -0,0 +1,34 @@
+﻿import json
+import runpy
+import sys
+from pathlib import Path
+
+# One peak-RSS reading for the bench and the tools' own traces: ../shared/_base.py (stdlib only).
+SHARED = Path(__file__).resolve().parent.parent / "shared"
+if str(SHARED) not in sys.path:
+    sys.path.insert(0, str(SHARED))
+
+from _base import peak_rss_mb
+
+
+def main() -> int:
+    # python _measure.py RESULT_JSON SCRIPT [ARGS...]: run SCRIPT as __main__ in
+    # this process, then write its exit code and peak RSS to RESULT_JSON.
+    result, script, *args = sys.argv[1:]
+    sys.argv = [script, *args]
+    sys.path.insert(0, str(Path(script).resolve().parent))
+    code = 0
+    try:
+        runpy.run_path(script, run_name="__main__")
+    except SystemExit as e:
+        if isinstance(e.code, int) or e.code is None:
+            code = e.code or 0
+        else:
+            print(e.code, file=sys.stderr)
+            code = 1
+    Path(result).write_text(json.dumps({"exit_code": code, "peak_rss_mb": peak_rss_mb()}), encoding="utf-8")
+    return code
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
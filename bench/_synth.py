@@ -0,0 +1,218 @@
+﻿import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+import localdb
+
+SYNAPSE_SCHEMAS = ["BI_DB_dbo", "DWH_dbo"]
+WORDS = [
+    "customer", "account", "trade", "position", "deposit", "withdrawal", "instrument", "price",
+    "daily", "monthly", "fact", "dim", "aum", "pnl", "fee", "commission", "country", "region",
+    "campaign", "session", "event", "login", "risk", "exposure", "balance", "ledger", "order",
+    "fill", "quote", "spread", "margin", "funding", "kyc", "crm", "lead", "segment", "club",
+]
+COLUMN_SUFFIXES = ["id", "amount", "date", "name", "flag", "count", "time"]
+# (Synapse DATA_TYPE, Databricks data_type) of the same column after migration.
+COLUMN_TYPES = [
+    ("int", "INT"), ("bigint", "BIGINT"), ("decimal", "DECIMAL"), ("nvarchar", "STRING"),
+    ("datetime2", "TIMESTAMP"), ("bit", "BOOLEAN"), ("date", "DATE"), ("float", "DOUBLE"),
+]
+FACT_COLUMNS = [("DateID", "int", "INT"), ("CustomerID", "bigint", "BIGINT"), ("Amount", "decimal", "DECIMAL")]
+
+
+@dataclass
+class SynthSpec:
+    rows: int = 1_000_000
+    tables: int = 4
+    dateids: int = 365
+    skew: float = 0.0
+    missing_rate: float = 0.001
+    objects: int = 2000
+    seed: int = 7
+    renamed_rate: float = 0.05
+
+
+def fact_names(i: int) -> Tuple[str, str]:
+    name = f"BI_DB_DDR_Fact_Bench{i:03d}"
+    return f"BI_DB_dbo.{name}", f"main.bi_db.{name.lower()}"
+
+
+def dateid_values(n: int) -> np.ndarray:
+    days = pd.date_range("2024-01-01", periods=n, freq="D")
+    return (days.year * 10000 + days.month * 100 + days.day).to_numpy(dtype=np.int64)
+
+
+def dateid_weights(n: int, skew: float) -> np.ndarray:
+    # Zipf-like: skew 0 is uniform, 1+ piles most rows onto the first DateIDs.
+    w = 1.0 / np.arange(1, n + 1, dtype=np.float64) ** skew
+    return w / w.sum()
+
+
+def fact_rows(spec: SynthSpec, rng: np.random.Generator) -> pd.DataFrame:
+    dateids = dateid_values(spec.dateids)
+    return pd.DataFrame({
+        "DateID": rng.choice(dateids, size=spec.rows, p=dateid_weights(spec.dateids, spec.skew)),
+        "CustomerID": rng.integers(1, 1_000_000, size=spec.rows),
+        "Amount": np.round(rng.gamma(2.0, 50.0, size=spec.rows), 2),
+    })
+
+
+def _insert(db, table: str, df: pd.DataFrame) -> None:
+    cols = ", ".join(df.columns)
+    marks = ", ".join("?" for _ in df.columns)
+    db.execute(f"CREATE TABLE {localdb.quote(table)} ({cols})")
+    db.executemany(f"INSERT INTO {localdb.quote(table)} VALUES ({marks})", df.itertuples(index=False, name=None))
+
+
+def inventory_names(spec: SynthSpec, rng: np.random.Generator) -> List[Tuple[str, str]]:
+    # (synapse name, databricks name) pairs: exact renames, vw_ views, token-dropped
+    # / reordered variants that only the fuzzy matcher can pair, and renames
+    # sharing no token that only the column signatures can pair.
+    pairs = []
+    seen = set()
+    while len(pairs) < spec.objects:
+        toks = list(rng.choice(WORDS, size=int(rng.integers(2, 6)), replace=False))
+        syn = "_".join(t.capitalize() for t in toks)
+        if syn in seen:
+            continue
+        seen.add(syn)
+        kind = rng.random()
+        if kind < spec.renamed_rate:
+            others = [w for w in WORDS if w not in toks]
+            dbx = "_".join(rng.choice(others, size=3, replace=False)) + f"_{len(pairs)}"
+        elif kind < 0.5:
+            dbx = syn.lower()
+        elif kind < 0.7:
+            dbx = syn.lower()
+            syn = "vw_" + syn
+        elif kind < 0.9 and len(toks) > 2:
+            dbx = "_".join(toks[:-1])
+        else:
+            dbx = "_".join(reversed(toks))
+        pairs.append((syn, dbx))
+    return pairs
+
+
+def object_columns(rng: np.random.Generator) -> List[Tuple[str, str, str]]:
+    # 3-8 random (Synapse CamelCase name, Synapse type, Databricks type) columns;
+    # the Databricks copy gets the snake_case name.
+    n = int(rng.integers(3, 9))
+    words = rng.choice(WORDS, size=n, replace=False)
+    suffixes = rng.choice(COLUMN_SUFFIXES, size=n)
+    types = rng.integers(0, len(COLUMN_TYPES), size=n)
+    return [(w.capitalize() + x.capitalize(), *COLUMN_TYPES[t]) for w, x, t in zip(words, suffixes, types)]
+
+
+def pdw_catalog(facts: List[Tuple[str, str, int]], objects: List[Tuple[str, str, str]]) -> Dict[str, pd.DataFrame]:
+    # Just enough of the Synapse catalog views for the partition-stats row count,
+    # modify-date and object-listing lookups: one node, one distribution per table.
+    # `objects` is (schema, name, "U" / "V") with the facts first.
+    schemas = sorted({schema for schema, _, _ in facts} | {schema for schema, _, _ in objects})
+    schema_ids = {s: i + 1 for i, s in enumerate(schemas)}
+    ids = range(1000, 1000 + len(facts))
+    physical = [f"Table_{i}" for i in ids]
+    return {
+        "sys.schemas": pd.DataFrame({"schema_id": list(schema_ids.values()), "name": schemas}),
+        "sys.objects": pd.DataFrame({
+            "object_id": range(1000, 1000 + len(objects)),
+            "schema_id": [schema_ids[s] for s, _, _ in objects],
+            "name": [n for _, n, _ in objects],
+            "type": [t for _, _, t in objects],
+            "modify_date": "2024-01-01T00:00:00",
+        }),
+        "sys.tables": pd.DataFrame({
+            "object_id": list(ids),
+            "schema_id": [schema_ids[s] for s, _, _ in facts],
+            "name": [n for _, n, _ in facts],
+            "modify_date": "2024-01-01T00:00:00",
+        }),
+        "sys.pdw_table_mappings": pd.DataFrame({"object_id": list(ids), "physical_name": physical}),
+        "sys.pdw_nodes_tables": pd.DataFrame({"name": physical, "object_id": list(ids), "pdw_node_id": 1, "distribution_id": 1}),
+        "sys.dm_pdw_nodes_db_partition_stats": pd.DataFrame({
+            "object_id": list(ids),
+            "pdw_node_id": 1,
+            "distribution_id": 1,
+            "index_id": 1,
+            "row_count": [rows for _, _, rows in facts],
+        }),
+    }
+
+
+def generate(root: Path, spec: SynthSpec) -> Dict[str, object]:
+    rng = np.random.default_rng(spec.seed)
+    syn_db = localdb.create("synapse", root)
+    dbx_db = localdb.create("databricks", root)
+
+    for db in (syn_db, dbx_db):
+        db.execute("PRAGMA journal_mode=OFF")
+        db.execute("PRAGMA synchronous=OFF")
+
+    syn_objects = []
+    dbx_objects = []
+    columns = []
+    dbx_columns = []
+    synapse_tables = []
+    facts = []
+    missing = 0
+    for i in range(spec.tables):
+        syn_name, dbx_name = fact_names(i)
+        df = fact_rows(spec, rng)
+        keep = rng.random(len(df)) >= spec.missing_rate
+        missing += int((~keep).sum())
+        _insert(syn_db, syn_name, df)
+        _insert(dbx_db, dbx_name, df[keep])
+
+        schema, name = syn_name.split(".", 1)
+        synapse_tables.append(syn_name)
+        facts.append((schema, name, len(df)))
+        syn_objects.append(("bench", schema, name, "BASE TABLE"))
+        dbx_objects.append(("main", "bi_db", dbx_name.rsplit(".", 1)[1], "TABLE", int(keep.sum())))
+        for pos, (col, typ, dbx_typ) in enumerate(FACT_COLUMNS, 1):
+            columns.append((schema, name, col, typ, 2 if typ == "decimal" else None, pos))
+            dbx_columns.append(("main", "bi_db", dbx_name.rsplit(".", 1)[1], col, dbx_typ, pos))
+
+    views = []
+    for j, (syn, dbx) in enumerate(inventory_names(spec, rng)):
+        schema = SYNAPSE_SCHEMAS[j % len(SYNAPSE_SCHEMAS)]
+        if syn.startswith("vw_"):
+            views.append(("bench", schema, syn))
+        else:
+            syn_objects.append(("bench", schema, syn, "BASE TABLE"))
+        dbx_objects.append(("main", "bi_db", dbx, "VIEW" if syn.startswith("vw_") else "TABLE", None))
+        for pos, (col, typ, dbx_typ) in enumerate(object_columns(rng), 1):
+            columns.append((schema, syn, col, typ, 2 if typ == "decimal" else None, pos))
+            dbx_columns.append(("main", "bi_db", dbx, "_".join(re.findall(r"[A-Z][a-z]*", col)).lower(), dbx_typ, pos))
+
+    _insert(syn_db, "INFORMATION_SCHEMA.TABLES", pd.DataFrame(syn_objects, columns=["TABLE_CATALOG", "TABLE_SCHEMA", "TABLE_NAME", "TABLE_TYPE"]))
+    _insert(syn_db, "INFORMATION_SCHEMA.VIEWS", pd.DataFrame(views, columns=["TABLE_CATALOG", "TABLE_SCHEMA", "TABLE_NAME"]))
+    _insert(
+        syn_db,
+        "INFORMATION_SCHEMA.COLUMNS",
+        pd.DataFrame(columns, columns=["TABLE_SCHEMA", "TABLE_NAME", "COLUMN_NAME", "DATA_TYPE", "NUMERIC_SCALE", "ORDINAL_POSITION"]),
+    )
+    objects = [(schema, name, "U") for _, schema, name, _ in syn_objects] + [(schema, name, "V") for _, schema, name in views]
+    for table, df in pdw_catalog(facts, objects).items():
+        _insert(syn_db, table, df)
+    _insert(dbx_db, "main.monitoring.tables", pd.DataFrame(dbx_objects, columns=["catalog", "schema", "name", "type", "num_rows"]))
+    _insert(
+        dbx_db,
+        "system.information_schema.tables",
+        pd.DataFrame(
+            [(c, s, n, "MANAGED" if t == "TABLE" else "VIEW", "2024-01-01 00:00:00") for c, s, n, t, _ in dbx_objects],
+            columns=["table_catalog", "table_schema", "table_name", "table_type", "last_altered"],
+        ),
+    )
+    _insert(
+        dbx_db,
+        "system.information_schema.columns",
+        pd.DataFrame(dbx_columns, columns=["table_catalog", "table_schema", "table_name", "column_name", "data_type", "ordinal_position"]),
+    )
+
+    for db in (syn_db, dbx_db):
+        db.commit()
+        db.close()
+    return {"synapse_tables": synapse_tables, "rows": spec.rows * spec.tables, "missing_in_databricks": missing}
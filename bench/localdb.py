@@ -0,0 +1,367 @@
+﻿import datetime
+import hashlib
+import os
+import re
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, List, Optional, Tuple
+
+import pyarrow as pa
+
+# Local stand-in for the Synapse and Databricks drivers, selected with
+# COMPARE_BACKEND=localdb. Each engine is one SQLite file under LOCALDB_PATH
+# (synapse.sqlite / databricks.sqlite). Dotted object names such as
+# main.bi_db.fact or INFORMATION_SCHEMA.TABLES are stored as single quoted
+# identifiers and rewritten in incoming SQL.
+#
+# LOCALDB_LATENCY_MS / LOCALDB_ROWS_PER_SEC (or LOCALDB_SYNAPSE_* /
+# LOCALDB_DATABRICKS_*) add a fixed per-statement delay and cap fetch
+# throughput, to approximate a remote warehouse.
+
+ENGINES = ("synapse", "databricks")
+NAME_RE = re.compile(r"(?<![\w.\"'])([A-Za-z_]\w*(?:\.[A-Za-z_]\w*)+)")
+CREATE_RE = re.compile(r"\s*CREATE\s+TABLE\s+([A-Za-z_]\w*(?:\.[A-Za-z_]\w*)+)", re.I)
+REWRITES = [
+    # UTF-8 varchar keeps every character; SQLite's default BINARY order is its byte order.
+    (re.compile(r"CONVERT\(\s*VARCHAR\((?:\d+|MAX)\)\s*,\s*(CONVERT\(\s*NVARCHAR\(MAX\)\s*,\s*[^()]+\))\s+COLLATE\s+\w+_UTF8\s*\)", re.I), r"UTF8_VARCHAR(\1)"),
+    (re.compile(r"COLLATE\s+Latin1_General_100_BIN2(_UTF8)?", re.I), "COLLATE BINARY"),
+    (re.compile(r"\s*COLLATE\s+Latin1_General_100_CI_AS_SC_UTF8", re.I), ""),
+    (re.compile(r"CONVERT\(\s*VARCHAR\(\d+\)\s*,\s*(.+?)\s*,\s*126\s*\)", re.I), r"\1"),
+    # The hash-diff text normalization: T-SQL CONVERT / CAST targets and LEFT become
+    # the functions below, Databricks STRING casts SQLite TEXT ones.
+    (re.compile(r"CONVERT\(\s*(N?VARCHAR)\((\d+|MAX)\)\s*,", re.I), r"CONVERT('\1(\2)',"),
+    (re.compile(r"CONVERT\(\s*BIGINT\s*,", re.I), "CONVERT('BIGINT',"),
+    (re.compile(r"CAST\(\s*([^()]+?)\s+AS\s+DATETIME2\((\d)\)\s*\)", re.I), r"DATETIME2(\1, \2)"),
+    (re.compile(r"\bLEFT\s*\(", re.I), "LEFT_TEXT("),
+    (re.compile(r"\bAS\s+STRING\s*\)", re.I), "AS TEXT)"),
+    (re.compile(r"\bCOUNT_BIG\(", re.I), "COUNT("),
+    (re.compile(r"\bGREATEST\(", re.I), "MAX("),
+    (re.compile(r"\bDB_NAME\(\)", re.I), "'bench'"),
+    (re.compile(r"^\s*DESCRIBE\s+TABLE\s+\"([^\"]+)\"\s*$", re.I), r"SELECT name AS col_name, type AS data_type, NULL AS comment FROM pragma_table_info('\1')"),
+]
+
+# Databricks string literals escape with backslashes ('it\'s'); SQLite doubles quotes.
+SPARK_STRING_RE = re.compile(r"'((?:[^'\\]|\\.)*)'", re.S)
+SPARK_ESCAPE_RE = re.compile(r"\\(.)", re.S)
+
+
+def _standard_string(m: re.Match) -> str:
+    return "'" + SPARK_ESCAPE_RE.sub(r"\1", m.group(1)).replace("'", "''") + "'"
+
+
+# Spark's CAST('inf' AS DOUBLE); SQLite reads an overflowing literal as infinity.
+SPARK_INF_RE = re.compile(r"CAST\(\s*'(-?)inf'\s+AS\s+DOUBLE\s*\)", re.I)
+# Multi-row INSERT ... VALUES (server-diff uploads, megabytes each) only holds
+# literals, so the query rewrites are skipped for it.
+VALUES_RE = re.compile(r"\s*INSERT\s+INTO\s+(\S+)\s+VALUES\s", re.I)
+
+
+GROUPING_FLAG_RE = re.compile(r"^GROUPING\((\w+)\)\s+AS\s+(\w+)$", re.I)
+
+
+def _split_top(text: str) -> List[str]:
+    # Comma-separated items, ignoring commas inside parentheses.
+    items, depth, start = [], 0, 0
+    for i, ch in enumerate(text):
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif ch == "," and depth == 0:
+            items.append(text[start:i].strip())
+            start = i + 1
+    items.append(text[start:].strip())
+    return [t for t in items if t]
+
+
+def _grouping_sets(group: str) -> Optional[List[List[str]]]:
+    m = re.match(r"^GROUPING\s+SETS\s*\((.*)\)$", group.strip(), re.I | re.S)
+    if m:
+        return [_split_top(inner) for inner in re.findall(r"\(([^()]*)\)", m.group(1))]
+    items = _split_top(group)
+    rolled = [i for i in items if re.match(r"^ROLLUP\s*\(", i, re.I)]
+    if not rolled:
+        return None
+    fixed = [i for i in items if i not in rolled]
+    cols = _split_top(rolled[0][rolled[0].index("(") + 1 : -1])
+    return [fixed + cols[:n] for n in range(len(cols), -1, -1)]
+
+
+def expand_grouping(sql: str) -> str:
+    # SQLite has no GROUPING SETS / ROLLUP / GROUPING(): expand each grouping set
+    # into its own GROUP BY branch of a UNION ALL, with the keys it does not group
+    # by as NULL and GROUPING(k) as a 0/1 literal.
+    branches = []
+    for branch in re.split(r"\s+UNION\s+ALL\s+", sql, flags=re.I):
+        head, sep, group = branch.rpartition(" GROUP BY ")
+        sets = _grouping_sets(group) if sep else None
+        m = re.match(r"^\s*SELECT\s+(.*?)\s+FROM\s+(.*)$", head, re.I | re.S)
+        if sets is None or m is None:
+            branches.append(branch)
+            continue
+        items = _split_top(m.group(1))
+        keys = {k for s in sets for k in s}
+        for grouped in sets:
+            select = []
+            for item in items:
+                flag = GROUPING_FLAG_RE.match(item)
+                if flag:
+                    select.append(f"{0 if flag.group(1) in grouped else 1} AS {flag.group(2)}")
+                elif item in keys and item not in grouped:
+                    select.append(f"NULL AS {item}")
+                else:
+                    select.append(item)
+            branches.append(f"SELECT {', '.join(select)} FROM {m.group(2)}" + (f" GROUP BY {', '.join(grouped)}" if grouped else ""))
+    return " UNION ALL ".join(branches)
+
+
+def db_path(engine: str, root: Optional[Path] = None) -> Path:
+    if root is None:
+        env = os.getenv("LOCALDB_PATH")
+        if not env:
+            raise RuntimeError("Missing env var: LOCALDB_PATH")
+        root = Path(env)
+    return root / f"{engine}.sqlite"
+
+
+def _setting(engine: str, name: str) -> float:
+    v = os.getenv(f"LOCALDB_{engine.upper()}_{name}") or os.getenv(f"LOCALDB_{name}")
+    return float(v) if v else 0.0
+
+
+# Raised when the real driver cannot be imported (no ODBC stack on this host);
+# _base.query_errors() picks these up from COMPARE_BACKEND.
+ERRORS = (sqlite3.Error,)
+
+
+def _driver_error(engine: str) -> type:
+    # Raise what the real driver would, so callers' except clauses behave the same.
+    try:
+        if engine == "synapse":
+            import pyodbc
+            return pyodbc.Error
+        from databricks.sql.exc import Error
+        return Error
+    except ImportError:
+        return sqlite3.Error
+
+
+def connect(engine: str) -> "Connection":
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine: {engine}")
+    # Stand-in for login / session setup (AAD, Azure CLI token, warehouse session).
+    time.sleep(_setting(engine, "CONNECT_MS") / 1000)
+    return Connection(engine, db_path(engine))
+
+
+def create(engine: str, root: Path) -> sqlite3.Connection:
+    # Fresh raw connection for loading data; callers quote dotted names themselves.
+    path = db_path(engine, root)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.exists():
+        path.unlink()
+    return sqlite3.connect(path)
+
+
+def quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+class _DistinctCount:
+    # APPROX_COUNT_DISTINCT / approx_count_distinct(col, rsd), answered exactly.
+    def __init__(self):
+        self.seen = set()
+
+    def step(self, value, *_) -> None:
+        if value is not None:
+            self.seen.add(value)
+
+    def finalize(self) -> int:
+        return len(self.seen)
+
+
+# Timestamps are stored as text, 'YYYY-MM-DD HH:MM:SS[.fraction]' (up to 7 digits, as datetime2).
+def _split_timestamp(value: str) -> Tuple[str, str]:
+    whole, _, fraction = str(value).replace("T", " ").partition(".")
+    return whole, fraction
+
+
+def _convert(typ: str, value: Any, style: Optional[int] = None) -> Any:
+    # T-SQL CONVERT for the targets the scripts use. VARCHAR holds code-page
+    # (cp1252) text, so characters outside it become '?' as on a real pool.
+    if value is None:
+        return None
+    if typ.upper() == "BIGINT":
+        return int.from_bytes(value, "big") if isinstance(value, bytes) else int(value)
+    kind, size = typ.upper().rstrip(")").split("(")
+    text = str(value)
+    if style == 23:
+        text = text[:10]
+    elif style == 121:
+        whole, fraction = _split_timestamp(text)
+        text = f"{whole}.{fraction.ljust(7, '0')}" if fraction else f"{whole}.0000000"
+    if kind == "VARCHAR":
+        text = text.encode("cp1252", errors="replace").decode("cp1252")
+    return text if size == "MAX" else text[: int(size)]
+
+
+def _datetime2(value: Any, precision: int) -> Optional[str]:
+    # CAST(x AS DATETIME2(p)) rounds to p fractional digits; the text keeps them.
+    if value is None:
+        return None
+    whole, fraction = _split_timestamp(value)
+    digits = (fraction + "0" * 7)[:7]
+    units = round(int(digits) / 10 ** (7 - precision))
+    if units == 10**precision:
+        # Rounded up into the next second.
+        stamp = datetime.datetime.fromisoformat(whole) + datetime.timedelta(seconds=1)
+        whole, units = stamp.isoformat(" "), 0
+    return f"{whole}.{units:0{precision}d}" if precision else whole
+
+
+def _date_format(value: Any, fmt: str) -> Optional[str]:
+    # Databricks date_format for the patterns the scripts use; .SSS truncates.
+    if value is None:
+        return None
+    whole, fraction = _split_timestamp(value)
+    text = fmt.replace("yyyy", whole[0:4]).replace("MM", whole[5:7]).replace("dd", whole[8:10])
+    text = text.replace("HH", whole[11:13] or "00").replace("mm", whole[14:16] or "00").replace("ss", whole[17:19] or "00")
+    return text.replace("SSS", (fraction + "000")[:3])
+
+
+def _hashbytes(algorithm: str, value: Any) -> Optional[bytes]:
+    if value is None:
+        return None
+    data = value if isinstance(value, bytes) else str(value).encode("utf-8")
+    return hashlib.new(algorithm.lower(), data).digest()
+
+
+def _md5(value: Any) -> Optional[str]:
+    return None if value is None else hashlib.md5(str(value).encode("utf-8")).hexdigest()
+
+
+def _conv(value: Any, from_base: int, to_base: int) -> Optional[str]:
+    if value is None:
+        return None
+    if to_base != 10:
+        raise ValueError(f"conv to base {to_base} is not emulated")
+    return str(int(str(value), int(from_base)))
+
+
+def _concat_ws(sep: str, *values: Any) -> str:
+    return sep.join(str(v) for v in values if v is not None)
+
+
+SCALAR_FUNCTIONS = {
+    "CONVERT": (-1, _convert),
+    "UTF8_VARCHAR": (1, lambda v: None if v is None else str(v)),
+    "DATETIME2": (2, _datetime2),
+    "LEFT_TEXT": (2, lambda v, n: None if v is None else str(v)[: int(n)]),
+    "HASHBYTES": (2, _hashbytes),
+    "md5": (1, _md5),
+    "conv": (3, _conv),
+    "concat_ws": (-1, _concat_ws),
+    "date_format": (2, _date_format),
+}
+
+
+class Connection:
+    def __init__(self, engine: str, path: Path):
+        if not path.exists():
+            raise RuntimeError(f"No local {engine} database at {path}")
+        self.engine = engine
+        self.latency = _setting(engine, "LATENCY_MS") / 1000
+        self.rows_per_sec = _setting(engine, "ROWS_PER_SEC")
+        self.error = _driver_error(engine)
+        # Pooled connections are created and used on different threads; autocommit like the warehouses.
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.create_aggregate("approx_count_distinct", -1, _DistinctCount)
+        for name, (n_args, fn) in SCALAR_FUNCTIONS.items():
+            self._db.create_function(name, n_args, fn, deterministic=True)
+        rows = self._db.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')").fetchall()
+        self._names = {n.lower() for (n,) in rows if "." in n}
+
+    def translate(self, sql: str) -> str:
+        # Staging tables created by the scripts get dotted names too.
+        created = CREATE_RE.match(sql)
+        if created:
+            self._names.add(created.group(1).lower())
+
+        def sub(m: re.Match) -> str:
+            name = m.group(1)
+            return quote(name) if name.lower() in self._names else name
+
+        if self.engine == "databricks":
+            if "\\" in sql:
+                sql = SPARK_STRING_RE.sub(_standard_string, sql)
+            sql = SPARK_INF_RE.sub(r"\g<1>9e999", sql)
+        values = VALUES_RE.match(sql)
+        if values:
+            return f"INSERT INTO {NAME_RE.sub(sub, values.group(1))} VALUES {sql[values.end():]}"
+        sql = NAME_RE.sub(sub, sql)
+        for pattern, repl in REWRITES:
+            sql = pattern.sub(repl, sql)
+        if re.search(r"\bGROUPING\s+SETS\b|\bROLLUP\s*\(", sql, re.I):
+            sql = expand_grouping(sql)
+        return sql
+
+    def cursor(self) -> "Cursor":
+        return Cursor(self)
+
+    def close(self) -> None:
+        self._db.close()
+
+    def __enter__(self) -> "Connection":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class Cursor:
+    # pyodbc-style fetchmany plus Databricks-style fetchmany_arrow.
+    def __init__(self, con: Connection):
+        self.con = con
+        self.arraysize = 1
+        self.description: Optional[List[Tuple[Any, ...]]] = None
+        self._cur = con._db.cursor()
+
+    def execute(self, sql: str) -> "Cursor":
+        if self.con.latency:
+            time.sleep(self.con.latency)
+        try:
+            self._cur.execute(self.con.translate(sql))
+        except sqlite3.Error as e:
+            raise self.con.error(f"[{self.con.engine}] {e}") from e
+        # SQLite reports no column types; the fetch helpers infer them from values.
+        desc = self._cur.description or []
+        self.description = [(d[0], None, None, None, None, None, None) for d in desc]
+        return self
+
+    def _throttle(self, rows: List[tuple]) -> List[tuple]:
+        if rows and self.con.rows_per_sec:
+            time.sleep(len(rows) / self.con.rows_per_sec)
+        return rows
+
+    def fetchmany(self, size: Optional[int] = None) -> List[tuple]:
+        return self._throttle(self._cur.fetchmany(size or self.arraysize))
+
+    def fetchall(self) -> List[tuple]:
+        return self._throttle(self._cur.fetchall())
+
+    def fetchmany_arrow(self, size: int) -> pa.Table:
+        names = [d[0] for d in self.description or []]
+        rows = self.fetchmany(size)
+        if not rows:
+            return pa.table({n: pa.array([], type=pa.null()) for n in names})
+        return pa.table({n: pa.array(v) for n, v in zip(names, zip(*rows))})
+
+    def close(self) -> None:
+        self._cur.close()
+
+    def __enter__(self) -> "Cursor":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
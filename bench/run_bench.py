@@ -0,0 +1,253 @@
+﻿import argparse
+import datetime
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import asdict
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from _measure import peak_rss_mb
+from _synth import SynthSpec, generate
+
+HERE = Path(__file__).resolve().parent
+DDR = HERE.parent / "ddr-compare"
+LAKE = HERE.parent / "lake-compare"
+SERVICE = HERE.parent / "service"
+CLI = HERE.parent / "compare_cli.py"
+# ddr-queue: worker processes, each with --parallel / QUEUE_WORKERS tables in flight.
+QUEUE_WORKERS = 2
+PHASES = ["generate", "ddr-sequential", "ddr-parallel", "ddr-queue", "ddr-watch", "lake-inventory", "lake-mapping", "lake-metrics", "lake-stream", "lake-profile", "lake-server-diff", "lake-grains", "service", "startup"]
+
+
+def git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def queue_dir(args: argparse.Namespace) -> Path:
+    return Path(args.work_dir).resolve() / "queue"
+
+
+def phase_commands(tables: List[str], args: argparse.Namespace) -> Dict[str, List[List[str]]]:
+    # Full scans only: metadata and result-cache shortcuts would hide the fetch and merge cost.
+    ddr = [str(DDR / "compare_many_tables_by_dateid.py"), *[a for t in tables for a in ("--synapse-table", t)], "--force-scan", "--no-cache"]
+    lake = [str(LAKE / "compare.py"), "--synapse", tables[0], "--key", "DateID", "--key", "CustomerID", "--metric", "sum:Amount", "--force-scan", "--no-cache"]
+    return {
+        "ddr-sequential": [ddr],
+        "ddr-parallel": [[*ddr, "--parallel", str(args.parallel)]],
+        # The coordinator only enqueues, waits and merges; queue_workers() does the work.
+        "ddr-queue": [[*ddr, "--queue", str(queue_dir(args)), "--no-work"]],
+        # Two watch polls with nothing loaded in between (the first only records the baseline): the
+        # cost of a poll, against a full ddr-sequential sweep.
+        "ddr-watch": [[*ddr, "--once", "--reset-watch", "--no-initial-sweep"], [*ddr, "--once"]],
+        "lake-inventory": [[str(LAKE / "inventory_synapse.py")], [str(LAKE / "inventory_databricks.py")]],
+        "lake-mapping": [[str(LAKE / "build_mapping.py")]],
+        "lake-metrics": [lake],
+        "lake-stream": [[*lake, "--mode", "stream", "--batch-rows", str(args.batch_rows)]],
+        "lake-server-diff": [[*lake, "--mode", "server-diff", "--staging-schema", "main.scratch"]],
+        "lake-profile": [[str(LAKE / "compare.py"), "--synapse", tables[0], "--key", "DateID", "--mode", "profile", "--no-cache"]],
+        "lake-grains": [[*lake, "--grain", "DateID", "--grain", "total"]],
+        # The same CLIs again, submitted to a running compare service.
+        "service": [ddr, lake],
+        # Startup cost alone: the unified CLI's help and dry runs never connect.
+        "startup": [
+            [str(CLI), "--help"],
+            [str(CLI), "ddr", "--dry-run", "--synapse-table", tables[0]],
+            [str(CLI), "compare", "--dry-run", *lake[1:]],
+        ],
+    }
+
+
+def child_env(work: Path, args: argparse.Namespace) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update({
+        "COMPARE_BACKEND": "localdb",
+        "LOCALDB_PATH": str(work / "db"),
+        "DDR_COMPARE_OUT_DIR": str(work / "ddr"),
+        "LAKE_COMPARE_OUT_DIR": str(work / "lake"),
+        # Only the service phase starts a service; the other phases find no file and run locally.
+        "COMPARE_SERVICE_FILE": str(work / "service.json"),
+        "PYTHONPATH": os.pathsep.join(p for p in [str(HERE), os.environ.get("PYTHONPATH")] if p),
+    })
+    if args.latency_ms:
+        env["LOCALDB_LATENCY_MS"] = str(args.latency_ms)
+    if args.rows_per_sec:
+        env["LOCALDB_ROWS_PER_SEC"] = str(args.rows_per_sec)
+    if args.connect_ms:
+        env["LOCALDB_CONNECT_MS"] = str(args.connect_ms)
+    return env
+
+
+def run_phase(name: str, commands: List[List[str]], env: Dict[str, str], work: Path) -> Dict[str, Any]:
+    log = work / "logs" / f"{name}.log"
+    log.parent.mkdir(parents=True, exist_ok=True)
+    result = work / "logs" / f"{name}.json"
+    record: Dict[str, Any] = {"phase": name, "seconds": 0.0, "peak_rss_mb": None, "exit_code": 0}
+    with log.open("w", encoding="utf-8") as f:
+        for cmd in commands:
+            result.unlink(missing_ok=True)
+            started = time.perf_counter()
+            proc = subprocess.run([sys.executable, str(HERE / "_measure.py"), str(result), *cmd], env=env, stdout=f, stderr=subprocess.STDOUT)
+            record["seconds"] += time.perf_counter() - started
+            measured = json.loads(result.read_text(encoding="utf-8")) if result.exists() else {}
+            peak = measured.get("peak_rss_mb")
+            if peak is not None:
+                record["peak_rss_mb"] = max(record["peak_rss_mb"] or 0.0, peak)
+            if proc.returncode:
+                record["exit_code"] = proc.returncode
+                break
+    record["seconds"] = round(record["seconds"], 3)
+    return record
+
+
+@contextmanager
+def running_service(env: Dict[str, str], work: Path) -> Iterator[None]:
+    # Starts service/compare_service.py for the phase's commands to submit to.
+    # Its startup (importing both tools, opening warm sessions) is not timed.
+    path = Path(env["COMPARE_SERVICE_FILE"])
+    path.unlink(missing_ok=True)
+    log_path = work / "logs" / "service-daemon.log"
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    with log_path.open("w", encoding="utf-8") as log:
+        proc = subprocess.Popen([sys.executable, str(SERVICE / "compare_service.py"), "start"], env=env, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            deadline = time.monotonic() + 120
+            while not path.exists():
+                if proc.poll() is not None or time.monotonic() > deadline:
+                    raise SystemExit(f"Compare service did not start (see {log_path})")
+                time.sleep(0.1)
+            yield
+        finally:
+            subprocess.run([sys.executable, str(SERVICE / "compare_service.py"), "stop"], env=env, capture_output=True)
+            try:
+                proc.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+
+
+@contextmanager
+def queue_workers(env: Dict[str, str], work: Path, args: argparse.Namespace) -> Iterator[None]:
+    # Worker processes for the ddr-queue phase; they wait for the coordinator's
+    # queue and exit once it is done. Their startup is not timed.
+    queue = queue_dir(args)
+    shutil.rmtree(queue, ignore_errors=True)
+    per_worker = str(max(1, args.parallel // QUEUE_WORKERS))
+    cmd = [sys.executable, str(DDR / "compare_many_tables_by_dateid.py"), "--queue", str(queue), "--worker", "--parallel", per_worker]
+    log_path = work / "logs" / "ddr-queue-workers.log"
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    with log_path.open("w", encoding="utf-8") as log:
+        procs = [subprocess.Popen(cmd, env=env, stdout=log, stderr=subprocess.STDOUT) for _ in range(QUEUE_WORKERS)]
+        try:
+            yield
+        finally:
+            for proc in procs:
+                try:
+                    proc.wait(timeout=60)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+                    proc.wait()
+
+
+def previous_run(results: Path, key: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    # Latest earlier successful phases with the same data shape and engine throttling.
+    if not results.exists():
+        return {}
+    runs: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    for line in results.read_text(encoding="utf-8").splitlines():
+        r = json.loads(line)
+        r.setdefault("connect_ms", 0.0)  # recorded before --connect-ms existed
+        if r.get("exit_code") == 0 and all(r.get(k) == v for k, v in key.items()):
+            runs.setdefault(r["run"], {})[r["phase"]] = r
+    return runs[max(runs)] if runs else {}
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--work-dir", default="bench_out", help="Databases, compare outputs and logs")
+    ap.add_argument("--results", help="JSONL history (default: <work-dir>/bench_results.jsonl)")
+    ap.add_argument("--phase", action="append", choices=PHASES, help="Repeatable; default: all")
+    ap.add_argument("--reuse-data", action="store_true", help="Skip generation when the data spec is unchanged")
+    ap.add_argument("--rows", type=int, default=SynthSpec.rows, help="Rows per fact table")
+    ap.add_argument("--tables", type=int, default=SynthSpec.tables, help="Number of fact tables")
+    ap.add_argument("--dateids", type=int, default=SynthSpec.dateids, help="Distinct DateIDs per fact")
+    ap.add_argument("--skew", type=float, default=SynthSpec.skew, help="Zipf exponent for the DateID distribution (0 = uniform)")
+    ap.add_argument("--missing-rate", type=float, default=SynthSpec.missing_rate, help="Fraction of rows left out of the Databricks copy")
+    ap.add_argument("--objects", type=int, default=SynthSpec.objects, help="Extra inventory objects for the mapping phase")
+    ap.add_argument("--seed", type=int, default=SynthSpec.seed)
+    ap.add_argument("--renamed-rate", type=float, default=SynthSpec.renamed_rate, help="Fraction of inventory objects renamed so only column signatures can pair them")
+    ap.add_argument("--latency-ms", type=float, default=0.0, help="Per-statement delay added by the local engines")
+    ap.add_argument("--rows-per-sec", type=float, default=0.0, help="Fetch throughput cap of the local engines (0 = none)")
+    ap.add_argument("--connect-ms", type=float, default=0.0, help="Delay per new connection, standing in for login and session setup")
+    ap.add_argument("--parallel", type=int, default=4, help="ddr-parallel: tables in flight")
+    ap.add_argument("--batch-rows", type=int, default=100_000, help="lake-stream: rows fetched per batch")
+    args = ap.parse_args()
+
+    spec = SynthSpec(args.rows, args.tables, args.dateids, args.skew, args.missing_rate, args.objects, args.seed, args.renamed_rate)
+    work = Path(args.work_dir).resolve()
+    work.mkdir(parents=True, exist_ok=True)
+    results = Path(args.results) if args.results else work / "bench_results.jsonl"
+    phases = args.phase or PHASES
+
+    key = {"spec": asdict(spec), "latency_ms": args.latency_ms, "rows_per_sec": args.rows_per_sec, "connect_ms": args.connect_ms}
+    previous = previous_run(results, key)
+    run = {"run": datetime.datetime.now().isoformat(timespec="seconds"), "commit": git_commit(), **key}
+
+    spec_path = work / "db" / "spec.json"
+    records = []
+    if "generate" in phases and not (args.reuse_data and spec_path.exists() and json.loads(spec_path.read_text(encoding="utf-8")) == asdict(spec)):
+        started = time.perf_counter()
+        info = generate(work / "db", spec)
+        # Object lists cached from the previous data would hide the new names.
+        for out in ("ddr", "lake"):
+            (work / out / "catalog_cache.sqlite").unlink(missing_ok=True)
+        spec_path.write_text(json.dumps(asdict(spec)), encoding="utf-8")
+        (work / "db" / "tables.json").write_text(json.dumps(info), encoding="utf-8")
+        records.append({"phase": "generate", "seconds": round(time.perf_counter() - started, 3), "peak_rss_mb": peak_rss_mb(), "exit_code": 0})
+        print(f"Generated {info['rows']} rows in {spec.tables} tables ({info['missing_in_databricks']} missing in Databricks)")
+
+    tables_path = work / "db" / "tables.json"
+    if not tables_path.exists():
+        raise SystemExit("No generated data. Run with the generate phase first.")
+    tables = json.loads(tables_path.read_text(encoding="utf-8"))["synapse_tables"]
+
+    env = child_env(work, args)
+    commands = phase_commands(tables, args)
+    for name in PHASES:
+        if name in phases and name == "service":
+            with running_service(env, work):
+                records.append(run_phase(name, commands[name], env, work))
+        elif name in phases and name == "ddr-queue":
+            with queue_workers(env, work, args):
+                records.append(run_phase(name, commands[name], env, work))
+        elif name in phases and name in commands:
+            records.append(run_phase(name, commands[name], env, work))
+            r = records[-1]
+            print(f"{name}: {r['seconds']:.2f}s" + ("" if r["exit_code"] == 0 else f" FAILED (see {work / 'logs' / name}.log)"))
+
+    with results.open("a", encoding="utf-8") as f:
+        for r in records:
+            f.write(json.dumps({**run, **r}) + "\n")
+
+    print()
+    print(f"{'phase':<16}{'seconds':>10}{'peak MB':>10}{'previous':>10}{'change':>9}")
+    for r in records:
+        prev = previous.get(r["phase"])
+        prev_s = f"{prev['seconds']:.2f}" if prev else "-"
+        change = f"{(r['seconds'] / prev['seconds'] - 1) * 100:+.0f}%" if prev and prev["seconds"] else "-"
+        peak = f"{r['peak_rss_mb']:.0f}" if r["peak_rss_mb"] is not None else "-"
+        print(f"{r['phase']:<16}{r['seconds']:>10.2f}{peak:>10}{prev_s:>10}{change:>9}")
+    print("Wrote:", results)
+    return 1 if any(r["exit_code"] for r in records) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
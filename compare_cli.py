@@ -0,0 +1,62 @@
+﻿import argparse
+import importlib
+import sys
+from pathlib import Path
+from typing import List
+
+# One entry point for every tool. Only this file and ../shared/_base.py (stdlib
+# only) load up front: a subcommand imports its script, and with it pandas,
+# once it is chosen, and the drivers load on the first connection it opens.
+ROOT = Path(__file__).resolve().parent
+sys.path.insert(0, str(ROOT / "shared"))
+import _base
+
+# subcommand -> (tool folder, scripts it runs in order, compare-service tool or None, help)
+COMMANDS = {
+    "inventory": ("lake-compare", ["inventory_synapse", "inventory_databricks"], "lake", "List Synapse and Databricks objects into the catalog cache and results store"),
+    "map": ("lake-compare", ["build_mapping"], "lake", "Match Synapse objects to Databricks ones (mapping.json)"),
+    "compare": ("lake-compare", ["compare"], "lake", "Compare one mapped table: metrics, grains, hash-diff, stream, profile, server-diff"),
+    "ddr": ("ddr-compare", ["compare_many_tables_by_dateid"], "ddr", "Per-DateID row counts for many tables"),
+    "ddr-table": ("ddr-compare", ["compare_table_by_dateid"], "ddr", "Per-DateID row counts for one table"),
+    "results": ("ddr-compare", ["query_results"], None, "Query the results store"),
+    "service": ("service", ["compare_service"], None, "Start, inspect or stop the resident compare service"),
+}
+INVENTORY_ENGINES = {"synapse": "inventory_synapse", "databricks": "inventory_databricks"}
+
+
+def run_script(command: str, folder: str, script: str, tool: str, argv: List[str]) -> int:
+    sys.argv = [f"{Path(sys.argv[0]).name} {command}", *argv]
+    if tool is not None:
+        # A running compare service takes the job before any tool module is imported here.
+        code = _base.submit_to_service(tool, script, argv)
+        if code is not None:
+            return code
+    if str(ROOT / folder) not in sys.path:
+        sys.path.insert(0, str(ROOT / folder))
+    return importlib.import_module(script).main() or 0
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(
+        description="Synapse -> Databricks compare tools. `<command> --help` shows a command's own options.",
+        epilog="commands:\n" + "\n".join(f"  {name:<11}{c[3]}" for name, c in COMMANDS.items())
+        + "\n\ninventory takes an optional engine first: inventory [synapse|databricks] [options]",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    ap.add_argument("command", choices=COMMANDS, metavar="command")
+    ap.add_argument("args", nargs=argparse.REMAINDER, help="options for the command")
+    args = ap.parse_args()
+
+    folder, scripts, tool, _ = COMMANDS[args.command]
+    argv = args.args
+    if args.command == "inventory" and argv and argv[0] in INVENTORY_ENGINES:
+        scripts, argv = [INVENTORY_ENGINES[argv[0]]], argv[1:]
+    for script in scripts:
+        code = run_script(args.command, folder, script, tool, argv)
+        if code:
+            return code
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
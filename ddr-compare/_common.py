@@ -1,121 +1,405 @@
-﻿import os
+﻿from __future__ import annotations
+
+import json
+import os
 import re
+import sqlite3
+import sys
+from contextlib import contextmanager
 from dataclasses import dataclass
+from functools import partial
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Iterator, Optional
 
-import pandas as pd
-import pyodbc
-from databricks import sql as dbsql
-
+# Connections, tracing, fetches, caches and the results store are shared with
+# lake-compare (../shared); what follows is ddr-compare's own per-DateID logic.
+SHARED = Path(__file__).resolve().parent.parent / 'shared'
+if str(SHARED) not in sys.path:
+    sys.path.insert(0, str(SHARED))
 
-def require_env(name: str) -> str:
-    v = os.getenv(name)
-    if not v:
-        raise RuntimeError(f"Missing env var: {name}")
-    return v
+import _base
+from _base import (
+    ConnectionPool,
+    add_dry_run_args,
+    add_trace_args,
+    catalog_cache_path,
+    databricks_connect,
+    query_errors,
+    require_env,
+    safe_filename,
+    show_sql,
+    span,
+    synapse_connect,
+    trace_run,
+)
+from _catalog import CatalogCache
+from _query import (
+    MONITORING_TABLE,
+    ChunkRunner,
+    ResultCache,
+    databricks_catalog_source,
+    databricks_changes,
+    databricks_changes_sql,
+    databricks_metadata_rowcount,
+    databricks_metadata_rowcount_sql,
+    databricks_query,
+    databricks_table_version,
+    record_result,
+    results_run,
+    synapse_changes,
+    synapse_changes_sql,
+    synapse_metadata_rowcount,
+    synapse_query,
+    synapse_table_stats_sql,
+    synapse_table_version,
+    write_csv,
+)
+from _results import SCHEMAS, ResultsStore
+from _workqueue import WorkQueue, add_queue_args, apply_queue_options, process_tag, queue_options, run_worker
 
+if TYPE_CHECKING:
+    import pandas as pd
+    import pyodbc
+    from databricks import sql as dbsql
 
-def synapse_connect() -> pyodbc.Connection:
-    server = require_env('SYNAPSE_SERVER')
-    db = require_env('SYNAPSE_DB')
-    uid = os.getenv('SYNAPSE_UID', '')
 
-    # Matches SSMS: Azure Active Directory ג€“ Universal with MFA
-    conn_str = (
-        'Driver={ODBC Driver 18 for SQL Server};'
-        f'Server=tcp:{server},1433;'
-        f'Database={db};'
-        'Encrypt=yes;TrustServerCertificate=no;'
-        'Connection Timeout=30;'
-        'Authentication=ActiveDirectoryInteractive;'
-        + (f'UID={uid};' if uid else '')
-    )
-    return pyodbc.connect(conn_str)
+SERVICE_TOOL = 'ddr'
 
 
-def databricks_connect() -> dbsql.Connection:
-    host = require_env('DATABRICKS_SERVER_HOSTNAME')
-    http_path = require_env('DATABRICKS_HTTP_PATH')
-    auth_type = os.getenv('DATABRICKS_AUTH_TYPE', 'azure-cli')
-    return dbsql.connect(server_hostname=host, http_path=http_path, auth_type=auth_type)
+def run_cli(main: Callable[[], Optional[int]]) -> int:
+    return _base.run_cli(main, SERVICE_TOOL)
 
 
 def out_dir() -> str:
     return require_env('DDR_COMPARE_OUT_DIR')
 
 
-def safe_filename(s: str) -> str:
-    return re.sub(r'[^A-Za-z0-9_]+', '_', s)
+def result_cache(enabled: bool = True, refresh: bool = False) -> Optional[ResultCache]:
+    if not enabled:
+        return None
+    max_mb = int(os.getenv('DDR_COMPARE_CACHE_MAX_MB', '1024'))
+    return ResultCache(Path(out_dir()) / 'result_cache', max_mb * 1024 * 1024, refresh)
+
+
+def add_cache_args(ap) -> None:
+    ap.add_argument('--no-cache', action='store_true', help='Do not read or write the query result cache')
+    ap.add_argument('--refresh', action='store_true', help='Re-run queries and overwrite cached results')
+
+
+def dateid_filter(min_dateid: Optional[int], max_dateid: Optional[int] = None) -> str:
+    conds = []
+    if min_dateid is not None:
+        conds.append(f"DateID >= {int(min_dateid)}")
+    if max_dateid is not None:
+        conds.append(f"DateID <= {int(max_dateid)}")
+    return f" WHERE {' AND '.join(conds)}" if conds else ''
+
+
+def counts_sql(table: str, min_dateid: Optional[int] = None, max_dateid: Optional[int] = None) -> str:
+    return f"SELECT DateID, COUNT(*) AS cnt FROM {table}{dateid_filter(min_dateid, max_dateid)} GROUP BY DateID"
 
 
-def synapse_counts_by_dateid(con: pyodbc.Connection, table_2part: str) -> pd.DataFrame:
-    q = f"SELECT DateID, COUNT(*) AS cnt FROM {table_2part} GROUP BY DateID"
-    df = pd.read_sql(q, con)
+def synapse_counts_by_dateid(
+    con: pyodbc.Connection,
+    table_2part: str,
+    min_dateid: Optional[int] = None,
+    result_cache: Optional[ResultCache] = None,
+) -> pd.DataFrame:
+    q = counts_sql(table_2part, min_dateid)
+    if result_cache is None:
+        df = synapse_query(con, q)
+    else:
+        # DDR_COMPARE_SYNAPSE_VERSION_SQL: optional load-audit query refining the version token.
+        version = synapse_table_version(con, table_2part, os.getenv('DDR_COMPARE_SYNAPSE_VERSION_SQL'))
+        df = result_cache.fetch(q, version, lambda: synapse_query(con, q))
     df['DateID'] = df['DateID'].astype('int64')
     df['cnt'] = df['cnt'].astype('int64')
     return df
 
 
-def databricks_counts_by_dateid(con: dbsql.Connection, table_3part: str) -> pd.DataFrame:
-    q = f"SELECT DateID, COUNT(*) AS cnt FROM {table_3part} GROUP BY DateID"
-    with con.cursor() as cur:
-        cur.execute(q)
-        rows = cur.fetchall()
-        cols = [d[0] for d in cur.description]
-    df = pd.DataFrame.from_records(rows, columns=cols)
+def databricks_counts_by_dateid(
+    con: dbsql.Connection,
+    table_3part: str,
+    min_dateid: Optional[int] = None,
+    result_cache: Optional[ResultCache] = None,
+) -> pd.DataFrame:
+    q = counts_sql(table_3part, min_dateid)
+    if result_cache is None:
+        df = databricks_query(con, q)
+    else:
+        df = result_cache.fetch(q, databricks_table_version(con, table_3part), lambda: databricks_query(con, q))
     df['DateID'] = df['DateID'].astype('int64')
     df['cnt'] = df['cnt'].astype('int64')
     return df
 
 
-def merge_counts(syn_df: pd.DataFrame, dbx_df: pd.DataFrame) -> pd.DataFrame:
-    merged = syn_df.merge(dbx_df, on='DateID', how='outer', suffixes=('_synapse', '_databricks'))
-    merged['cnt_synapse'] = merged['cnt_synapse'].fillna(0).astype('int64')
-    merged['cnt_databricks'] = merged['cnt_databricks'].fillna(0).astype('int64')
-    merged['diff'] = merged['cnt_databricks'] - merged['cnt_synapse']
-    return merged.sort_values('DateID')
-
-
-def load_monitoring_tables(con: dbsql.Connection) -> pd.DataFrame:
-    with con.cursor() as cur:
-        cur.execute('SELECT * FROM main.monitoring.tables')
-        cols = [d[0] for d in cur.description]
-        rows = cur.fetchall()
-    raw = pd.DataFrame.from_records(rows, columns=cols)
-
-    lower = {c.lower(): c for c in raw.columns}
-    def pick(*names):
-        for n in names:
-            if n in lower:
-                return lower[n]
+def change_tokens(syn_con: pyodbc.Connection, dbx_con: dbsql.Connection, pairs: list[tuple[str, str]]) -> dict[str, Optional[str]]:
+    # One token per Synapse table covering both sides, from one metadata query per
+    # engine; None when neither side has a change indicator.
+    # DDR_COMPARE_SYNAPSE_WATCH_SQL: optional load-audit query returning schema, name and loaded for every table.
+    with span('changes', engine='synapse'):
+        syn = synapse_changes(syn_con, [s for s, _ in pairs], os.getenv('DDR_COMPARE_SYNAPSE_WATCH_SQL'))
+    with span('changes', engine='databricks'):
+        dbx = databricks_changes(dbx_con, [d for _, d in pairs])
+    return {s: None if syn[s] is None and dbx[d] is None else f'{syn[s]}|{dbx[d]}' for s, d in pairs}
+
+
+def metadata_equal(syn_total: Optional[int], dbx_total: Optional[int]) -> bool:
+    return syn_total is not None and dbx_total is not None and syn_total == dbx_total
+
+
+def batch_counts_sql(tables: list[str]) -> str:
+    return '\nUNION ALL\n'.join(
+        f'SELECT {i} AS tbl, DateID, COUNT(*) AS cnt FROM {t} GROUP BY DateID' for i, t in enumerate(tables)
+    )
+
+
+def split_batch_counts(df: pd.DataFrame, tables: list[str]) -> dict[str, pd.DataFrame]:
+    out = {}
+    for i, t in enumerate(tables):
+        part = df[df['tbl'] == i][['DateID', 'cnt']].reset_index(drop=True)
+        out[t] = part.astype('int64')
+    return out
+
+
+def synapse_counts_batch(con: pyodbc.Connection, tables: list[str]) -> dict[str, pd.DataFrame]:
+    return split_batch_counts(synapse_query(con, batch_counts_sql(tables)), tables)
+
+
+def databricks_counts_batch(con: dbsql.Connection, tables: list[str]) -> dict[str, pd.DataFrame]:
+    return split_batch_counts(databricks_query(con, batch_counts_sql(tables)), tables)
+
+
+def plan_batches(sizes: dict[str, int], max_rows: int, max_tables: int) -> list[list[str]]:
+    # First-fit decreasing: largest tables first, each into the first batch that
+    # still has room for its rows and a table slot.
+    batches: list[tuple[int, list[str]]] = []
+    for t in sorted(sizes, key=lambda t: (-sizes[t], t)):
+        for i, (rows, members) in enumerate(batches):
+            if rows + sizes[t] <= max_rows and len(members) < max_tables:
+                batches[i] = (rows + sizes[t], members + [t])
+                break
+        else:
+            batches.append((sizes[t], [t]))
+    return [members for _, members in batches]
+
+
+class CountCache:
+    # Per-side, per-table, per-DateID counts persisted in SQLite under the output
+    # dir. Each call opens its own sqlite3 connection so it is safe from threads.
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with self._connect() as db:
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS dateid_counts ('
+                ' side TEXT NOT NULL, table_name TEXT NOT NULL, DateID INTEGER NOT NULL, cnt INTEGER NOT NULL,'
+                ' PRIMARY KEY (side, table_name, DateID))'
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=60)
+
+    def load(self, side: str, table: str) -> pd.DataFrame:
+        import pandas as pd
+
+        with self._connect() as db:
+            rows = db.execute(
+                'SELECT DateID, cnt FROM dateid_counts WHERE side = ? AND table_name = ? ORDER BY DateID',
+                (side, table.lower()),
+            ).fetchall()
+        return pd.DataFrame.from_records(rows, columns=['DateID', 'cnt']).astype('int64')
+
+    def store(self, side: str, table: str, df: pd.DataFrame, min_dateid: Optional[int] = None) -> None:
+        # Replaces everything from min_dateid on, so DateIDs that vanished at the
+        # source are dropped from the cache too.
+        key = table.lower()
+        rows = [(side, key, int(d), int(c)) for d, c in zip(df['DateID'], df['cnt'])]
+        with self._connect() as db:
+            if min_dateid is None:
+                db.execute('DELETE FROM dateid_counts WHERE side = ? AND table_name = ?', (side, key))
+            else:
+                db.execute(
+                    'DELETE FROM dateid_counts WHERE side = ? AND table_name = ? AND DateID >= ?',
+                    (side, key, int(min_dateid)),
+                )
+            db.executemany('INSERT INTO dateid_counts (side, table_name, DateID, cnt) VALUES (?, ?, ?, ?)', rows)
+
+
+def incremental_start(cached: pd.DataFrame, lookback: int) -> Optional[int]:
+    # Re-query the last `lookback` cached DateIDs and anything newer (lookback=0
+    # only picks up DateIDs past the watermark). None means full scan.
+    if cached.empty:
         return None
+    dates = cached['DateID'].drop_duplicates().sort_values()
+    if lookback <= 0:
+        return int(dates.iloc[-1]) + 1
+    return int(dates.iloc[-min(lookback, len(dates))])
+
+
+def cached_counts_by_dateid(
+    con: Any,
+    table: str,
+    *,
+    side: str,
+    cache: CountCache,
+    lookback: int = 3,
+    since: Optional[int] = None,
+    result_cache: Optional[ResultCache] = None,
+) -> pd.DataFrame:
+    fetch = synapse_counts_by_dateid if side == 'synapse' else databricks_counts_by_dateid
+    cached = cache.load(side, table)
+    if since is None:
+        since = incremental_start(cached, lookback)
+
+    fresh = fetch(con, table, since, result_cache)
+    cache.store(side, table, fresh, since)
+    if since is None:
+        return fresh
+    import pandas as pd
+
+    return pd.concat([cached[cached['DateID'] < since], fresh], ignore_index=True)
 
-    c_catalog = pick('catalog', 'table_catalog')
-    c_schema = pick('schema', 'table_schema', 'database', 'table_database')
-    c_name = pick('name', 'table_name')
 
-    df = pd.DataFrame()
-    df['catalog'] = raw[c_catalog] if c_catalog else 'main'
-    df['schema'] = raw[c_schema] if c_schema else None
-    df['name'] = raw[c_name] if c_name else None
-    df['fqn'] = df['catalog'].astype(str) + '.' + df['schema'].astype(str) + '.' + df['name'].astype(str)
+@dataclass
+class Chunking:
+    rows: int
+    workers: int
+    syn_pool: ConnectionPool
+    dbx_pool: ConnectionPool
+    checkpoints: Path
+    retries: int = 3
+
+
+@contextmanager
+def chunking(args, out: Path) -> Iterator[Optional[Chunking]]:
+    if not args.chunk_rows:
+        yield None
+        return
+    with ConnectionPool(synapse_connect, args.chunk_workers) as syn_pool, \
+            ConnectionPool(databricks_connect, args.chunk_workers) as dbx_pool:
+        yield Chunking(args.chunk_rows, args.chunk_workers, syn_pool, dbx_pool, out / 'checkpoints', args.chunk_retries)
+
+
+def add_chunk_args(ap) -> None:
+    ap.add_argument('--chunk-rows', type=int, default=0, help='Split scans into DateID ranges of about this many rows (0 = off)')
+    ap.add_argument('--chunk-workers', type=int, default=4, help='Chunks: concurrent range queries per engine')
+    ap.add_argument('--chunk-retries', type=int, default=3, help='Chunks: retries per range before it is split in half')
+
+
+def chunked_counts_by_dateid(con: Any, table: str, *, side: str, chunks: Chunking) -> pd.DataFrame:
+    import pandas as pd
+
+    # Same result as a full scan for non-NULL DateIDs: per-range GROUP BYs do not overlap.
+    synapse = side == 'synapse'
+    query = synapse_query if synapse else databricks_query
+    bounds = query(con, f'SELECT MIN(DateID) AS lo, MAX(DateID) AS hi FROM {table}')
+    if bounds.empty or pd.isna(bounds.iloc[0, 0]):
+        return pd.DataFrame({'DateID': pd.Series(dtype='int64'), 'cnt': pd.Series(dtype='int64')})
+    lo, hi = int(bounds.iloc[0, 0]), int(bounds.iloc[0, 1])
+
+    rows = (synapse_metadata_rowcount if synapse else databricks_metadata_rowcount)(con, table)
+    if rows is None:
+        rows = int(query(con, f"SELECT {'COUNT_BIG(*)' if synapse else 'COUNT(*)'} AS cnt FROM {table}").iloc[0, 0])
+    n = max(1, -(-rows // chunks.rows))
+
+    runner = ChunkRunner(
+        chunks.syn_pool if synapse else chunks.dbx_pool,
+        chunks.checkpoints / f'{side}_{safe_filename(table)}',
+        chunks.workers,
+        chunks.retries,
+    )
+    ranges = runner.plan(lo, hi, n)
+    print(f'{table}: {rows} rows in DateID [{lo}, {hi}] -> {len(ranges)} ranges')
+    df = runner.run(ranges, lambda c, a, b: query(c, counts_sql(table, a, b)))
+    df = df.sort_values('DateID', ignore_index=True)
+    df['DateID'] = df['DateID'].astype('int64')
+    df['cnt'] = df['cnt'].astype('int64')
     return df
 
 
-def best_match_databricks_fqn(monitor_df: pd.DataFrame, synapse_table_2part: str) -> str:
+def count_functions(
+    incremental: bool,
+    lookback: int = 3,
+    since: Optional[int] = None,
+    result_cache: Optional[ResultCache] = None,
+    chunks: Optional[Chunking] = None,
+) -> tuple[Callable, Callable]:
+    # (synapse, databricks) count functions, both called as fn(con, table).
+    if chunks is not None and not incremental:
+        return (
+            partial(chunked_counts_by_dateid, side='synapse', chunks=chunks),
+            partial(chunked_counts_by_dateid, side='databricks', chunks=chunks),
+        )
+    if not incremental:
+        return (
+            partial(synapse_counts_by_dateid, result_cache=result_cache),
+            partial(databricks_counts_by_dateid, result_cache=result_cache),
+        )
+    cache = CountCache(Path(out_dir()) / 'dateid_counts.sqlite')
+    opts = dict(cache=cache, lookback=lookback, since=since, result_cache=result_cache)
+    return (
+        partial(cached_counts_by_dateid, side='synapse', **opts),
+        partial(cached_counts_by_dateid, side='databricks', **opts),
+    )
+
+
+def add_incremental_args(ap) -> None:
+    ap.add_argument('--incremental', action='store_true', help='Re-query only recent DateIDs and merge with cached counts')
+    ap.add_argument('--lookback', type=int, default=3, help='Incremental: re-query the last N cached DateIDs (default 3)')
+    ap.add_argument('--since', type=int, help='Incremental: re-query DateID >= this value instead of using --lookback')
+
+
+def merge_counts(syn_df: pd.DataFrame, dbx_df: pd.DataFrame) -> pd.DataFrame:
+    with span('merge') as s:
+        merged = syn_df.merge(dbx_df, on='DateID', how='outer', suffixes=('_synapse', '_databricks'))
+        merged['cnt_synapse'] = merged['cnt_synapse'].fillna(0).astype('int64')
+        merged['cnt_databricks'] = merged['cnt_databricks'].fillna(0).astype('int64')
+        merged['diff'] = merged['cnt_databricks'] - merged['cnt_synapse']
+        s['rows'] = len(merged)
+        return merged.sort_values('DateID')
+
+
+def results_dir() -> Path:
+    # Shared with lake-compare when both point COMPARE_RESULTS_DIR at one folder.
+    return Path(os.getenv('COMPARE_RESULTS_DIR') or Path(out_dir()) / 'results')
+
+
+def load_mapping_pairs(path: Path) -> dict[str, str]:
+    # lake-compare mapping.json -> {Synapse SCHEMA.TABLE: Databricks catalog.schema.name}
+    data = json.loads(Path(path).read_text(encoding='utf-8-sig'))
+    pairs = {}
+    for m in data.get('mappings', []):
+        s, d = m['synapse'], m['databricks']
+        pairs[f"{s.get('schema')}.{s.get('name')}"] = f"{d.get('catalog')}.{d.get('schema')}.{d.get('name')}"
+    return pairs
+
+
+def monitoring_catalog(con: dbsql.Connection, ttl_hours: float = 24.0, refresh: bool = False) -> CatalogCache:
+    cache = CatalogCache(catalog_cache_path(Path(out_dir())), ttl_hours)
+    with span('catalog', engine='databricks') as s:
+        s['refresh'] = cache.refresh('databricks', partial(databricks_catalog_source, con), force=refresh)
+    if s['refresh'] != 'cached':
+        print(f"Catalog cache: {s['refresh']} refresh, {cache.size('databricks')} Databricks objects")
+    return cache
+
+
+def add_catalog_args(ap) -> None:
+    ap.add_argument('--catalog-ttl-hours', type=float, default=24.0, help='Reuse the cached Databricks object list for this long')
+    ap.add_argument('--refresh-catalog', action='store_true', help='Re-read the full object list into the catalog cache')
+
+
+def best_match_databricks_fqn(catalog: CatalogCache, synapse_table_2part: str) -> str:
     # Heuristic: look for normalized Synapse table name substring in Databricks object name.
     syn_name = synapse_table_2part.split('.', 1)[1].lower()
-    target = re.sub(r'[^a-z0-9]+', '_', syn_name)
 
     # Prefer main.bi_db catalog+schema if present
-    cand = monitor_df[(monitor_df['catalog'] == 'main') & (monitor_df['schema'] == 'bi_db')].copy()
-    if cand.empty:
-        cand = monitor_df[monitor_df['catalog'] == 'main'].copy()
+    scope = ('main', 'bi_db') if catalog.exists('databricks', 'main', 'bi_db') else ('main', None)
 
-    hits = cand[cand['name'].fillna('').str.lower().str.contains(syn_name, na=False)]
-    if len(hits) >= 1:
-        # pick longest name
-        hits = hits.assign(nlen=hits['name'].fillna('').str.len()).sort_values('nlen', ascending=False)
-        return str(hits.iloc[0]['fqn'])
+    # pick longest name containing it
+    hit = catalog.longest_containing('databricks', syn_name, *scope)
+    if hit is not None:
+        return hit
 
     # fallback: return best token overlap
     def tokens(s: str) -> set[str]:
@@ -124,15 +408,74 @@ def best_match_databricks_fqn(monitor_df: pd.DataFrame, synapse_table_2part: str
     tset = tokens(syn_name)
     best = None
     best_score = -1.0
-    for _, r in cand.iterrows():
-        n = str(r.get('name') or '')
+    for n, fqn in catalog.names('databricks', *scope):
         if not n:
             continue
         score = len(tset & tokens(n)) / max(1, len(tset | tokens(n)))
         if score > best_score:
             best_score = score
-            best = r
+            best = fqn
 
     if best is None:
         raise RuntimeError(f"No Databricks match found for {synapse_table_2part}")
-    return str(best['fqn'])
+    return best
+
+
+def dry_run_pairs(tables: list[str], mapped: dict[str, str], ttl_hours: float) -> list[tuple[str, Optional[str]]]:
+    # Databricks names as a run would resolve them, from the mapping or the cached
+    # object list; a dry run never refreshes the catalog. None: only resolvable online.
+    path = catalog_cache_path(Path(out_dir()))
+    catalog = None
+    if not all(t in mapped for t in tables) and path.exists():
+        catalog = CatalogCache(path, ttl_hours)
+    pairs = []
+    for t in tables:
+        dbx = mapped.get(t)
+        if dbx is None and catalog is not None and catalog.size('databricks'):
+            try:
+                dbx = best_match_databricks_fqn(catalog, t)
+            except RuntimeError:
+                pass
+        pairs.append((t, dbx))
+    return pairs
+
+
+def dry_run_changes(pairs: list[tuple[str, Optional[str]]]) -> None:
+    # Watch mode's poll: one change query per engine for every watched table.
+    dbx_tables = [d.split('.') for _, d in pairs if d]
+    show_sql('synapse: change indicators (row count and modify date per table)', synapse_changes_sql(sorted({s.split('.', 1)[0] for s, _ in pairs})))
+    show_sql(
+        'databricks: change indicators (last Delta commit per table)',
+        databricks_changes_sql(sorted({p[0] for p in dbx_tables}), sorted({p[1] for p in dbx_tables})),
+    )
+    audit_sql = os.getenv('DDR_COMPARE_SYNAPSE_WATCH_SQL')
+    if audit_sql:
+        show_sql('synapse: load audit (DDR_COMPARE_SYNAPSE_WATCH_SQL)', audit_sql)
+
+
+def dry_run_table(syn_table: str, dbx_table: Optional[str], args) -> None:
+    # The statements comparing one table sends, as far as they are known without
+    # connecting: chunk ranges and --batch groups follow from live row counts.
+    print('Synapse:', syn_table)
+    print('Databricks:', dbx_table or f'(no offline match: resolved from {MONITORING_TABLE} at run time)')
+    print()
+    dbx_table = dbx_table or '<databricks table>'
+    if not args.force_scan or getattr(args, 'batch', False):
+        show_sql('synapse: metadata row count', synapse_table_stats_sql(syn_table))
+        show_sql('databricks: metadata row count (Delta tables only)', *databricks_metadata_rowcount_sql(dbx_table))
+
+    counts_path = Path(out_dir()) / 'dateid_counts.sqlite'
+    for side, table in (('synapse', syn_table), ('databricks', dbx_table)):
+        if args.incremental:
+            since = args.since
+            if since is None and counts_path.exists():
+                since = incremental_start(CountCache(counts_path).load(side, table), args.lookback)
+            scope = f'from DateID {since}, merged with the cached counts' if since is not None else 'nothing cached yet, full history'
+            show_sql(f'{side}: counts ({scope})', counts_sql(table, since))
+        elif args.chunk_rows:
+            show_sql(
+                f'{side}: DateID bounds; the counts then run per DateID range of ~{args.chunk_rows} rows',
+                f'SELECT MIN(DateID) AS lo, MAX(DateID) AS hi FROM {table}',
+            )
+        else:
+            show_sql(f'{side}: counts', counts_sql(table))
@@ -0,0 +1,138 @@
+﻿import datetime
+import heapq
+import sqlite3
+import statistics
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+ENGINES = ('synapse', 'databricks')
+
+
+class RunHistory:
+    # Per-table, per-engine count runtimes and row totals from earlier runs, in
+    # SQLite under the output dir. `mode` (full / incremental / chunked) keeps
+    # estimates from mixing cheap incremental runs with full scans.
+
+    def __init__(self, path: Path, keep: int = 5):
+        self.path = Path(path)
+        self.keep = keep
+        with self._connect() as db:
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS table_runs ('
+                ' table_name TEXT NOT NULL, engine TEXT NOT NULL, mode TEXT NOT NULL,'
+                ' seconds REAL NOT NULL, rows INTEGER, run_at TEXT NOT NULL)'
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=60)
+
+    def record(self, table: str, engine: str, mode: str, seconds: float, rows: Optional[int]) -> None:
+        with self._connect() as db:
+            db.execute(
+                'INSERT INTO table_runs (table_name, engine, mode, seconds, rows, run_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (table.lower(), engine, mode, float(seconds), rows, datetime.datetime.now().isoformat(timespec='seconds')),
+            )
+
+    def estimates(self, tables: list[str], mode: str) -> dict[str, Optional[tuple[float, float]]]:
+        # Median of the last `keep` runs per engine; None for tables never seen in this mode.
+        out: dict[str, Optional[tuple[float, float]]] = {}
+        with self._connect() as db:
+            for t in tables:
+                per_engine = []
+                for engine in ENGINES:
+                    rows = db.execute(
+                        'SELECT seconds FROM table_runs WHERE table_name = ? AND engine = ? AND mode = ?'
+                        ' ORDER BY run_at DESC, rowid DESC LIMIT ?',
+                        (t.lower(), engine, mode, self.keep),
+                    ).fetchall()
+                    per_engine.append(statistics.median(r[0] for r in rows) if rows else None)
+                out[t] = None if None in per_engine else (per_engine[0], per_engine[1])
+        return out
+
+
+def fill_unknown(estimates: dict[str, Optional[tuple[float, float]]], default: float) -> dict[str, tuple[float, float]]:
+    # Tables without history are assumed as expensive as the most expensive known
+    # one, so they start early instead of surprising the end of the run.
+    known = [e for e in estimates.values() if e is not None]
+    guess = (max(e[0] for e in known), max(e[1] for e in known)) if known else (default, default)
+    return {t: e if e is not None else guess for t, e in estimates.items()}
+
+
+def format_eta(seconds: float) -> str:
+    return str(datetime.timedelta(seconds=round(seconds)))
+
+
+class Scheduler:
+    # Longest-processing-time-first dispatch: each free worker takes the queued
+    # table with the largest predicted cost. Cost is the per-engine history
+    # estimate scaled by a per-engine factor learned during the run (actual /
+    # predicted), combined with max() when both engines run concurrently and
+    # sum() when they run one after the other. A slow engine today therefore
+    # re-orders what is still queued; tables that overrun by `replan_factor`
+    # trigger a re-estimated ETA. Thread-safe.
+
+    def __init__(
+        self,
+        tables: list[str],
+        estimates: dict[str, tuple[float, float]],
+        slots: int,
+        overlap: bool = True,
+        replan_factor: float = 1.5,
+        log: Callable[[str], None] = print,
+    ):
+        self.queue = list(tables)
+        self.estimates = estimates
+        self.slots = max(1, slots)
+        self.combine = max if overlap else (lambda a, b: a + b)
+        self.replan_factor = replan_factor
+        self.log = log
+        self.factors = {e: 1.0 for e in ENGINES}
+        self.running: dict[str, float] = {}
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def cost(self, table: str) -> float:
+        syn, dbx = self.estimates[table]
+        return self.combine(syn * self.factors['synapse'], dbx * self.factors['databricks'])
+
+    def eta(self) -> float:
+        # Simulated list-scheduling makespan of what is running and queued.
+        now = time.monotonic()
+        loads = [max(self.cost(t) - (now - start), 0.0) for t, start in self.running.items()]
+        loads += [0.0] * max(self.slots - len(loads), 0)
+        heapq.heapify(loads)
+        for t in sorted(self.queue, key=self.cost, reverse=True):
+            heapq.heappush(loads, heapq.heappop(loads) + self.cost(t))
+        return max(loads) if loads else 0.0
+
+    def next(self) -> Optional[str]:
+        with self._lock:
+            if not self.queue:
+                return None
+            table = max(self.queue, key=self.cost)
+            self.queue.remove(table)
+            self.running[table] = time.monotonic()
+            return table
+
+    def finish(self, table: str, seconds: Optional[dict[str, float]] = None) -> None:
+        # seconds: measured per-engine count time, or None when the table was not scanned.
+        with self._lock:
+            start = self.running.pop(table, None)
+            if not seconds or start is None:
+                return
+            predicted = self.cost(table)
+            for engine, est in zip(ENGINES, self.estimates[table]):
+                if engine in seconds and est > 0:
+                    self.factors[engine] = 0.5 * self.factors[engine] + 0.5 * seconds[engine] / est
+            actual = time.monotonic() - start
+            if predicted > 0 and actual > self.replan_factor * predicted:
+                self.log(
+                    f'{table} took {format_eta(actual)} vs {format_eta(predicted)} predicted; '
+                    f'remaining ETA re-planned to {format_eta(self.eta())}'
+                )
+
+    def plan(self) -> str:
+        order = sorted(self.queue, key=self.cost, reverse=True)
+        return f'Plan: {len(order)} tables on {self.slots} slot(s), ETA {format_eta(self.eta())}; largest first: ' + ', '.join(order[:5])
@@ -0,0 +1,77 @@
+﻿import datetime
+import sqlite3
+import time
+from pathlib import Path
+from typing import Optional
+
+
+class WatchState:
+    # Watch mode's memory, in SQLite under the output dir: per table, the latest
+    # change token (Synapse and Databricks indicators together), when it took
+    # that value, and the token of the last good compare. A table is due once its
+    # token differs from the compared one and has stood still for `settle`
+    # seconds (a load still running keeps moving it), or once it has waited
+    # `max_wait` seconds, so a table that never goes quiet is still compared.
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with self._connect() as db:
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS watched ('
+                ' table_name TEXT PRIMARY KEY, token TEXT, seen_at REAL NOT NULL, changed_at REAL NOT NULL,'
+                ' compared_token TEXT, compared_at TEXT)'
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=60)
+
+    def reset(self) -> None:
+        with self._connect() as db:
+            db.execute('DELETE FROM watched')
+
+    def observe(self, tokens: dict[str, str], settle: float, max_wait: float, initial: bool = True) -> tuple[list[str], int]:
+        # Records this poll's tokens; returns (tables due now, tables still settling).
+        # A table seen for the first time counts as settled, and is due unless
+        # `initial` is off, which takes its current state as already compared.
+        now = time.time()
+        due, settling = [], 0
+        with self._connect() as db:
+            known = {r[0]: r[1:] for r in db.execute('SELECT table_name, token, seen_at, changed_at, compared_token FROM watched')}
+            for table, token in tokens.items():
+                key = table.lower()
+                if key not in known:
+                    seen_at, changed_at, compared = now - settle, now, None if initial else token
+                    db.execute(
+                        'INSERT INTO watched (table_name, token, seen_at, changed_at, compared_token) VALUES (?, ?, ?, ?, ?)',
+                        (key, token, seen_at, changed_at, compared),
+                    )
+                else:
+                    old, seen_at, changed_at, compared = known[key]
+                    if token != old:
+                        if old == compared:
+                            changed_at = now
+                        seen_at = now
+                        db.execute('UPDATE watched SET token = ?, seen_at = ?, changed_at = ? WHERE table_name = ?', (token, seen_at, changed_at, key))
+                if token == compared:
+                    continue
+                if now - seen_at >= settle or now - changed_at >= max_wait:
+                    due.append(table)
+                else:
+                    settling += 1
+        return due, settling
+
+    def compared(self, table: str, token: Optional[str]) -> None:
+        # `token` is the one observed when the compare was decided: a load that
+        # lands during the compare shows up as a new change at the next poll.
+        with self._connect() as db:
+            db.execute(
+                'UPDATE watched SET compared_token = ?, compared_at = ? WHERE table_name = ?',
+                (token, datetime.datetime.now().isoformat(timespec='seconds'), table.lower()),
+            )
+
+    def retry_later(self, table: str) -> None:
+        # A failed compare restarts the table's wait, so it is retried one settle
+        # period later instead of at every poll.
+        now = time.time()
+        with self._connect() as db:
+            db.execute('UPDATE watched SET seen_at = ?, changed_at = ? WHERE table_name = ?', (now, now, table.lower()))
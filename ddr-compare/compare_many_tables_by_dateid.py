@@ -1,70 +1,556 @@
-﻿import argparse
-from pathlib import Path
+﻿from __future__ import annotations
 
-import pandas as pd
+import argparse
+import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterator, Optional
 
 from _common import (
+    Chunking,
+    ConnectionPool,
+    ResultsStore,
+    WorkQueue,
+    add_cache_args,
+    add_catalog_args,
+    add_chunk_args,
+    add_dry_run_args,
+    add_incremental_args,
+    add_queue_args,
+    add_trace_args,
+    apply_queue_options,
+    change_tokens,
+    count_functions,
     databricks_connect,
-    databricks_counts_by_dateid,
-    load_monitoring_tables,
+    databricks_counts_batch,
+    databricks_metadata_rowcount,
+    dry_run_changes,
+    dry_run_pairs,
+    dry_run_table,
+    load_mapping_pairs,
+    monitoring_catalog,
     best_match_databricks_fqn,
+    chunking,
     merge_counts,
+    metadata_equal,
     out_dir,
+    plan_batches,
+    process_tag,
+    query_errors,
+    queue_options,
+    record_result,
+    result_cache,
+    results_dir,
+    results_run,
+    run_cli,
+    run_worker,
     safe_filename,
+    span,
     synapse_connect,
-    synapse_counts_by_dateid,
+    synapse_counts_batch,
+    synapse_metadata_rowcount,
+    trace_run,
+    write_csv,
 )
+from _schedule import RunHistory, Scheduler, fill_unknown
+from _watch import WatchState
 
+if TYPE_CHECKING:
+    import pandas as pd
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument('--synapse-table', action='append', required=True, help='Repeatable 2-part: SCHEMA.TABLE')
-    args = ap.parse_args()
+# Assumed per-engine seconds for tables when no history exists yet at all.
+DEFAULT_ESTIMATE_SECONDS = 60.0
+# Per-process settings a queue worker keeps; the rest come from the coordinator.
+QUEUE_LOCAL = ('synapse_table', 'mapping', 'parallel', 'synapse_concurrency', 'databricks_concurrency', 'chunk_workers')
+
+
+def summarize(syn_table: str, dbx_table: str, out_csv: Optional[Path], syn_df: pd.DataFrame, dbx_df: pd.DataFrame, merged: pd.DataFrame) -> dict:
+    syn_dates = set(syn_df['DateID'].tolist())
+    dbx_dates = set(dbx_df['DateID'].tolist())
+
+    return {
+        'synapse_table': syn_table,
+        'databricks_table': dbx_table,
+        'status': 'scanned',
+        'csv': str(out_csv) if out_csv is not None else None,
+        'rows': int(len(merged)),
+        'syn_min': int(syn_df.DateID.min()) if len(syn_df) else None,
+        'syn_max': int(syn_df.DateID.max()) if len(syn_df) else None,
+        'dbx_min': int(dbx_df.DateID.min()) if len(dbx_df) else None,
+        'dbx_max': int(dbx_df.DateID.max()) if len(dbx_df) else None,
+        'syn_total': int(syn_df.cnt.sum()) if len(syn_df) else 0,
+        'dbx_total': int(dbx_df.cnt.sum()) if len(dbx_df) else 0,
+        'missing_in_dbx': int(len(syn_dates - dbx_dates)),
+        'missing_in_syn': int(len(dbx_dates - syn_dates)),
+        'mismatch_dates': int((merged['diff'] != 0).sum()),
+    }
+
+
+def metadata_summary(syn_table: str, dbx_table: str, total: int) -> dict:
+    print(f"Metadata-equal {syn_table} -> {dbx_table} ({total} rows), scan skipped")
+    return {
+        'synapse_table': syn_table,
+        'databricks_table': dbx_table,
+        'status': 'metadata-equal',
+        'csv': None,
+        'rows': None,
+        'syn_min': None,
+        'syn_max': None,
+        'dbx_min': None,
+        'dbx_max': None,
+        'syn_total': total,
+        'dbx_total': total,
+        'missing_in_dbx': None,
+        'missing_in_syn': None,
+        'mismatch_dates': None,
+    }
+
+
+def write_table(out: Path, syn_table: str, dbx_table: str, syn_df: pd.DataFrame, dbx_df: pd.DataFrame) -> dict:
+    merged = merge_counts(syn_df, dbx_df)
+    record_result('counts', merged, syn_table)
+    out_csv = write_csv(merged, out / f"compare_{safe_filename(syn_table)}_counts.csv")
+
+    print(f"Done {syn_table} -> {dbx_table}" + (f" ({out_csv.name})" if out_csv is not None else ''))
+    return summarize(syn_table, dbx_table, out_csv, syn_df, dbx_df, merged)
+
+
+def compare_batched(out: Path, syn_con, dbx_con, pairs: list[tuple[str, str]], args: argparse.Namespace) -> dict[str, dict]:
+    # Metadata row counts pick out small tables; those are counted with one
+    # UNION ALL statement per engine per batch. A failing batch leaves its tables
+    # to the per-table path. Returns summaries for the tables handled here.
+    done = {}
+    sizes = {}
+    dbx_of = dict(pairs)
+    for syn_table, dbx_table in pairs:
+        syn_total = synapse_metadata_rowcount(syn_con, syn_table)
+        dbx_total = databricks_metadata_rowcount(dbx_con, dbx_table)
+        if not args.force_scan and metadata_equal(syn_total, dbx_total):
+            done[syn_table] = metadata_summary(syn_table, dbx_table, syn_total)
+        elif syn_total is not None and dbx_total is not None and max(syn_total, dbx_total) <= args.small_table_rows:
+            sizes[syn_table] = max(syn_total, dbx_total)
+
+    for batch in plan_batches(sizes, args.batch_rows, args.batch_max_tables):
+        if len(batch) < 2:
+            continue
+        dbx_batch = [dbx_of[t] for t in batch]
+        try:
+            with span('batch', engine='synapse', tables=len(batch)):
+                syn_res = synapse_counts_batch(syn_con, batch)
+            with span('batch', engine='databricks', tables=len(batch)):
+                dbx_res = databricks_counts_batch(dbx_con, dbx_batch)
+        except query_errors() as e:
+            print(f"Batch of {len(batch)} tables failed, falling back to per-table queries: {e}")
+            continue
+        print(f"Batched {len(batch)} small tables ({sum(sizes[t] for t in batch)} rows)")
+        for t in batch:
+            done[t] = write_table(out, t, dbx_of[t], syn_res[t], dbx_res[dbx_of[t]])
+    return done
+
+
+def error_summary(syn_table: str, dbx_table: str, error: Exception) -> dict:
+    print(f'FAILED {syn_table} -> {dbx_table}: {error}')
+    return {'synapse_table': syn_table, 'databricks_table': dbx_table, 'status': 'error', 'error': str(error)}
+
+
+def summary_frame(summary: pd.DataFrame, mode: str) -> pd.DataFrame:
+    # DDR_compare_summary.csv rows in the results store's shared summary layout.
+    renamed = summary.rename(columns={'synapse_table': 'table', 'mismatch_dates': 'mismatching'})
+    return renamed.assign(tool='ddr-compare', mode=mode, keys='DateID')
+
+
+def run_mode(args: argparse.Namespace) -> str:
+    if args.incremental:
+        return 'incremental'
+    return 'chunked' if args.chunk_rows else 'full'
+
+
+def timed_count(fn, con, table: str) -> tuple[pd.DataFrame, float]:
+    started = time.perf_counter()
+    df = fn(con, table)
+    return df, time.perf_counter() - started
+
+
+def record_counts(history: RunHistory, mode: str, syn_table: str, counted: dict[str, tuple[pd.DataFrame, float]]) -> dict[str, float]:
+    for engine, (df, seconds) in counted.items():
+        history.record(syn_table, engine, mode, seconds, int(df['cnt'].sum()))
+    return {engine: seconds for engine, (_, seconds) in counted.items()}
+
+
+def make_scheduler(tables: list[str], history: RunHistory, mode: str, slots: int, overlap: bool) -> Scheduler:
+    estimates = fill_unknown(history.estimates(tables, mode), DEFAULT_ESTIMATE_SECONDS)
+    sched = Scheduler(tables, estimates, slots, overlap=overlap)
+    print(sched.plan())
+    return sched
+
+
+def resolve_pairs(dbx_con, tables: list[str], mapped: dict[str, str], args: argparse.Namespace) -> list[tuple[str, str]]:
+    if all(t in mapped for t in tables):
+        return [(t, mapped[t]) for t in tables]
+    catalog = monitoring_catalog(dbx_con, args.catalog_ttl_hours, args.refresh_catalog)
+    return [(t, mapped.get(t) or best_match_databricks_fqn(catalog, t)) for t in tables]
+
+
+def compare_pair(
+    out: Path, syn_con, dbx_con, syn_table: str, dbx_table: str, syn_count, dbx_count, check_metadata: bool,
+    history: RunHistory, mode: str,
+) -> tuple[dict, Optional[dict[str, float]]]:
+    if check_metadata:
+        with span('metadata'):
+            syn_total = synapse_metadata_rowcount(syn_con, syn_table)
+            dbx_total = databricks_metadata_rowcount(dbx_con, dbx_table)
+        if metadata_equal(syn_total, dbx_total):
+            return metadata_summary(syn_table, dbx_table, syn_total), None
+
+    with span('count', engine='synapse'):
+        syn = timed_count(syn_count, syn_con, syn_table)
+    with span('count', engine='databricks'):
+        dbx = timed_count(dbx_count, dbx_con, dbx_table)
+    timings = record_counts(history, mode, syn_table, {'synapse': syn, 'databricks': dbx})
+    return write_table(out, syn_table, dbx_table, syn[0], dbx[0]), timings
+
+
+def run_sequential(
+    out: Path, tables: list[str], mapped: dict[str, str], syn_count, dbx_count, args: argparse.Namespace, history: RunHistory,
+    syn_pool: ConnectionPool, dbx_pool: ConnectionPool,
+) -> list[dict]:
+    # Connections are checked out per table, so a failed table's (possibly dead)
+    # sessions are replaced instead of failing the tables after it.
+    with dbx_pool.connection(discard_on_error=True) as dbx_con:
+        pairs = resolve_pairs(dbx_con, tables, mapped, args)
+    dbx_of = dict(pairs)
+
+    results = {}
+    if args.batch:
+        with syn_pool.connection(discard_on_error=True) as syn_con, dbx_pool.connection(discard_on_error=True) as dbx_con:
+            results = compare_batched(out, syn_con, dbx_con, pairs, args)
+    check_metadata = not args.force_scan and not args.batch
+    mode = run_mode(args)
 
+    # One table at a time: the order cannot change the total, but the ETA is still useful.
+    sched = make_scheduler([t for t in dbx_of if t not in results], history, mode, 1, overlap=False)
+    while (syn_table := sched.next()) is not None:
+        timings = None
+        try:
+            with syn_pool.connection(discard_on_error=True) as syn_con, \
+                    dbx_pool.connection(discard_on_error=True) as dbx_con, \
+                    span('table', table=syn_table):
+                results[syn_table], timings = compare_pair(
+                    out, syn_con, dbx_con, syn_table, dbx_of[syn_table], syn_count, dbx_count, check_metadata,
+                    history, mode,
+                )
+        # Any failure, not just a driver error, is recorded for its table
+        # so the tables already compared still reach the summary.
+        except Exception as e:
+            results[syn_table] = error_summary(syn_table, dbx_of[syn_table], e)
+        finally:
+            sched.finish(syn_table, timings)
+
+    return [results[t] for t, _ in pairs]
+
+
+def run_parallel(
+    out: Path, tables: list[str], mapped: dict[str, str], syn_count, dbx_count, args: argparse.Namespace, history: RunHistory,
+    syn_pool: ConnectionPool, dbx_pool: ConnectionPool,
+) -> list[dict]:
+    # `parallel` tables are in flight at once; each one submits its Synapse and
+    # Databricks scans to per-engine executors, so the two sides run concurrently
+    # while each engine never sees more than its own concurrency limit. Tables are
+    # handed to free workers largest-predicted-first (see _schedule.Scheduler).
+    syn_workers = args.synapse_concurrency
+    dbx_workers = args.databricks_concurrency
+    mode = run_mode(args)
+    with ThreadPoolExecutor(syn_workers, thread_name_prefix='synapse') as syn_exec, \
+            ThreadPoolExecutor(dbx_workers, thread_name_prefix='databricks') as dbx_exec, \
+            ThreadPoolExecutor(args.parallel, thread_name_prefix='table') as table_exec:
+
+        with dbx_pool.connection(discard_on_error=True) as dbx_con:
+            pairs = resolve_pairs(dbx_con, tables, mapped, args)
+        dbx_of = dict(pairs)
+
+        results = {}
+        if args.batch:
+            with syn_pool.connection(discard_on_error=True) as syn_con, dbx_pool.connection(discard_on_error=True) as dbx_con:
+                results = compare_batched(out, syn_con, dbx_con, pairs, args)
+        check_metadata = not args.force_scan and not args.batch
+
+        # Spans are labelled with the Synapse name so both sides of a table group together.
+        def on_synapse(phase: str, fn, table: str):
+            with syn_pool.connection(discard_on_error=True) as con, span(phase, table=table, engine='synapse'):
+                return fn(con, table)
+
+        def on_databricks(phase: str, fn, table: str, label: str):
+            with dbx_pool.connection(discard_on_error=True) as con, span(phase, table=label, engine='databricks'):
+                return fn(con, table)
+
+        def compare_one(syn_table: str, dbx_table: str) -> tuple[dict, Optional[dict[str, float]]]:
+            if check_metadata:
+                syn_meta = syn_exec.submit(on_synapse, 'metadata', synapse_metadata_rowcount, syn_table)
+                dbx_meta = dbx_exec.submit(on_databricks, 'metadata', databricks_metadata_rowcount, dbx_table, syn_table)
+                if metadata_equal(syn_meta.result(), dbx_meta.result()):
+                    return metadata_summary(syn_table, dbx_table, syn_meta.result()), None
+
+            syn_fut = syn_exec.submit(on_synapse, 'count', partial(timed_count, syn_count), syn_table)
+            dbx_fut = dbx_exec.submit(on_databricks, 'count', partial(timed_count, dbx_count), dbx_table, syn_table)
+            syn, dbx = syn_fut.result(), dbx_fut.result()
+            timings = record_counts(history, mode, syn_table, {'synapse': syn, 'databricks': dbx})
+            return write_table(out, syn_table, dbx_table, syn[0], dbx[0]), timings
+
+        slots = min(args.parallel, syn_workers, dbx_workers)
+        sched = make_scheduler([t for t in dbx_of if t not in results], history, mode, slots, overlap=True)
+
+        def worker() -> None:
+            while (syn_table := sched.next()) is not None:
+                timings = None
+                try:
+                    with span('table', table=syn_table):
+                        results[syn_table], timings = compare_one(syn_table, dbx_of[syn_table])
+                except Exception as e:
+                    results[syn_table] = error_summary(syn_table, dbx_of[syn_table], e)
+                finally:
+                    sched.finish(syn_table, timings)
+
+        for f in [table_exec.submit(worker) for _ in range(args.parallel)]:
+            f.result()
+
+        # Summary rows follow the input order, not completion order.
+        return [results[t] for t, _ in pairs]
+
+
+def enqueue(queue: WorkQueue, tables: list[str], mapped: dict[str, str], args: argparse.Namespace, history: RunHistory) -> dict:
+    # Tables go in largest-predicted-first, the order the in-process scheduler would start them.
+    if queue.exists() and not queue.finished():
+        print(f'Resuming the unfinished queue in {queue.root}: {queue.status()}')
+        return queue.meta()
+    if args.batch:
+        print('--batch is ignored with --queue (queue items are single tables)')
+        args.batch = False
+    with databricks_connect() as dbx_con:
+        pairs = resolve_pairs(dbx_con, tables, mapped, args)
+    dbx_of = dict(pairs)
+    sched = make_scheduler(list(dbx_of), history, run_mode(args), args.parallel, overlap=True)
+    items = [{'synapse_table': t, 'databricks_table': dbx_of[t]} for t in iter(sched.next, None)]
+    queue.create(
+        items, args.lease_seconds, args.max_attempts,
+        tool='ddr', run_id=ResultsStore(results_dir()).run_id, options=queue_options(args, QUEUE_LOCAL),
+    )
+    print(f'Queued {len(items)} tables in {queue.root}')
+    return queue.meta()
+
+
+def work_queue(queue: WorkQueue, out: Path, syn_count, dbx_count, args: argparse.Namespace, history: RunHistory) -> int:
+    # `parallel` claim loops, each with its own pair of connections. Every
+    # loop stays until the queue is done, to take over items of workers that die.
+    mode = run_mode(args)
+    check_metadata = not args.force_scan
+
+    def loop() -> int:
+        with synapse_connect() as syn_con, databricks_connect() as dbx_con:
+            def handle(item: dict) -> dict:
+                syn_table, dbx_table = item['synapse_table'], item['databricks_table']
+                try:
+                    with span('table', table=syn_table):
+                        summary, _ = compare_pair(
+                            out, syn_con, dbx_con, syn_table, dbx_table, syn_count, dbx_count, check_metadata, history, mode,
+                        )
+                except Exception as e:
+                    summary = error_summary(syn_table, dbx_table, e)
+                return summary
+
+            return run_worker(queue, handle)
+
+    with ThreadPoolExecutor(args.parallel, thread_name_prefix='queue') as pool:
+        return sum(f.result() for f in [pool.submit(loop) for _ in range(args.parallel)])
+
+
+def queue_summaries(queue: WorkQueue) -> list[dict]:
+    rows = []
+    for e in queue.results():
+        item = e['item']
+        row = e['result'] or {
+            'synapse_table': item['synapse_table'], 'databricks_table': item['databricks_table'], 'status': 'error', 'error': e['error'],
+        }
+        rows.append({**row, 'worker': e['worker'], 'attempts': e['attempts'], 'seconds': e['seconds']})
+    return rows
+
+
+def run_queue(args: argparse.Namespace, tables: list[str], mapped: dict[str, str]) -> None:
+    # Distributed run over a shared folder: the coordinator enqueues, any number
+    # of workers on any machines claim tables under time-limited leases, and the
+    # coordinator merges their summaries into one. Workers record counts under
+    # the coordinator's run id.
+    queue = WorkQueue(Path(args.queue))
     out = Path(out_dir())
     out.mkdir(parents=True, exist_ok=True)
+    history = RunHistory(out / 'run_history.sqlite')
+    if args.worker:
+        meta = queue.wait_ready(args.lease_seconds)
+        apply_queue_options(args, meta)
+    else:
+        meta = enqueue(queue, tables, mapped, args, history)
+    cache = result_cache(not args.no_cache, args.refresh)
+
+    summary_path = None
+    name = f'DDR_compare_worker_{process_tag()}' if args.worker else 'DDR_compare'
+    with trace_run(out, name, args.profile), results_run(results_dir(), meta['run_id']), chunking(args, out) as chunks:
+        if args.worker or not args.no_work:
+            syn_count, dbx_count = count_functions(args.incremental, args.lookback, args.since, cache, chunks)
+            print(f'Handled {work_queue(queue, out, syn_count, dbx_count, args, history)} queue items')
+        if not args.worker:
+            import pandas as pd
+
+            queue.wait()
+            summary = pd.DataFrame.from_records(queue_summaries(queue))
+            record_result('summary', summary_frame(summary, run_mode(args)))
+            summary_path = write_csv(summary, out / 'DDR_compare_summary.csv')
+    if summary_path is not None:
+        print('Wrote summary:', summary_path)
+    if cache is not None:
+        print('Result cache:', cache)
+
 
-    summaries = []
+@contextmanager
+def run_pools(args: argparse.Namespace, out: Path) -> Iterator[tuple[ConnectionPool, ConnectionPool, Optional[Chunking]]]:
+    # Every connection a run uses; a watch keeps them across polls, so logins
+    # (an MFA prompt on Synapse) happen once, not every poll.
+    syn_size = args.synapse_concurrency if args.parallel > 1 else 1
+    dbx_size = args.databricks_concurrency if args.parallel > 1 else 1
+    with ConnectionPool(synapse_connect, syn_size) as syn_pool, \
+            ConnectionPool(databricks_connect, dbx_size) as dbx_pool, \
+            chunking(args, out) as chunks:
+        yield syn_pool, dbx_pool, chunks
 
-    with synapse_connect() as syn_con:
-        with databricks_connect() as dbx_con:
-            monitor = load_monitoring_tables(dbx_con)
 
-            for syn_table in args.synapse_table:
-                dbx_table = best_match_databricks_fqn(monitor, syn_table)
+def run_tables(out: Path, tables: list[str], mapped: dict[str, str], args: argparse.Namespace, cache, pools) -> list[dict]:
+    import pandas as pd
 
-                syn_df = synapse_counts_by_dateid(syn_con, syn_table)
-                dbx_df = databricks_counts_by_dateid(dbx_con, dbx_table)
-                merged = merge_counts(syn_df, dbx_df)
+    syn_pool, dbx_pool, chunks = pools
+    with trace_run(out, 'DDR_compare', args.profile), results_run(results_dir()):
+        syn_count, dbx_count = count_functions(args.incremental, args.lookback, args.since, cache, chunks)
+        history = RunHistory(out / 'run_history.sqlite')
+        if args.parallel > 1:
+            summaries = run_parallel(out, tables, mapped, syn_count, dbx_count, args, history, syn_pool, dbx_pool)
+        else:
+            summaries = run_sequential(out, tables, mapped, syn_count, dbx_count, args, history, syn_pool, dbx_pool)
 
-                out_csv = out / f"compare_{safe_filename(syn_table)}_counts.csv"
-                merged.to_csv(out_csv, index=False)
+        summary = pd.DataFrame.from_records(summaries)
+        record_result('summary', summary_frame(summary, run_mode(args)))
+        summary_path = write_csv(summary, out / 'DDR_compare_summary.csv')
+    if summary_path is not None:
+        print('Wrote summary:', summary_path)
+    return summaries
 
-                syn_dates = set(syn_df['DateID'].tolist())
-                dbx_dates = set(dbx_df['DateID'].tolist())
 
-                summaries.append({
-                    'synapse_table': syn_table,
-                    'databricks_table': dbx_table,
-                    'csv': str(out_csv),
-                    'rows': int(len(merged)),
-                    'syn_min': int(syn_df.DateID.min()) if len(syn_df) else None,
-                    'syn_max': int(syn_df.DateID.max()) if len(syn_df) else None,
-                    'dbx_min': int(dbx_df.DateID.min()) if len(dbx_df) else None,
-                    'dbx_max': int(dbx_df.DateID.max()) if len(dbx_df) else None,
-                    'syn_total': int(syn_df.cnt.sum()) if len(syn_df) else 0,
-                    'dbx_total': int(dbx_df.cnt.sum()) if len(dbx_df) else 0,
-                    'missing_in_dbx': int(len(syn_dates - dbx_dates)),
-                    'missing_in_syn': int(len(dbx_dates - syn_dates)),
-                    'mismatch_dates': int((merged['diff'] != 0).sum()),
-                })
+def watch(out: Path, tables: list[str], mapped: dict[str, str], args: argparse.Namespace, cache, pools) -> None:
+    # Change-driven runs: every poll reads one change query per engine for all
+    # tables, and only tables whose indicators moved and then settled are run,
+    # through the same sequential / parallel path as a full sweep (one results
+    # run per poll that compares anything).
+    state = WatchState(out / 'watch_state.sqlite')
+    if args.reset_watch:
+        state.reset()
+    syn_pool, dbx_pool, _ = pools
+    with dbx_pool.connection(discard_on_error=True) as dbx_con:
+        pairs = resolve_pairs(dbx_con, tables, mapped, args)
+    dbx_of = dict(pairs)
+    settle, max_wait = args.settle_minutes * 60, args.max_wait_minutes * 60
 
-                print(f"Done {syn_table} -> {dbx_table} ({out_csv.name})")
+    warned = False
+    while True:
+        try:
+            with syn_pool.connection(discard_on_error=True) as syn_con, dbx_pool.connection(discard_on_error=True) as dbx_con:
+                tokens = change_tokens(syn_con, dbx_con, pairs)
+        except query_errors() as e:
+            # The failed sessions are dropped from the pools; the next poll reconnects.
+            print(f'Change poll failed, retrying at the next poll: {e}')
+        else:
+            unwatched = [t for t, token in tokens.items() if token is None]
+            if unwatched and not warned:
+                more = f' (+{len(unwatched) - 5} more)' if len(unwatched) > 5 else ''
+                print(f"No change indicator on either side, not watched: {', '.join(unwatched[:5])}{more}")
+                warned = True
+            due, settling = state.observe(tokens, settle, max_wait, initial=not args.no_initial_sweep)
+            print(f'{datetime.datetime.now():%Y-%m-%d %H:%M:%S} watching {len(tokens) - len(unwatched)} tables: {len(due)} changed and due, {settling} settling')
+            if due:
+                for summary in run_tables(out, due, dbx_of, args, cache, pools):
+                    if summary['status'] == 'error':
+                        state.retry_later(summary['synapse_table'])
+                    else:
+                        state.compared(summary['synapse_table'], tokens[summary['synapse_table']])
+        if args.once:
+            return
+        time.sleep(args.poll_minutes * 60)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--synapse-table', action='append', help='Repeatable 2-part: SCHEMA.TABLE')
+    ap.add_argument('--mapping', help='lake-compare mapping.json: compare every mapped table (or only --synapse-table ones) with its mapped Databricks name')
+    ap.add_argument('--parallel', type=int, default=1, help='Tables in flight at once (1 = sequential)')
+    ap.add_argument('--synapse-concurrency', type=int, default=4, help='Max concurrent Synapse queries in parallel mode')
+    ap.add_argument('--databricks-concurrency', type=int, default=4, help='Max concurrent Databricks queries in parallel mode')
+    ap.add_argument('--force-scan', action='store_true', help='Scan even when metadata row counts already match')
+    ap.add_argument('--batch', action='store_true', help='Count small tables together, one UNION ALL query per engine per batch')
+    ap.add_argument('--small-table-rows', type=int, default=1_000_000, help='Batch: tables up to this many rows are batched')
+    ap.add_argument('--batch-rows', type=int, default=10_000_000, help='Batch: max total rows per batch')
+    ap.add_argument('--batch-max-tables', type=int, default=50, help='Batch: max tables per batch')
+    add_incremental_args(ap)
+    add_cache_args(ap)
+    add_chunk_args(ap)
+    add_catalog_args(ap)
+    add_trace_args(ap)
+    add_dry_run_args(ap)
+    add_queue_args(ap)
+    ap.add_argument('--watch', action='store_true', help='Keep polling change indicators and compare only tables whose data changed')
+    ap.add_argument('--once', action='store_true', help='Watch: poll once, compare what is due and exit (for a scheduler; state is kept between runs)')
+    ap.add_argument('--poll-minutes', type=float, default=5.0, help='Watch: minutes between polls')
+    ap.add_argument('--settle-minutes', type=float, default=10.0, help='Watch: a change must stand still this long before the table is compared')
+    ap.add_argument('--max-wait-minutes', type=float, default=120.0, help='Watch: compare a table that keeps changing after this long anyway')
+    ap.add_argument('--no-initial-sweep', action='store_true', help='Watch: take tables seen for the first time as already compared')
+    ap.add_argument('--reset-watch', action='store_true', help='Watch: forget what was compared; every table counts as new')
+    args = ap.parse_args()
+    args.watch = args.watch or args.once
+    if args.worker and not args.queue:
+        ap.error('--worker needs --queue')
+    if args.watch and args.queue:
+        ap.error('--watch and --queue do not combine')
+    if not args.synapse_table and not args.mapping and not args.worker:
+        ap.error('give --synapse-table and/or --mapping')
+
+    mapped = load_mapping_pairs(Path(args.mapping)) if args.mapping else {}
+    tables = args.synapse_table or list(mapped)
+    if args.dry_run:
+        pairs = dry_run_pairs(tables, mapped, args.catalog_ttl_hours)
+        if args.watch:
+            dry_run_changes(pairs)
+            print('Watch: the tables whose indicators changed and settled are then compared as follows')
+            print()
+        for syn_table, dbx_table in pairs:
+            dry_run_table(syn_table, dbx_table, args)
+        if args.batch and not args.incremental:
+            print('--batch: tables the metadata queries find small are then counted together, one UNION ALL per engine per batch')
+        return
+    if args.queue:
+        return run_queue(args, tables, mapped)
+
+    out = Path(out_dir())
+    out.mkdir(parents=True, exist_ok=True)
+    cache = result_cache(not args.no_cache, args.refresh)
+    if args.batch and args.incremental:
+        print('--batch is ignored with --incremental (batched queries scan full history)')
+        args.batch = False
 
-    summary_path = out / 'DDR_compare_summary.csv'
-    pd.DataFrame.from_records(summaries).to_csv(summary_path, index=False)
-    print('Wrote summary:', summary_path)
+    with run_pools(args, out) as pools:
+        if args.watch:
+            watch(out, tables, mapped, args, cache, pools)
+        else:
+            run_tables(out, tables, mapped, args, cache, pools)
+    if cache is not None:
+        print('Result cache:', cache)
 
 
 if __name__ == '__main__':
-    main()
+    raise SystemExit(run_cli(main))
@@ -2,44 +2,98 @@
 from pathlib import Path
 
 from _common import (
+    add_cache_args,
+    add_catalog_args,
+    add_chunk_args,
+    add_dry_run_args,
+    add_incremental_args,
+    add_trace_args,
+    count_functions,
     databricks_connect,
-    databricks_counts_by_dateid,
-    load_monitoring_tables,
+    databricks_metadata_rowcount,
+    dry_run_pairs,
+    dry_run_table,
+    monitoring_catalog,
     best_match_databricks_fqn,
+    chunking,
     merge_counts,
+    metadata_equal,
     out_dir,
+    record_result,
+    result_cache,
+    results_dir,
+    results_run,
+    run_cli,
     safe_filename,
+    span,
     synapse_connect,
-    synapse_counts_by_dateid,
+    synapse_metadata_rowcount,
+    trace_run,
+    write_csv,
 )
 
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument('--synapse-table', required=True, help='2-part: SCHEMA.TABLE')
-    ap.add_argument('--databricks-table', required=False, help='3-part: catalog.schema.name (optional)')
-    args = ap.parse_args()
-
-    out = Path(out_dir())
-    out.mkdir(parents=True, exist_ok=True)
-
+def compare(args: argparse.Namespace, out: Path, syn_count, dbx_count) -> None:
     with synapse_connect() as syn_con:
         with databricks_connect() as dbx_con:
-            monitor = load_monitoring_tables(dbx_con)
-            dbx_table = args.databricks_table or best_match_databricks_fqn(monitor, args.synapse_table)
+            dbx_table = args.databricks_table or best_match_databricks_fqn(
+                monitoring_catalog(dbx_con, args.catalog_ttl_hours, args.refresh_catalog), args.synapse_table
+            )
+
+            if not args.force_scan:
+                with span('metadata', table=args.synapse_table):
+                    syn_total = synapse_metadata_rowcount(syn_con, args.synapse_table)
+                    dbx_total = databricks_metadata_rowcount(dbx_con, dbx_table)
+                if metadata_equal(syn_total, dbx_total):
+                    print('Synapse:', args.synapse_table)
+                    print('Databricks:', dbx_table)
+                    print(f'Metadata-equal: {syn_total} rows on both sides, scan skipped (use --force-scan to compare per DateID)')
+                    return
 
-            syn_df = synapse_counts_by_dateid(syn_con, args.synapse_table)
-            dbx_df = databricks_counts_by_dateid(dbx_con, dbx_table)
+            with span('table', table=args.synapse_table):
+                with span('count', engine='synapse'):
+                    syn_df = syn_count(syn_con, args.synapse_table)
+                with span('count', engine='databricks'):
+                    dbx_df = dbx_count(dbx_con, dbx_table)
 
-            merged = merge_counts(syn_df, dbx_df)
-            out_csv = out / f"compare_{safe_filename(args.synapse_table)}_counts.csv"
-            merged.to_csv(out_csv, index=False)
+                merged = merge_counts(syn_df, dbx_df)
+                record_result('counts', merged, args.synapse_table)
+                out_csv = write_csv(merged, out / f"compare_{safe_filename(args.synapse_table)}_counts.csv")
 
             print('Synapse:', args.synapse_table)
             print('Databricks:', dbx_table)
-            print('Wrote:', out_csv)
+            if out_csv is not None:
+                print('Wrote:', out_csv)
             print('Rows:', len(merged), 'Nonzero diffs:', int((merged['diff'] != 0).sum()))
 
 
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--synapse-table', required=True, help='2-part: SCHEMA.TABLE')
+    ap.add_argument('--databricks-table', required=False, help='3-part: catalog.schema.name (optional)')
+    ap.add_argument('--force-scan', action='store_true', help='Scan even when metadata row counts already match')
+    add_incremental_args(ap)
+    add_cache_args(ap)
+    add_chunk_args(ap)
+    add_catalog_args(ap)
+    add_trace_args(ap)
+    add_dry_run_args(ap)
+    args = ap.parse_args()
+    if args.dry_run:
+        mapped = {args.synapse_table: args.databricks_table} if args.databricks_table else {}
+        for syn_table, dbx_table in dry_run_pairs([args.synapse_table], mapped, args.catalog_ttl_hours):
+            dry_run_table(syn_table, dbx_table, args)
+        return
+
+    out = Path(out_dir())
+    out.mkdir(parents=True, exist_ok=True)
+    cache = result_cache(not args.no_cache, args.refresh)
+    with trace_run(out, f'compare_{safe_filename(args.synapse_table)}', args.profile), results_run(results_dir()), chunking(args, out) as chunks:
+        syn_count, dbx_count = count_functions(args.incremental, args.lookback, args.since, cache, chunks)
+        compare(args, out, syn_count, dbx_count)
+    if cache is not None:
+        print('Result cache:', cache)
+
+
 if __name__ == '__main__':
-    main()
+    raise SystemExit(run_cli(main))
@@ -0,0 +1,49 @@
+﻿import argparse
+from pathlib import Path
+
+from _common import SCHEMAS, ResultsStore, results_dir
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description='Read the Parquet results store written by ddr-compare and lake-compare')
+    ap.add_argument('--dataset', choices=sorted(SCHEMAS), default='counts')
+    ap.add_argument('--table', help='Synapse SCHEMA.TABLE (partition filter for counts / diffs)')
+    ap.add_argument('--last-runs', type=int, help='Only the last N runs that recorded this dataset (and --table)')
+    ap.add_argument('--since', help='Only runs on or after this date (YYYY-MM-DD)')
+    ap.add_argument('--column', action='append', help='Repeatable: columns to read (default: all)')
+    ap.add_argument('--mismatch-only', action='store_true', help='counts: diff != 0; diffs: match false; summary: mismatching or error')
+    ap.add_argument('--runs', action='store_true', help='List run ids instead of rows')
+    ap.add_argument('--csv', help='Write the rows to this CSV file instead of printing them')
+    ap.add_argument('--root', help='Store folder (default: COMPARE_RESULTS_DIR, else results under DDR_COMPARE_OUT_DIR)')
+    args = ap.parse_args()
+
+    store = ResultsStore(Path(args.root) if args.root else results_dir())
+    if args.runs:
+        runs = store.runs(args.dataset, args.table, args.since)
+        for r in runs[-args.last_runs:] if args.last_runs else runs:
+            print(r)
+        return 0
+
+    df = store.read(
+        args.dataset,
+        table=args.table,
+        since=args.since,
+        last_runs=args.last_runs,
+        columns=args.column,
+        mismatch_only=args.mismatch_only,
+    )
+    order = [c for c in ('run_id', 'table', 'DateID', 'grain', 'key', 'metric') if c in df.columns]
+    if order:
+        df = df.sort_values(order, kind='stable', ignore_index=True)
+
+    if args.csv:
+        df.to_csv(args.csv, index=False)
+        print(f'Wrote {len(df)} rows -> {args.csv}')
+    else:
+        print(df.to_string(index=False, max_rows=60))
+        print('Rows:', len(df))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -1,19 +1,77 @@
-﻿import json
+﻿from __future__ import annotations
+
+import datetime
+import decimal
+import json
 import os
 import re
+import sys
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
-import pyodbc
-from databricks import sql as dbsql
+
+# Connections, fetches, caches and the results store are shared with
+# ddr-compare (../shared); what follows is lake-compare's own compare logic.
+SHARED = Path(__file__).resolve().parent.parent / "shared"
+if str(SHARED) not in sys.path:
+    sys.path.insert(0, str(SHARED))
+
+import _base
+from _base import (
+    ConnectionPool,
+    add_dry_run_args,
+    catalog_cache_path,
+    databricks_connect,
+    query_errors,
+    require_env,
+    safe_filename,
+    show_sql,
+    synapse_connect,
+)
+from _catalog import CatalogCache, CatalogSource, ColumnSource
+from _query import (
+    FETCH_BATCH_ROWS,
+    MONITORING_TABLE,
+    SYNAPSE_OBJECT_COUNT_SQL,
+    ChunkRunner,
+    FetchStats,
+    ResultCache,
+    databricks_catalog_source,
+    databricks_column_source,
+    databricks_columns_sql,
+    databricks_iter_arrow,
+    databricks_metadata_rowcount,
+    databricks_metadata_rowcount_sql,
+    databricks_query,
+    databricks_table_version,
+    monitoring_probe_sql,
+    record_result,
+    results_run,
+    synapse_catalog_source,
+    synapse_column_source,
+    synapse_columns_sql,
+    synapse_iter_arrow,
+    synapse_metadata_rowcount,
+    synapse_objects_sql,
+    synapse_query,
+    synapse_table_stats_sql,
+    synapse_table_version,
+    write_csv,
+)
+from _results import ResultsStore
+from _workqueue import WorkQueue, add_queue_args, apply_queue_options, queue_options, run_worker
+
+if TYPE_CHECKING:
+    import pyodbc
+    from databricks import sql as dbsql
+
+SERVICE_TOOL = "lake"
 
 
-def require_env(name: str) -> str:
-    v = os.getenv(name)
-    if not v:
-        raise RuntimeError(f"Missing env var: {name}")
-    return v
+def run_cli(main: Callable[[], Optional[int]]) -> int:
+    return _base.run_cli(main, SERVICE_TOOL)
 
 
 def out_dir() -> Path:
@@ -22,35 +80,313 @@ def out_dir() -> Path:
 
 def load_settings() -> Dict[str, Any]:
     here = Path(__file__).resolve().parent
-    return json.loads((here / "settings.json").read_text(encoding="utf-8"))
-
-
-def synapse_connect() -> pyodbc.Connection:
-    server = require_env("SYNAPSE_SERVER")
-    db = require_env("SYNAPSE_DB")
-    uid = os.getenv("SYNAPSE_UID", "")
-
-    conn_str = (
-        "Driver={ODBC Driver 18 for SQL Server};"
-        f"Server=tcp:{server},1433;"
-        f"Database={db};"
-        "Encrypt=yes;TrustServerCertificate=no;"
-        "Connection Timeout=30;"
-        "Authentication=ActiveDirectoryInteractive;"
-        + (f"UID={uid};" if uid else "")
+    return json.loads((here / "settings.json").read_text(encoding="utf-8-sig"))
+
+
+def synapse_columns(con: pyodbc.Connection, synapse_2part: str) -> pd.DataFrame:
+    schema, name = synapse_2part.split(".", 1)
+    sql = (
+        "SELECT COLUMN_NAME, DATA_TYPE, NUMERIC_SCALE FROM INFORMATION_SCHEMA.COLUMNS "
+        f"WHERE TABLE_SCHEMA = '{schema}' AND TABLE_NAME = '{name}' ORDER BY ORDINAL_POSITION"
     )
-    return pyodbc.connect(conn_str)
+    df = synapse_query(con, sql)
+    if df.empty:
+        raise RuntimeError(f"No columns found for {synapse_2part}")
+    return df.rename(columns={"COLUMN_NAME": "name", "DATA_TYPE": "type", "NUMERIC_SCALE": "scale"})
+
+
+def databricks_columns(con: dbsql.Connection, table_3part: str) -> pd.DataFrame:
+    # DESCRIBE TABLE lists the columns first, then partitioning / detail sections after a blank or "#" row.
+    df = databricks_query(con, f"DESCRIBE TABLE {table_3part}")
+    rows = []
+    for name, typ in zip(df["col_name"], df["data_type"]):
+        if not name or str(name).startswith("#"):
+            break
+        rows.append((str(name), str(typ)))
+    if not rows:
+        raise RuntimeError(f"No columns found for {table_3part}")
+    return pd.DataFrame(rows, columns=["name", "type"])
+
+
+def refresh_catalog(engine: str, ttl_hours: float = 24.0, refresh: bool = False) -> CatalogCache:
+    # Connects only when the cached snapshot is older than ttl_hours (or refresh is set).
+    cache = CatalogCache(catalog_cache_path(out_dir()), ttl_hours)
+    connect, source = (synapse_connect, synapse_catalog_source) if engine == "synapse" else (databricks_connect, databricks_catalog_source)
+    cons = []
+    def make_source() -> CatalogSource:
+        cons.append(connect())
+        return source(cons[0])
+
+    try:
+        kind = cache.refresh(engine, make_source, force=refresh)
+    finally:
+        for con in cons:
+            con.close()
+    print(f"Catalog cache: {kind}, {cache.size(engine)} {engine} objects ({cache.path})")
+    return cache
+
+
+def scope_key(scope: Dict[str, List[str]]) -> str:
+    return json.dumps({k: sorted(v) for k, v in scope.items()}, sort_keys=True)
+
+
+def refresh_columns(engine: str, scope: Dict[str, List[str]], ttl_hours: float = 24.0, refresh: bool = False) -> pd.DataFrame:
+    # Column signatures per object (catalog, schema, name, n_columns, row_count,
+    # signature, names_signature) from one bulk information-schema read per
+    # engine, limited to `scope` (synapse: schemas; databricks: catalogs,
+    # schemas). Connects only when the cached listing is stale.
+    cache = CatalogCache(catalog_cache_path(out_dir()), ttl_hours)
+    connect, source = (synapse_connect, synapse_column_source) if engine == "synapse" else (databricks_connect, databricks_column_source)
+    cons = []
+    def make_source() -> ColumnSource:
+        cons.append(connect())
+        return source(cons[0], **scope)
+
+    try:
+        kind = cache.refresh_columns(engine, make_source, scope_key(scope), force=refresh)
+    finally:
+        for con in cons:
+            con.close()
+    sigs = cache.signatures(engine)
+    print(f"Column cache: {kind}, {len(sigs)} {engine} objects with columns ({cache.path})")
+    return sigs
+
+
+def add_catalog_args(ap) -> None:
+    ap.add_argument("--ttl-hours", type=float, default=24.0, help="Reuse the cached object list for this long")
+    ap.add_argument("--refresh", action="store_true", help="Re-read the full object list into the catalog cache")
+    ap.add_argument("--no-columns", action="store_true", help="Skip the column listing (mapping then matches on names only)")
+
+
+def show_catalog_refresh(engine: str, ttl_hours: float = 24.0, refresh: bool = False) -> None:
+    # --dry-run for the inventory scripts: what refresh_catalog would query, without connecting.
+    path = catalog_cache_path(out_dir())
+    snap = CatalogCache(path, ttl_hours).snapshot(engine) if path.exists() else None
+    if snap is not None and snap[2] and not refresh:
+        print(f"Catalog cache: {engine} objects listed {snap[0]}, within --ttl-hours; no query would run ({path})")
+        return
+    since = snap[1] if snap is not None and not refresh else None
+    if engine == "synapse":
+        show_sql(f"synapse: {'objects changed since ' + since if since else 'all objects'}", synapse_objects_sql(since))
+        if since:
+            show_sql("synapse: object count, to notice drops", SYNAPSE_OBJECT_COUNT_SQL)
+    else:
+        # The listing itself selects whichever name / type / change columns the probe finds.
+        show_sql(f"databricks: column probe, then {'objects changed since ' + since if since else 'all objects'} from {MONITORING_TABLE}", monitoring_probe_sql())
+
+
+def show_columns_refresh(engine: str, scope: Dict[str, List[str]], ttl_hours: float = 24.0, refresh: bool = False) -> None:
+    # --dry-run counterpart of refresh_columns.
+    path = catalog_cache_path(out_dir())
+    snap = CatalogCache(path, ttl_hours).column_snapshot(engine) if path.exists() else None
+    if snap is not None and snap[2] and snap[1] == scope_key(scope) and not refresh:
+        print(f"Column cache: {engine} columns listed {snap[0]}, within --ttl-hours; no query would run ({path})")
+        return
+    if engine == "synapse":
+        show_sql("synapse: columns of every object, then row counts per table", *synapse_columns_sql(**scope))
+    else:
+        show_sql(
+            f"databricks: columns of every object, then row counts if {MONITORING_TABLE} has a row count column",
+            databricks_columns_sql(**scope),
+            monitoring_probe_sql(),
+        )
+
+
+KEY_TYPES = ("int64", "decimal", "float64", "date", "datetime", "string", "string_ci")
+
+
+def parse_key_types(specs: Optional[List[str]]) -> Dict[str, str]:
+    # ["DateID=int64", "Amount=decimal:2", "Name=string_ci"] -> {key: type}
+    out = {}
+    for spec in specs or []:
+        key, _, typ = spec.partition("=")
+        if typ.split(":", 1)[0] not in KEY_TYPES:
+            raise SystemExit(f"Unknown key type in {spec!r}; expected one of {', '.join(KEY_TYPES)}")
+        out[key] = typ
+    return out
+
+
+def _decimal_scale(v: decimal.Decimal) -> int:
+    v = v.normalize()
+    return max(0, -v.as_tuple().exponent)
+
+
+def _key_kind(s: pd.Series) -> Optional[str]:
+    s = s.dropna()
+    if s.empty:
+        return None
+    if pd.api.types.is_bool_dtype(s) or pd.api.types.is_integer_dtype(s):
+        return "int64"
+    if pd.api.types.is_float_dtype(s):
+        return "int64" if bool((s == s.round()).all()) else "float64"
+    if pd.api.types.is_datetime64_any_dtype(s):
+        return "date" if bool((s == s.dt.normalize()).all()) else "datetime"
+    first = s.iloc[0]
+    if isinstance(first, decimal.Decimal):
+        scale = max(_decimal_scale(v) for v in s)
+        return f"decimal:{scale}" if scale else "int64"
+    if isinstance(first, datetime.datetime):
+        return "datetime"
+    if isinstance(first, datetime.date):
+        return "date"
+    return "string"
+
+
+def infer_key_type(a: pd.Series, b: pd.Series) -> str:
+    kinds = {k for k in (_key_kind(a), _key_kind(b)) if k}
+    if not kinds:
+        return "string"
+    if len(kinds) == 1:
+        return kinds.pop()
+    if "string" in kinds:
+        return "string"
+    if kinds <= {"date", "datetime"}:
+        return "datetime"
+    if "float64" in kinds:
+        return "float64"
+    scales = [int(k.split(":", 1)[1]) for k in kinds if k.startswith("decimal:")]
+    return f"decimal:{max(scales)}" if scales else "int64"
+
+
+def _as_text(s: pd.Series) -> pd.Series:
+    return s.astype(object).where(s.notna()).map(lambda v: v if v is None or isinstance(v, str) else str(v), na_action="ignore")
+
+
+def cast_key(s: pd.Series, key_type: str) -> pd.Series:
+    typ, _, arg = key_type.partition(":")
+    if typ == "int64":
+        if s.dtype == object:
+            s = s.map(int, na_action="ignore")
+        s = pd.to_numeric(s)
+        return s.astype("Int64" if s.isna().any() else "int64")
+    if typ == "float64":
+        return pd.to_numeric(s).astype("float64")
+    if typ == "date":
+        return pd.to_datetime(s).dt.normalize()
+    if typ == "datetime":
+        return pd.to_datetime(s)
+    if typ == "decimal":
+        q = decimal.Decimal(1).scaleb(-int(arg or 0))
+        return s.map(lambda v: str(decimal.Decimal(str(v)).quantize(q)), na_action="ignore")
+    s = _as_text(s)
+    if typ == "string_ci":
+        # Synapse default collations are case-insensitive and ignore trailing spaces
+        s = s.map(lambda v: v.rstrip().casefold(), na_action="ignore")
+    return s
+
+
+def normalize_keys(
+    syn_df: pd.DataFrame, dbx_df: pd.DataFrame, keys: List[str], key_types: Optional[Dict[str, str]] = None
+) -> Dict[str, str]:
+    # Casts key columns of both frames in place to one compact shared dtype so the
+    # merge compares typed values (1.0 == 1) instead of their text. Text keys
+    # become categoricals over the union of both sides' values.
+    resolved = {}
+    for k in keys:
+        typ = (key_types or {}).get(k) or infer_key_type(syn_df[k], dbx_df[k])
+        a = cast_key(syn_df[k], typ)
+        b = cast_key(dbx_df[k], typ)
+        if typ.split(":", 1)[0] in ("decimal", "string", "string_ci"):
+            cats = pd.Index(pd.concat([a, b], ignore_index=True).dropna().unique())
+            a = pd.Categorical(a, categories=cats)
+            b = pd.Categorical(b, categories=cats)
+        syn_df[k] = a
+        dbx_df[k] = b
+        resolved[k] = typ
+    return resolved
+
+
+def _numeric_block(df: pd.DataFrame) -> np.ndarray:
+    if not all(pd.api.types.is_numeric_dtype(t) for t in df.dtypes):
+        df = df.apply(pd.to_numeric, errors="coerce")
+    if all(pd.api.types.is_integer_dtype(t) or pd.api.types.is_bool_dtype(t) for t in df.dtypes):
+        return df.to_numpy(dtype="int64", na_value=0)
+    return df.to_numpy(dtype="float64", na_value=0.0)
+
+
+def result_cache(enabled: bool = True, refresh: bool = False) -> Optional[ResultCache]:
+    if not enabled:
+        return None
+    max_mb = int(load_settings().get("cache", {}).get("maxMB", 1024))
+    return ResultCache(out_dir() / "result_cache", max_mb * 1024 * 1024, refresh)
+
+
+def add_metric_diffs(merged: pd.DataFrame) -> List[str]:
+    # For every <metric>_synapse / <metric>_databricks pair add <metric>_diff,
+    # computed for all metrics in one 2-D numpy pass; returns the diff column names.
+    bases = [c[: -len("_synapse")] for c in merged.columns if c.endswith("_synapse")]
+    bases = [b for b in bases if b + "_databricks" in merged.columns]
+    if not bases:
+        return []
+
+    syn = _numeric_block(merged[[b + "_synapse" for b in bases]])
+    dbx = _numeric_block(merged[[b + "_databricks" for b in bases]])
+    if syn.dtype != dbx.dtype:
+        syn, dbx = syn.astype("float64"), dbx.astype("float64")
+    diff = dbx - syn
+
+    # integer metrics come back as float once an outer merge introduces NaNs
+    if syn.dtype.kind == "f":
+        both = np.vstack([syn, dbx])
+        integral = np.all((np.mod(both, 1) == 0) & (np.abs(both) < 2**53), axis=0)
+    else:
+        integral = np.zeros(len(bases), dtype=bool)
+
+    for i, b in enumerate(bases):
+        cast = (lambda a: a.astype("int64")) if integral[i] else (lambda a: a)
+        merged[b + "_synapse"] = cast(syn[:, i])
+        merged[b + "_databricks"] = cast(dbx[:, i])
+        merged[b + "_diff"] = cast(diff[:, i])
+    return [b + "_diff" for b in bases]
+
+
+# approx_distinct metrics: Synapse APPROX_COUNT_DISTINCT is documented within 2% of
+# the true count with 97% probability; Databricks approx_count_distinct is asked for
+# a 1% relative standard deviation, of which 3 sigma is allowed.
+APPROX_PREFIX = "approx_distinct_"
+SYNAPSE_APPROX_ERROR = 0.02
+DATABRICKS_APPROX_RSD = 0.01
+APPROX_TOLERANCE = SYNAPSE_APPROX_ERROR + 3 * DATABRICKS_APPROX_RSD
+
+
+def approx_bound(merged: pd.DataFrame, base: str) -> pd.Series:
+    # Largest difference two sketches of the same data can show.
+    syn = pd.to_numeric(merged[base + "_synapse"], errors="coerce").abs()
+    dbx = pd.to_numeric(merged[base + "_databricks"], errors="coerce").abs()
+    return np.ceil(APPROX_TOLERANCE * np.maximum(syn.fillna(0), dbx.fillna(0))).astype("int64")
+
+
+def add_approx_bounds(merged: pd.DataFrame, diff_cols: List[str]) -> None:
+    for c in diff_cols:
+        if c.startswith(APPROX_PREFIX):
+            base = c[: -len("_diff")]
+            merged.insert(merged.columns.get_loc(c) + 1, base + "_bound", approx_bound(merged, base))
 
 
-def databricks_connect() -> dbsql.Connection:
-    host = require_env("DATABRICKS_SERVER_HOSTNAME")
-    http_path = require_env("DATABRICKS_HTTP_PATH")
-    auth_type = os.getenv("DATABRICKS_AUTH_TYPE", "azure-cli")
-    return dbsql.connect(server_hostname=host, http_path=http_path, auth_type=auth_type)
+def mismatch_rows(merged: pd.DataFrame, diff_cols: List[str], indicator: Optional[str] = "_merge") -> pd.Series:
+    # Exact metrics must match; approx_distinct ones only need to agree within approx_bound.
+    exact = [c for c in diff_cols if not c.startswith(APPROX_PREFIX)]
+    differs = pd.Series(merged[exact].to_numpy().any(axis=1), index=merged.index) if exact else pd.Series(False, index=merged.index)
+    for c in diff_cols:
+        if c.startswith(APPROX_PREFIX):
+            differs |= pd.to_numeric(merged[c], errors="coerce").abs() > approx_bound(merged, c[: -len("_diff")])
+    if indicator and indicator in merged.columns:
+        differs |= merged[indicator] != "both"
+    return differs
 
 
-def safe_filename(s: str) -> str:
-    return re.sub(r"[^A-Za-z0-9_]+", "_", s)
+def with_totals_row(rows: pd.DataFrame, merged: pd.DataFrame, keys: List[str]) -> pd.DataFrame:
+    # Appends a row (first key = "TOTAL") summing every numeric column over all of `merged`.
+    totals = {c: merged[c].sum() for c in merged.columns if c not in keys and pd.api.types.is_numeric_dtype(merged[c])}
+    totals.update({k: None for k in keys})
+    totals[keys[0]] = "TOTAL"
+    rows = rows.astype({k: object for k in keys})
+    return pd.concat([rows, pd.DataFrame([totals])], ignore_index=True)
+
+
+def results_dir() -> Path:
+    # Shared with ddr-compare when both point COMPARE_RESULTS_DIR at one folder.
+    return Path(os.getenv("COMPARE_RESULTS_DIR") or out_dir() / "results")
 
 
 def normalize_name(name: str, strip_prefixes: List[str]) -> str:
@@ -64,11 +400,84 @@ def normalize_name(name: str, strip_prefixes: List[str]) -> str:
     return s
 
 
+def name_tokens(s: str) -> set:
+    return set(s.split("_")) - {""}
+
+
 def jaccard_tokens(a: str, b: str) -> float:
-    sa = set(a.split("_")) - {""}
-    sb = set(b.split("_")) - {""}
+    sa = name_tokens(a)
+    sb = name_tokens(b)
     if not sa and not sb:
         return 1.0
     if not sa or not sb:
         return 0.0
     return len(sa & sb) / len(sa | sb)
+
+
+class TokenIndex:
+    # Inverted index (token -> positions) over normalized names. best_match()
+    # scores only candidates sharing a token and returns the same
+    # (position, score) a linear jaccard_tokens() scan would: highest score,
+    # first position on ties, position 0 with score 0.0 when nothing overlaps.
+
+    def __init__(self, norms: List[str]):
+        self.size = len(norms)
+        token_sets = [name_tokens(n) for n in norms]
+        self.sizes = np.fromiter((len(t) for t in token_sets), dtype=np.int64, count=self.size)
+
+        postings: Dict[str, List[int]] = {}
+        for pos, toks in enumerate(token_sets):
+            for t in toks:
+                postings.setdefault(t, []).append(pos)
+        self.postings = {t: np.asarray(p, dtype=np.int64) for t, p in postings.items()}
+
+        empty = np.flatnonzero(self.sizes == 0)
+        self.first_empty = int(empty[0]) if len(empty) else None
+
+    def best_match(self, norm: str) -> Optional[Tuple[int, float]]:
+        if self.size == 0:
+            return None
+
+        toks = name_tokens(norm)
+        if not toks:
+            if self.first_empty is not None:
+                return self.first_empty, 1.0
+            return 0, 0.0
+
+        lists = [self.postings[t] for t in toks if t in self.postings]
+        if not lists:
+            return 0, 0.0
+
+        cand, inter = np.unique(np.concatenate(lists), return_counts=True)
+        scores = inter / (len(toks) + self.sizes[cand] - inter)
+        best = int(np.argmax(scores))
+        return int(cand[best]), float(scores[best])
+
+
+class SignatureIndex:
+    # Column-signature hash -> positions, for the name:type signature and the
+    # names-only one. lookup() is a dict probe, so confirming or finding a match
+    # by shape costs the same at any catalog size. Objects with fewer than
+    # min_columns columns are left out: shapes like (id, name) identify nothing.
+
+    def __init__(self, signatures: List[Any], names_signatures: List[Any], n_columns: List[Any], min_columns: int = 3):
+        self.min_columns = min_columns
+        self.typed: Dict[str, List[int]] = {}
+        self.names: Dict[str, List[int]] = {}
+        for pos, (sig, names_sig, n) in enumerate(zip(signatures, names_signatures, n_columns)):
+            if self.usable(sig, n):
+                self.typed.setdefault(sig, []).append(pos)
+                self.names.setdefault(names_sig, []).append(pos)
+
+    def usable(self, signature: Any, n_columns: Any) -> bool:
+        return isinstance(signature, str) and pd.notna(n_columns) and n_columns >= self.min_columns
+
+    def lookup(self, signature: Any, names_signature: Any, n_columns: Any) -> Tuple[List[int], Optional[str]]:
+        # (positions, "columns" for same names and types | "column_names" for same names only)
+        if not self.usable(signature, n_columns):
+            return [], None
+        if signature in self.typed:
+            return self.typed[signature], "columns"
+        if names_signature in self.names:
+            return self.names[names_signature], "column_names"
+        return [], None
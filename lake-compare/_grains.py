@@ -0,0 +1,115 @@
+﻿from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+GROUPING_PREFIX = "grouping_"
+TOTAL = "total"
+
+
+def parse_grains(specs: List[str]) -> List[List[str]]:
+    # "DateID,Platform" -> ["DateID", "Platform"]; "total" -> [] (the whole table).
+    grains: List[List[str]] = []
+    for spec in specs:
+        cols = [] if spec.strip().lower() == TOTAL else [c.strip() for c in spec.split(",") if c.strip()]
+        if not cols and spec.strip().lower() != TOTAL:
+            raise ValueError(f"Empty grain: {spec!r} (use {TOTAL!r} for the whole table)")
+        if not any(set(cols) == set(g) for g in grains):
+            grains.append(cols)
+    return grains
+
+
+def grain_label(grain: List[str]) -> str:
+    return "+".join(grain) or TOTAL
+
+
+def grain_chains(grains: List[List[str]]) -> List[List[List[str]]]:
+    # Groups grains, coarse first, into chains where each grain contains the previous one.
+    chains: List[List[List[str]]] = []
+    for g in sorted(grains, key=len):
+        for chain in chains:
+            if set(chain[-1]) <= set(g):
+                chain.append(g)
+                break
+        else:
+            chains.append([g])
+    return chains
+
+
+def key_text(df: pd.DataFrame, cols: List[str]) -> pd.Series:
+    if not cols:
+        return pd.Series(TOTAL, index=df.index)
+    parts = [c + "=" + df[c].astype(object).where(df[c].notna(), "NULL").astype(str) for c in cols]
+    text = parts[0]
+    for p in parts[1:]:
+        text = text + ", " + p
+    return text
+
+
+@dataclass
+class Grains:
+    # Several key sets compared from one aggregate query per engine. Every result
+    # row carries grouping_<key> flags (1 = aggregated away) that tell which grain
+    # it belongs to; `split` turns the mixed result back into one frame per grain.
+    grains: List[List[str]]
+
+    @property
+    def keys(self) -> List[str]:
+        return list(dict.fromkeys(k for g in self.grains for k in g))
+
+    def sql(self, metric_parts: List[str], source: str, synapse: bool) -> str:
+        flag = lambda k: f"{GROUPING_PREFIX}{k}"
+        if not synapse:
+            flags = [f"GROUPING({k}) AS {flag(k)}" for k in self.keys]
+            sets = ", ".join(f"({', '.join(g)})" for g in self.grains)
+            return f"SELECT {', '.join([*self.keys, *flags, *metric_parts])} FROM {source}{{where}} GROUP BY GROUPING SETS ({sets})"
+
+        # Dedicated SQL pools have ROLLUP but no GROUPING SETS: one ROLLUP per chain
+        # of nested grains (normally a single chain, so a single scan). Rollup
+        # levels that were not asked for are dropped by split().
+        branches = []
+        for chain in grain_chains(self.grains):
+            fixed = chain[0]
+            rolled = list(dict.fromkeys(k for g in chain[1:] for k in g if k not in fixed))
+            cols = [*fixed, *rolled]
+            select = [k if k in cols else f"NULL AS {k}" for k in self.keys]
+            select += [f"{f'GROUPING({k})' if k in rolled else ('0' if k in fixed else '1')} AS {flag(k)}" for k in self.keys]
+            group = [*fixed, *([f"ROLLUP({', '.join(rolled)})"] if rolled else [])]
+            branches.append(
+                f"SELECT {', '.join([*select, *metric_parts])} FROM {source}{{where}}" + (f" GROUP BY {', '.join(group)}" if group else "")
+            )
+        return " UNION ALL ".join(branches)
+
+    def split(self, df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+        flag_cols = [GROUPING_PREFIX + k for k in self.keys]
+        flags = df[flag_cols].astype("int64").to_numpy()
+        parts = {}
+        for g in self.grains:
+            want = np.array([0 if k in g else 1 for k in self.keys], dtype="int64")
+            part = df[(flags == want).all(axis=1)]
+            parts[grain_label(g)] = part.drop(columns=[*flag_cols, *(k for k in self.keys if k not in g)]).reset_index(drop=True)
+        return parts
+
+    def parent(self, grain: List[str]) -> Optional[List[str]]:
+        # The finest requested grain strictly coarser than `grain` that it refines.
+        coarser = [g for g in self.grains if set(g) < set(grain)]
+        return max(coarser, key=len) if coarser else None
+
+    def drilldown(self, merged: Dict[str, pd.DataFrame], bad: Dict[str, pd.Series], value_cols: List[str]) -> pd.DataFrame:
+        # Mismatching groups of every grain, coarse first, each linked to the group
+        # of its parent grain (parent_grain / parent_key) so a bad total or day can
+        # be followed down to the finer groups that explain it.
+        frames = []
+        for g in sorted(self.grains, key=len):
+            label = grain_label(g)
+            rows = merged[label][bad[label]]
+            parent = self.parent(g)
+            frame = pd.DataFrame({
+                "grain": label,
+                "key": key_text(rows, g),
+                "parent_grain": grain_label(parent) if parent is not None else None,
+                "parent_key": key_text(rows, parent) if parent is not None else None,
+            }, index=rows.index)
+            frames.append(pd.concat([frame, rows[[c for c in value_cols if c in rows.columns]]], axis=1))
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
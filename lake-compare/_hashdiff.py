@@ -0,0 +1,299 @@
+﻿import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+NULL_TOKEN = "#null#"
+SEP = "|"
+# Synapse text is rendered as UTF-8 varchar, so HASHBYTES sees the same bytes as
+# Databricks md5() (a code-page varchar would turn non-Latin characters into '?').
+SYNAPSE_UTF8 = "Latin1_General_100_CI_AS_SC_UTF8"
+
+INT_TYPES = {"tinyint", "smallint", "int", "bigint"}
+DECIMAL_TYPES = {"decimal", "numeric", "money", "smallmoney"}
+FLOAT_TYPES = {"float", "real"}
+DATETIME_TYPES = {"datetime", "datetime2", "smalldatetime", "datetimeoffset"}
+
+
+def column_classes(columns: pd.DataFrame) -> Dict[str, Tuple[str, int]]:
+    # INFORMATION_SCHEMA rows (name, type, scale) -> {name: (class, scale)}
+    out = {}
+    for _, r in columns.iterrows():
+        cls = column_class(r["type"])
+        if cls == "decimal":
+            scale = int(r["scale"]) if pd.notna(r["scale"]) else 0
+        elif cls == "float":
+            scale = 6
+        else:
+            scale = 0
+        out[str(r["name"])] = (cls, scale)
+    return out
+
+
+def column_class(data_type: str) -> str:
+    t = str(data_type).lower()
+    if t in INT_TYPES:
+        return "int"
+    if t in DECIMAL_TYPES:
+        return "decimal"
+    if t in FLOAT_TYPES:
+        return "float"
+    if t == "bit":
+        return "bit"
+    if t == "date":
+        return "date"
+    if t in DATETIME_TYPES:
+        return "datetime"
+    if t == "uniqueidentifier":
+        return "guid"
+    return "string"
+
+
+@dataclass(frozen=True)
+class Dialect:
+    name: str
+
+    @property
+    def synapse(self) -> bool:
+        return self.name == "synapse"
+
+    def ident(self, col: str) -> str:
+        return f"[{col}]" if self.synapse else f"`{col}`"
+
+    def literal(self, v: str) -> str:
+        if self.synapse:
+            return "'" + v.replace("'", "''") + "'"
+        return "'" + v.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+    def count(self) -> str:
+        return "COUNT_BIG(*)" if self.synapse else "COUNT(*)"
+
+    def norm(self, col: str, cls: str, scale: int = 0) -> str:
+        # Render a value as the same text on both engines so row hashes agree.
+        c = self.ident(col)
+        if self.synapse:
+            if cls == "int":
+                return f"CONVERT(VARCHAR(40), {c})"
+            if cls in ("decimal", "float"):
+                return f"CONVERT(VARCHAR(60), CAST({c} AS DECIMAL(38, {scale})))"
+            if cls == "bit":
+                return f"CONVERT(VARCHAR(1), {c})"
+            if cls == "date":
+                return f"CONVERT(VARCHAR(10), {c}, 23)"
+            if cls == "datetime":
+                # Cut to milliseconds, as date_format's .SSS does; CAST(... AS DATETIME2(3)) would round.
+                return f"LEFT(CONVERT(VARCHAR(27), {c}, 121), 23)"
+            if cls == "guid":
+                return f"LOWER(CONVERT(VARCHAR(36), {c}))"
+            return f"CONVERT(VARCHAR(MAX), CONVERT(NVARCHAR(MAX), {c}) COLLATE {SYNAPSE_UTF8})"
+        if cls in ("decimal", "float"):
+            return f"CAST(CAST({c} AS DECIMAL(38, {scale})) AS STRING)"
+        if cls == "bit":
+            return f"CAST(CAST({c} AS INT) AS STRING)"
+        if cls == "date":
+            return f"date_format({c}, 'yyyy-MM-dd')"
+        if cls == "datetime":
+            return f"date_format({c}, 'yyyy-MM-dd HH:mm:ss.SSS')"
+        if cls == "guid":
+            return f"LOWER(CAST({c} AS STRING))"
+        return f"CAST({c} AS STRING)"
+
+    def concat(self, parts: List[str]) -> str:
+        parts = [f"COALESCE({p}, '{NULL_TOKEN}')" for p in parts]
+        if len(parts) == 1:
+            return parts[0]
+        return f"CONCAT_WS('{SEP}', {', '.join(parts)})"
+
+    def hash32(self, expr: str) -> str:
+        # First 4 bytes of MD5 as an unsigned 32-bit BIGINT; identical on both engines.
+        if self.synapse:
+            return f"CONVERT(BIGINT, SUBSTRING(HASHBYTES('MD5', {expr}), 1, 4))"
+        return f"CAST(conv(substr(md5({expr}), 1, 8), 16, 10) AS BIGINT)"
+
+
+SYNAPSE = Dialect("synapse")
+DATABRICKS = Dialect("databricks")
+
+
+@dataclass
+class Side:
+    dialect: Dialect
+    table: str
+    run: Callable[[str], pd.DataFrame]
+    queries: int = 0
+    rows: int = 0
+
+    def query(self, sql: str) -> pd.DataFrame:
+        df = self.run(sql)
+        self.queries += 1
+        self.rows += len(df)
+        return df
+
+
+@dataclass
+class HashDiff:
+    # Order-independent bucket checksums (COUNT + SUM of a 32-bit row hash) are
+    # computed on both engines. Level 0 buckets on the first key; deeper levels
+    # split mismatching buckets by ranges (modulo fanout^depth) of the key hash,
+    # or of the row hash when only one key is given. Only leaf buckets of at most
+    # `leaf_rows` rows are fetched, so transfer scales with the differences.
+    keys: List[str]
+    columns: List[str]
+    classes: Dict[str, Tuple[str, int]]
+    fanout: int = 16
+    leaf_rows: int = 1000
+    log: Callable[[str], None] = print
+    levels: List[dict] = field(default_factory=list)
+
+    @property
+    def keyed(self) -> bool:
+        return len(self.keys) > 1
+
+    @property
+    def max_depth(self) -> int:
+        d = 0
+        while self.fanout ** (d + 1) <= 2**32:
+            d += 1
+        return d
+
+    def _norm(self, d: Dialect, col: str) -> str:
+        cls, scale = self.classes[col]
+        return d.norm(col, cls, scale)
+
+    def _inner(self, d: Dialect, table: str, top_values: Optional[List[str]], extra: str = "") -> str:
+        b0 = self._norm(d, self.keys[0])
+        rh = d.hash32(d.concat([self._norm(d, c) for c in self.columns]))
+        kh = d.hash32(d.concat([self._norm(d, k) for k in self.keys[1:]])) if self.keyed else rh
+        where = ""
+        if top_values is not None:
+            where = f" WHERE {self._top_filter(d, top_values)}"
+        return f"SELECT COALESCE({b0}, '{NULL_TOKEN}') AS b0, {kh} AS kh, {rh} AS h{extra} FROM {table}{where}"
+
+    def _top_filter(self, d: Dialect, values: List[str]) -> str:
+        # Filter on the raw first key where possible so the engines can prune.
+        key = self.keys[0]
+        cls, _ = self.classes[key]
+        vals = [v for v in values if v != NULL_TOKEN]
+        parts = []
+        if vals:
+            if cls == "int":
+                parts.append(f"{d.ident(key)} IN ({', '.join(str(int(v)) for v in vals)})")
+            else:
+                parts.append(f"{self._norm(d, key)} IN ({', '.join(d.literal(v) for v in vals)})")
+        if len(vals) < len(values):
+            parts.append(f"{d.ident(key)} IS NULL")
+        return "(" + " OR ".join(parts) + ")"
+
+    def _bucket_filter(self, d: Dialect, parents: List[Tuple[str, int]], modulus: int) -> str:
+        if modulus == 1:
+            return ""
+        conds = [f"(b0 = {d.literal(b0)} AND kh % {modulus} = {int(b)})" for b0, b in parents]
+        return " WHERE " + " OR ".join(conds)
+
+    def bucket_sql(self, d: Dialect, table: str, depth: int, parents: Optional[List[Tuple[str, int]]]) -> str:
+        modulus = self.fanout ** depth
+        top = None if parents is None else sorted({p[0] for p in parents})
+        inner = self._inner(d, table, top)
+        parent_filter = "" if parents is None else self._bucket_filter(d, parents, self.fanout ** (depth - 1))
+        return (
+            f"SELECT b0, b, {d.count()} AS cnt, SUM(h) AS hsum FROM ("
+            f"SELECT b0, kh % {modulus} AS b, h FROM ({inner}) x{parent_filter}"
+            ") y GROUP BY b0, b"
+        )
+
+    def leaf_sql(self, d: Dialect, table: str, depth: int, leaves: List[Tuple[str, int]]) -> str:
+        k = d.concat([self._norm(d, c) for c in self.keys])
+        cols = "".join(f", COALESCE({self._norm(d, c)}, '{NULL_TOKEN}') AS {d.ident(c)}" for c in self.columns)
+        inner = self._inner(d, table, sorted({p[0] for p in leaves}), extra=f", {k} AS _k{cols}")
+        col_list = ", ".join(d.ident(c) for c in self.columns)
+        return f"SELECT _k, h AS _h, {col_list} FROM ({inner}) x{self._bucket_filter(d, leaves, self.fanout ** depth)}"
+
+    def _levels(self, syn: Side, dbx: Side, depth: int, parents, batch: int) -> pd.DataFrame:
+        chunks = [None] if parents is None else [parents[i : i + batch] for i in range(0, len(parents), batch)]
+        frames = []
+        for chunk in chunks:
+            s = syn.query(self.bucket_sql(syn.dialect, syn.table, depth, chunk))
+            x = dbx.query(self.bucket_sql(dbx.dialect, dbx.table, depth, chunk))
+            for df in (s, x):
+                df.columns = [c.lower() for c in df.columns]
+                df["b0"] = df["b0"].astype(str)
+                df["b"] = df["b"].astype("int64")
+            frames.append(s.merge(x, on=["b0", "b"], how="outer", suffixes=("_synapse", "_databricks")))
+        merged = pd.concat(frames, ignore_index=True)
+        for c in ("cnt_synapse", "cnt_databricks", "hsum_synapse", "hsum_databricks"):
+            merged[c] = pd.to_numeric(merged[c], errors="coerce").fillna(0).astype("int64")
+        return merged
+
+    def _leaf_rows(self, syn: Side, dbx: Side, depth: int, leaves, batch: int) -> pd.DataFrame:
+        frames = []
+        for i in range(0, len(leaves), batch):
+            chunk = leaves[i : i + batch]
+            s = syn.query(self.leaf_sql(syn.dialect, syn.table, depth, chunk))
+            x = dbx.query(self.leaf_sql(dbx.dialect, dbx.table, depth, chunk))
+            frames.append(self.diff_rows(s, x))
+        if not frames:
+            return pd.DataFrame(columns=["status"])
+        return pd.concat(frames, ignore_index=True)
+
+    def diff_rows(self, syn_rows: pd.DataFrame, dbx_rows: pd.DataFrame) -> pd.DataFrame:
+        cols = {c.lower(): c for c in ["_k", "_h", *self.columns]}
+        syn_rows = syn_rows.rename(columns=lambda c: cols.get(c.lower(), c))
+        dbx_rows = dbx_rows.rename(columns=lambda c: cols.get(c.lower(), c))
+        on = ["_k"]
+        if not self.keyed:
+            # No row identity: treat each side as a multiset of row hashes.
+            for df in (syn_rows, dbx_rows):
+                df["_n"] = df.groupby("_h").cumcount()
+            on = ["_h", "_n"]
+
+        m = syn_rows.merge(dbx_rows, on=on, how="outer", suffixes=("_synapse", "_databricks"), indicator=True)
+        m["status"] = m["_merge"].map({"left_only": "missing_in_databricks", "right_only": "missing_in_synapse", "both": "different"})
+        if self.keyed:
+            m = m[(m["_merge"] != "both") | (m["_h_synapse"] != m["_h_databricks"])].copy()
+            m["diff_columns"] = [
+                ",".join(c for c in self.columns if r[f"{c}_synapse"] != r[f"{c}_databricks"]) if r["_merge"] == "both" else ""
+                for _, r in m.iterrows()
+            ]
+        else:
+            m = m[m["_merge"] != "both"].copy()
+        m = m.drop(columns=["_merge"])
+        lead = [c for c in ("status", "diff_columns") if c in m.columns]
+        return m[lead + [c for c in m.columns if c not in lead]]
+
+    def run(self, syn: Side, dbx: Side, batch: int = 200) -> pd.DataFrame:
+        depth = 0
+        parents = None
+        results = []
+        while True:
+            started = time.perf_counter()
+            buckets = self._levels(syn, dbx, depth, parents, batch)
+            bad = buckets[
+                (buckets["cnt_synapse"] != buckets["cnt_databricks"]) | (buckets["hsum_synapse"] != buckets["hsum_databricks"])
+            ]
+            small = bad[bad[["cnt_synapse", "cnt_databricks"]].max(axis=1) <= self.leaf_rows]
+            at_bottom = depth >= self.max_depth
+            leaves = bad if at_bottom else small
+            drill = bad.drop(leaves.index)
+
+            leaf_keys = list(zip(leaves["b0"], leaves["b"]))
+            if leaf_keys:
+                results.append(self._leaf_rows(syn, dbx, depth, leaf_keys, batch))
+
+            self.levels.append({
+                "depth": depth,
+                "buckets": int(len(buckets)),
+                "mismatched": int(len(bad)),
+                "leaves": int(len(leaves)),
+                "seconds": round(time.perf_counter() - started, 3),
+            })
+            self.log(f"Level {depth}: buckets={len(buckets)} mismatched={len(bad)} leaves={len(leaves)}")
+
+            if drill.empty:
+                break
+            parents = list(zip(drill["b0"], drill["b"]))
+            depth += 1
+
+        if not results:
+            return pd.DataFrame(columns=["status"])
+        return pd.concat(results, ignore_index=True)
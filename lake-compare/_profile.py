@@ -0,0 +1,109 @@
+﻿import decimal
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from _hashdiff import Dialect
+
+# Stats computed per column class. Sums are taken over DECIMAL(38, scale) on both
+# engines so they neither overflow nor depend on float summation order; text-valued
+# min/max use the same normalized text as hash-diff, compared in binary order.
+CLASS_STATS = {
+    "int": ["nulls", "min", "max", "sum"],
+    "decimal": ["nulls", "min", "max", "sum"],
+    "float": ["nulls", "min", "max", "sum"],
+    "bit": ["nulls", "trues"],
+    "date": ["nulls", "min", "max"],
+    "datetime": ["nulls", "min", "max"],
+    "guid": ["nulls", "min", "max"],
+    "string": ["nulls", "min_len", "max_len", "sum_len", "min", "max"],
+}
+NUMERIC_CLASSES = {"int", "decimal", "float"}
+# Byte order of the UTF-8 text (what the shared normalization produces), as Databricks compares strings.
+BIN2 = " COLLATE Latin1_General_100_BIN2_UTF8"
+
+
+def _exact(v) -> Optional[decimal.Decimal]:
+    if v is None or (isinstance(v, float) and v != v):
+        return None
+    try:
+        return decimal.Decimal(str(v))
+    except decimal.InvalidOperation:
+        return None
+
+
+@dataclass
+class Profile:
+    # Every stat of every column in one aggregate query per engine, optionally
+    # grouped by `keys`. Result columns are aliased p<i>_<stat> (i = position in
+    # `columns`) so wide tables and awkward column names stay within identifier
+    # limits; `report` maps them back to (column, stat) rows.
+    keys: List[str]
+    columns: List[str]
+    classes: Dict[str, Tuple[str, int]]
+
+    def stats(self) -> List[Tuple[int, str, str]]:
+        return [(i, c, s) for i, c in enumerate(self.columns) for s in CLASS_STATS[self.classes[c][0]]]
+
+    def expr(self, d: Dialect, col: str, stat: str) -> str:
+        cls, scale = self.classes[col]
+        c = d.ident(col)
+        count = "COUNT_BIG" if d.synapse else "COUNT"
+        if stat == "nulls":
+            return f"{count}(*) - {count}({c})"
+        if stat == "trues":
+            return f"{count}(CASE WHEN {c} = 1 THEN 1 END)" if d.synapse else f"{count}(CASE WHEN CAST({c} AS INT) = 1 THEN 1 END)"
+        if stat == "sum":
+            return f"SUM(CAST({c} AS DECIMAL(38, {scale})))"
+        if stat in ("min_len", "max_len", "sum_len"):
+            # LEN ignores trailing spaces; RTRIM makes Databricks agree.
+            length = f"CAST(LEN({c}) AS BIGINT)" if d.synapse else f"LENGTH(RTRIM({c}))"
+            return f"{stat[:3].upper()}({length})"
+        if cls in NUMERIC_CLASSES:
+            return f"{stat.upper()}({c})"
+        text = d.norm(col, cls, scale) + (BIN2 if d.synapse else "")
+        return f"{stat.upper()}({text})"
+
+    def sql(self, d: Dialect) -> str:
+        keys = [f"{d.ident(k)} AS {d.ident(k)}" for k in self.keys]
+        aggs = [f"{self.expr(d, c, s)} AS p{i}_{s}" for i, c, s in self.stats()]
+        group = f" GROUP BY {', '.join(d.ident(k) for k in self.keys)}" if self.keys else ""
+        return f"SELECT {', '.join([*keys, *aggs])} FROM {{table}}{{where}}{group}"
+
+    def report(self, syn_df: pd.DataFrame, dbx_df: pd.DataFrame) -> pd.DataFrame:
+        # Long format: one row per key group, column and stat.
+        aliases = {f"p{i}_{s}": (c, s) for i, c, s in self.stats()}
+        frames = []
+        for df in (syn_df, dbx_df):
+            df = df.rename(columns=lambda n: n.lower() if n.lower() in aliases else n)
+            # object columns keep ints, Decimals and text as fetched instead of upcasting to float
+            df = df.astype({a: object for a in aliases})
+            long = df.melt(id_vars=self.keys, value_vars=list(aliases), var_name="_alias", value_name="value")
+            frames.append(long)
+
+        on = [*self.keys, "_alias"]
+        m = frames[0].merge(frames[1], on=on, how="outer", suffixes=("_synapse", "_databricks"), indicator=True)
+        m.insert(len(self.keys), "column", m["_alias"].map(lambda a: aliases[a][0]))
+        m.insert(len(self.keys) + 1, "stat", m["_alias"].map(lambda a: aliases[a][1]))
+        m = m.rename(columns={"value_synapse": "synapse", "value_databricks": "databricks"})
+
+        order = {a: n for n, a in enumerate(aliases)}
+        m = m.assign(_order=m["_alias"].map(order)).sort_values([*self.keys, "_order"], kind="stable", ignore_index=True)
+
+        numeric = [s not in ("min", "max") or self.classes[c][0] in NUMERIC_CLASSES for c, s in zip(m["column"], m["stat"])]
+        diffs, match = [], []
+        for is_num, a, b in zip(numeric, m["synapse"], m["databricks"]):
+            if is_num:
+                a, b = _exact(a), _exact(b)
+                diffs.append(float(b - a) if a is not None and b is not None else None)
+            else:
+                a = None if pd.isna(a) else str(a)
+                b = None if pd.isna(b) else str(b)
+                diffs.append(None)
+            match.append(a == b)
+        m["diff"] = pd.to_numeric(pd.Series(diffs, index=m.index, dtype=object))
+        m["match"] = match
+        m.loc[m["_merge"] != "both", "match"] = False
+        m["presence"] = m["_merge"].map({"both": "both", "left_only": "synapse_only", "right_only": "databricks_only"})
+        return m.drop(columns=["_alias", "_merge", "_order"])
@@ -0,0 +1,193 @@
+﻿import datetime
+import decimal
+import math
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from _common import APPROX_PREFIX, APPROX_TOLERANCE, add_approx_bounds, add_metric_diffs, databricks_query
+from _hashdiff import DATABRICKS
+
+
+def spark_type(t: pa.DataType) -> str:
+    if pa.types.is_boolean(t):
+        return "BOOLEAN"
+    if pa.types.is_integer(t):
+        return "BIGINT"
+    if pa.types.is_floating(t):
+        return "DOUBLE"
+    if pa.types.is_decimal(t):
+        return f"DECIMAL({t.precision}, {t.scale})"
+    if pa.types.is_timestamp(t):
+        return "TIMESTAMP"
+    if pa.types.is_date(t):
+        return "DATE"
+    if pa.types.is_binary(t):
+        return "BINARY"
+    return "STRING"
+
+
+def sql_literal(v) -> str:
+    if v is None or (isinstance(v, float) and math.isnan(v)):
+        return "NULL"
+    if isinstance(v, bool):
+        return "TRUE" if v else "FALSE"
+    if isinstance(v, float) and math.isinf(v):
+        # inf is no numeric literal in Spark SQL
+        return f"CAST('{'-' if v < 0 else ''}inf' AS DOUBLE)"
+    if isinstance(v, (int, float)):
+        return repr(v)
+    if isinstance(v, decimal.Decimal):
+        return format(v, "f")
+    if isinstance(v, datetime.datetime):
+        return f"TIMESTAMP '{v.isoformat(sep=' ')}'"
+    if isinstance(v, datetime.date):
+        return f"DATE '{v.isoformat()}'"
+    if isinstance(v, bytes):
+        return f"X'{v.hex()}'"
+    return DATABRICKS.literal(str(v))
+
+
+def column_literals(col: pa.ChunkedArray) -> pa.ChunkedArray:
+    # sql_literal for a whole column. Integers, decimals and strings are rendered
+    # by Arrow compute kernels; other types (floats with inf / NaN, timestamps, ...)
+    # go value by value.
+    t = col.type
+    if pa.types.is_integer(t) or pa.types.is_decimal(t):
+        text = pc.cast(col, pa.string())
+    elif pa.types.is_string(t) or pa.types.is_large_string(t):
+        escaped = pc.replace_substring(pc.replace_substring(col, "\\", "\\\\"), "'", "\\'")
+        text = pc.binary_join_element_wise("'", escaped, "'", "")
+    else:
+        return pa.chunked_array([pa.array([sql_literal(v) for v in col.to_pylist()], pa.string())])
+    return pc.fill_null(text, "NULL")
+
+
+def _execute(con, sql: str) -> None:
+    with con.cursor() as cur:
+        cur.execute(sql)
+
+
+def _count(v) -> int:
+    # SUM over no rows is NULL, which reaches pandas as NaN.
+    return 0 if pd.isna(v) else int(v)
+
+
+@dataclass
+class ServerDiff:
+    # The Synapse aggregate is streamed batch by batch into a Databricks staging
+    # table with multi-row INSERTs of up to insert_bytes of SQL each (one Delta
+    # commit per statement), the Databricks aggregate is materialized next
+    # to it, and the outer match and comparison run inside the warehouse. Only the
+    # mismatching groups and one totals row come back to the client. Both staging
+    # tables are dropped afterwards.
+    keys: List[str]
+    staging_schema: str
+    insert_bytes: int = 8 * 1024 * 1024
+    log: Callable[[str], None] = print
+    uploaded: int = 0
+    upload_seconds: float = 0.0
+
+    def _upload(self, con, table: str, batches: Iterator[pa.Table]) -> List[str]:
+        # Rows are buffered across fetch batches, so statements (and commits)
+        # follow insert_bytes rather than the fetch size.
+        names: List[str] = []
+        pending: List[str] = []
+        size = 0
+
+        def flush() -> None:
+            nonlocal size
+            if pending:
+                started = time.perf_counter()
+                _execute(con, f"INSERT INTO {table} VALUES {', '.join(pending)}")
+                self.upload_seconds += time.perf_counter() - started
+                pending.clear()
+                size = 0
+
+        for batch in batches:
+            if not names:
+                names = batch.column_names
+                cols = ", ".join(f"{DATABRICKS.ident(f.name)} {spark_type(f.type)}" for f in batch.schema)
+                _execute(con, f"CREATE TABLE {table} ({cols})")
+            values = [column_literals(c) for c in batch.columns]
+            joined = values[0] if len(values) == 1 else pc.binary_join_element_wise(*values, ", ")
+            for r in joined.to_pylist():
+                row = f"({r})"
+                pending.append(row)
+                size += len(row) + 2
+                if size >= self.insert_bytes:
+                    flush()
+            self.uploaded += batch.num_rows
+        flush()
+        return names
+
+    def _groups(self, syn_table: str, dbx_table: str, metrics: List[str]) -> str:
+        # UNION ALL + GROUP BY rather than a FULL OUTER JOIN: grouping matches NULL
+        # keys like the client-side merge does, and needs a single aggregation.
+        keys = ", ".join(DATABRICKS.ident(k) for k in self.keys)
+        pairs = [(m, name) for name in ("synapse", "databricks") for m in metrics]
+
+        def side(table: str, mine: str) -> str:
+            values = [f"{DATABRICKS.ident(m) if name == mine else 'NULL'} AS {DATABRICKS.ident(f'{m}_{name}')}" for m, name in pairs]
+            marks = f"{int(mine == 'synapse')} AS _s, {int(mine == 'databricks')} AS _d"
+            return f"SELECT {', '.join([keys, *values, marks])} FROM {table}"
+
+        values = [f"MAX({DATABRICKS.ident(f'{m}_{name}')}) AS {DATABRICKS.ident(f'{m}_{name}')}" for m, name in pairs]
+        return (
+            f"(SELECT {', '.join([keys, *values, 'MAX(_s) AS _s', 'MAX(_d) AS _d'])} FROM "
+            f"({side(syn_table, 'synapse')} UNION ALL {side(dbx_table, 'databricks')}) u GROUP BY {keys}) g"
+        )
+
+    def _differs(self, metrics: List[str]) -> str:
+        # Same rules as mismatch_rows: NULL counts as 0, approx_distinct within its bound is equal.
+        conds = ["_s = 0", "_d = 0"]
+        for m in metrics:
+            s = f"COALESCE({DATABRICKS.ident(m + '_synapse')}, 0)"
+            d = f"COALESCE({DATABRICKS.ident(m + '_databricks')}, 0)"
+            if m.startswith(APPROX_PREFIX):
+                conds.append(f"ABS({d} - {s}) > CEIL({APPROX_TOLERANCE} * GREATEST(ABS({s}), ABS({d})))")
+            else:
+                conds.append(f"{s} <> {d}")
+        return "(" + " OR ".join(conds) + ")"
+
+    def mismatch_sql(self, syn_table: str, dbx_table: str, metrics: List[str]) -> str:
+        return f"SELECT * FROM {self._groups(syn_table, dbx_table, metrics)} WHERE {self._differs(metrics)}"
+
+    def totals_sql(self, syn_table: str, dbx_table: str, metrics: List[str]) -> str:
+        sums = [
+            f"SUM({DATABRICKS.ident(f'{m}_{name}')}) AS {DATABRICKS.ident(f'{m}_{name}')}"
+            for name in ("synapse", "databricks")
+            for m in metrics
+        ]
+        counts = ["COUNT(*) AS _groups", f"COALESCE(SUM(CASE WHEN {self._differs(metrics)} THEN 1 ELSE 0 END), 0) AS _mismatching"]
+        return f"SELECT {', '.join([*counts, *sums])} FROM {self._groups(syn_table, dbx_table, metrics)}"
+
+    def run(self, syn_batches: Iterator[pa.Table], dbx_con, dbx_sql: str) -> Tuple[pd.DataFrame, Dict[str, int]]:
+        stage = f"{self.staging_schema}.lake_compare_{uuid.uuid4().hex[:12]}"
+        syn_table, dbx_table = f"{stage}_s", f"{stage}_d"
+        try:
+            names = self._upload(dbx_con, syn_table, syn_batches)
+            self.log(f"Uploaded {self.uploaded} Synapse groups to {syn_table} in {self.upload_seconds:.2f}s")
+            _execute(dbx_con, f"CREATE TABLE {dbx_table} AS {dbx_sql}")
+            metrics = [n for n in names if n not in self.keys]
+
+            rows = databricks_query(dbx_con, self.mismatch_sql(syn_table, dbx_table, metrics))
+            totals = databricks_query(dbx_con, self.totals_sql(syn_table, dbx_table, metrics)).iloc[0]
+        finally:
+            for t in (syn_table, dbx_table):
+                _execute(dbx_con, f"DROP TABLE IF EXISTS {t}")
+
+        rows = rows.drop(columns=["_s", "_d"])
+        total = {k: None for k in self.keys}
+        total[self.keys[0]] = "TOTAL"
+        for m in metrics:
+            total[f"{m}_synapse"] = totals[f"{m}_synapse"]
+            total[f"{m}_databricks"] = totals[f"{m}_databricks"]
+        rows = pd.concat([rows.astype({k: object for k in self.keys}), pd.DataFrame([total])], ignore_index=True)
+        add_approx_bounds(rows, add_metric_diffs(rows))
+        return rows, {"groups": _count(totals["_groups"]), "mismatching": _count(totals["_mismatching"])}
@@ -0,0 +1,183 @@
+﻿import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from _common import add_metric_diffs, mismatch_rows, normalize_keys
+
+STATUS = {"left_only": "missing_in_databricks", "right_only": "missing_in_synapse", "both": "different"}
+
+
+def order_by(keys: List[str], synapse: bool, string_keys: Optional[set] = None) -> str:
+    # Both engines must emit keys in the same order as the Python comparisons
+    # below: nulls first, strings in code point order. That is UTF-8 byte order,
+    # which Databricks uses; Synapse sorts the key as UTF-8 varchar under a binary
+    # UTF-8 collation (BIN2 alone follows UTF-16 units or the code page).
+    parts = []
+    for k in keys:
+        if synapse:
+            if k in (string_keys or set()):
+                k = f"CONVERT(VARCHAR(MAX), CONVERT(NVARCHAR(MAX), {k}) COLLATE Latin1_General_100_BIN2_UTF8)"
+            parts.append(f"{k} ASC")
+        else:
+            parts.append(f"{k} ASC NULLS FIRST")
+    return " ORDER BY " + ", ".join(parts)
+
+
+def _lt(s: pd.Series, w) -> pd.Series:
+    if pd.isna(w):
+        return pd.Series(False, index=s.index)
+    return s.isna() | (s < w).fillna(False).astype(bool)
+
+
+def _eq(s: pd.Series, w) -> pd.Series:
+    if pd.isna(w):
+        return s.isna()
+    return (s == w).fillna(False).astype(bool)
+
+
+def rows_le(df: pd.DataFrame, keys: List[str], wm: tuple) -> pd.Series:
+    # Lexicographic df[keys] <= wm with nulls sorting first.
+    acc = _lt(df[keys[-1]], wm[-1]) | _eq(df[keys[-1]], wm[-1])
+    for k, w in zip(reversed(keys[:-1]), reversed(wm[:-1])):
+        acc = _lt(df[k], w) | (_eq(df[k], w) & acc)
+    return acc
+
+
+def key_lt(a: tuple, b: tuple) -> bool:
+    for x, y in zip(a, b):
+        xn, yn = pd.isna(x), pd.isna(y)
+        if xn and yn:
+            continue
+        if xn or yn:
+            return xn
+        if x != y:
+            return x < y
+    return False
+
+
+@dataclass
+class StreamingCompare:
+    # Sort-merge join over two key-ordered batch streams. Rows are released
+    # once both sides have moved past them, so memory is bounded by roughly one
+    # batch per side regardless of result size. Differences are written as
+    # numbered part files under `out`.
+    keys: List[str]
+    out: Path
+    fmt: str = "parquet"
+    log_every: int = 10
+    log: Callable[[str], None] = print
+    key_types: Dict[str, str] = field(default_factory=dict)
+    summary: Dict[str, float] = field(default_factory=dict)
+    parts: int = 0
+    chunks: int = 0
+
+    def _write(self, diffs: pd.DataFrame) -> None:
+        path = self.out / f"part-{self.parts:05d}.{self.fmt}"
+        if self.fmt == "parquet":
+            pq.write_table(pa.Table.from_pandas(diffs, preserve_index=False), path)
+        else:
+            diffs.to_csv(path, index=False)
+        self.parts += 1
+
+    def _emit(self, syn: pd.DataFrame, dbx: pd.DataFrame) -> None:
+        if syn.empty and dbx.empty:
+            return
+        syn = syn.copy()
+        dbx = dbx.copy()
+        # Key types are fixed by the first chunk so every part file has one schema.
+        resolved = normalize_keys(syn, dbx, self.keys, self.key_types or None)
+        if not self.key_types:
+            self.key_types = resolved
+
+        merged = syn.merge(dbx, on=self.keys, how="outer", suffixes=("_synapse", "_databricks"), indicator=True)
+        diff_cols = add_metric_diffs(merged)
+        both = merged["_merge"] == "both"
+        differs = mismatch_rows(merged, diff_cols, indicator=None)
+
+        s = self.summary
+        s["groups"] = s.get("groups", 0) + len(merged)
+        s["missing_in_databricks"] = s.get("missing_in_databricks", 0) + int((merged["_merge"] == "left_only").sum())
+        s["missing_in_synapse"] = s.get("missing_in_synapse", 0) + int((merged["_merge"] == "right_only").sum())
+        s["mismatched"] = s.get("mismatched", 0) + int((both & differs).sum())
+        for c in merged.columns:
+            if c.endswith("_synapse") or c.endswith("_databricks") or c in diff_cols:
+                if pd.api.types.is_numeric_dtype(merged[c]):
+                    s[c] = s.get(c, 0) + merged[c].sum()
+
+        bad = merged[~both | differs].copy()
+        if not bad.empty:
+            bad = bad.astype({k: object for k in self.keys if isinstance(bad[k].dtype, pd.CategoricalDtype)})
+            bad.insert(0, "status", bad["_merge"].astype(str).map(STATUS))
+            self._write(bad.drop(columns=["_merge"]))
+
+        self.chunks += 1
+        if self.chunks % self.log_every == 0:
+            self.log(self.progress())
+
+    def progress(self) -> str:
+        s = self.summary
+        return (
+            f"groups={int(s.get('groups', 0))} mismatched={int(s.get('mismatched', 0))} "
+            f"missing_in_databricks={int(s.get('missing_in_databricks', 0))} "
+            f"missing_in_synapse={int(s.get('missing_in_synapse', 0))} parts={self.parts}"
+        )
+
+    def run(self, syn_batches: Iterator[pd.DataFrame], dbx_batches: Iterator[pd.DataFrame]) -> Dict[str, float]:
+        self.out.mkdir(parents=True, exist_ok=True)
+        started = time.perf_counter()
+        its = {"syn": syn_batches, "dbx": dbx_batches}
+        buf = {"syn": pd.DataFrame(columns=self.keys), "dbx": pd.DataFrame(columns=self.keys)}
+        done = {"syn": False, "dbx": False}
+
+        def pull(side: str) -> None:
+            try:
+                df = next(its[side])
+            except StopIteration:
+                done[side] = True
+                return
+            buf[side] = df if buf[side].empty else pd.concat([buf[side], df], ignore_index=True)
+
+        pull("syn")
+        pull("dbx")
+        while True:
+            syn = buf["syn"]
+            dbx = buf["dbx"]
+
+            if done["syn"] or done["dbx"]:
+                # One side is exhausted: nothing still to come can match what is buffered.
+                self._emit(syn, dbx)
+                buf["syn"] = syn.iloc[0:0]
+                buf["dbx"] = dbx.iloc[0:0]
+                if done["syn"] and done["dbx"]:
+                    break
+                pull("dbx" if done["syn"] else "syn")
+                continue
+
+            if syn.empty or dbx.empty:
+                pull("syn" if syn.empty else "dbx")
+                continue
+
+            syn_last = tuple(syn[self.keys].iloc[-1])
+            dbx_last = tuple(dbx[self.keys].iloc[-1])
+            wm = dbx_last if key_lt(dbx_last, syn_last) else syn_last
+
+            s_mask = rows_le(syn, self.keys, wm)
+            d_mask = rows_le(dbx, self.keys, wm)
+            self._emit(syn[s_mask], dbx[d_mask])
+            buf["syn"] = syn[~s_mask].reset_index(drop=True)
+            buf["dbx"] = dbx[~d_mask].reset_index(drop=True)
+
+            if not key_lt(syn_last, wm) and not key_lt(wm, syn_last):
+                pull("syn")
+            if not key_lt(dbx_last, wm) and not key_lt(wm, dbx_last):
+                pull("dbx")
+
+        self.summary["seconds"] = round(time.perf_counter() - started, 3)
+        self.summary["parts"] = self.parts
+        self.log(self.progress())
+        return self.summary
@@ -1,24 +1,75 @@
 ﻿import json
+from pathlib import Path
+from typing import Optional
 
 import pandas as pd
-
-from _common import jaccard_tokens, load_settings, normalize_name, out_dir
+import pyarrow.dataset as ds
+
+from _common import (
+    ResultsStore,
+    SignatureIndex,
+    TokenIndex,
+    jaccard_tokens,
+    load_settings,
+    normalize_name,
+    out_dir,
+    results_dir,
+    run_cli,
+)
+
+INVENTORY_COLUMNS = ["catalog", "schema", "name", "type", "n_columns", "row_count", "signature", "names_signature"]
+# Confidence of a match found by column shape alone: the only object with the
+# same column names and types, the only one with the same names, or the
+# closest name among several of that shape.
+SIGNATURE_SCORES = {"columns": 0.9, "column_names": 0.8}
+AMBIGUOUS_SIGNATURE_SCORE = 0.6
+# Shapes shared by more objects than this say nothing about which one it is.
+MAX_SIGNATURE_CANDIDATES = 20
+ROW_COUNT_PENALTY = 0.2
+
+
+def load_inventory(engine: str, csv_path: Path) -> Optional[pd.DataFrame]:
+    # Latest inventory run in the results store, else the inventory script's CSV.
+    # Inventories taken without columns have empty signatures.
+    df = ResultsStore(results_dir()).read(
+        "inventory", last_runs=1, columns=INVENTORY_COLUMNS, where=ds.field("engine") == engine
+    )
+    if not df.empty:
+        return df
+    return pd.read_csv(csv_path).reindex(columns=INVENTORY_COLUMNS) if csv_path.exists() else None
+
+
+def row_gap(a, b) -> Optional[float]:
+    # Relative difference of two approximate row counts; None when either is unknown.
+    if pd.isna(a) or pd.isna(b):
+        return None
+    a, b = float(a), float(b)
+    return abs(a - b) / max(a, b) if max(a, b) else 0.0
+
+
+def column_check(s: pd.Series, d: pd.Series) -> str:
+    if not isinstance(s.get("signature"), str) or not isinstance(d.get("signature"), str):
+        return "unknown"
+    if s["signature"] == d["signature"]:
+        return "match"
+    if s.get("names_signature") == d.get("names_signature"):
+        return "names"
+    return "differ"
 
 
 def main() -> int:
     settings = load_settings()
     strip_prefixes = settings["mapping"].get("stripPrefixes", ["vw_", "v_"])
     threshold = float(settings["mapping"].get("threshold", 0.65))
+    min_columns = int(settings["mapping"].get("minSignatureColumns", 3))
+    row_tolerance = float(settings["mapping"].get("rowCountTolerance", 0.5))
 
     out = out_dir()
-    syn_path = out / "synapse_objects.csv"
-    dbx_path = out / "databricks_objects.csv"
-    if not syn_path.exists() or not dbx_path.exists():
+    syn = load_inventory("synapse", out / "synapse_objects.csv")
+    dbx = load_inventory("databricks", out / "databricks_objects.csv")
+    if syn is None or dbx is None:
         raise SystemExit("Run inventory scripts first")
 
-    syn = pd.read_csv(syn_path)
-    dbx = pd.read_csv(dbx_path)
-
     syn["norm"] = syn["name"].astype(str).map(lambda s: normalize_name(s, strip_prefixes))
     dbx["norm"] = dbx["name"].astype(str).map(lambda s: normalize_name(s, strip_prefixes))
 
@@ -28,6 +79,11 @@ def main() -> int:
         if n and n not in dbx_by_norm:
             dbx_by_norm[n] = i
 
+    dbx_norms = dbx["norm"].astype(str).tolist()
+    dbx_rows = dbx["row_count"].tolist()
+    dbx_index = TokenIndex(dbx_norms)
+    sig_index = SignatureIndex(dbx["signature"].tolist(), dbx["names_signature"].tolist(), dbx["n_columns"].tolist(), min_columns)
+
     mappings = []
     review_rows = []
 
@@ -44,15 +100,33 @@ def main() -> int:
             best_score = 1.0
             reason = "exact_name"
         else:
-            for i, d in dbx.iterrows():
-                score = jaccard_tokens(s_norm, str(d["norm"]))
-                if score > best_score:
-                    best_score = score
-                    best_idx = i
+            hit = dbx_index.best_match(s_norm)
+            if hit is not None:
+                best_idx = dbx.index[hit[0]]
+                best_score = hit[1]
+
+            hits, kind = sig_index.lookup(s["signature"], s["names_signature"], s["n_columns"])
+            if 0 < len(hits) <= MAX_SIGNATURE_CANDIDATES:
+                if hit is not None and hit[0] in hits:
+                    # The name match has the same columns: confirmed.
+                    best_score = max(best_score, SIGNATURE_SCORES[kind])
+                    reason = f"fuzzy_name+{kind}"
+                else:
+                    # Renamed: among objects of the same shape take the closest name, then row count.
+                    pos = max(hits, key=lambda p: (jaccard_tokens(s_norm, dbx_norms[p]), -(row_gap(s["row_count"], dbx_rows[p]) or 0.0)))
+                    score = SIGNATURE_SCORES[kind] if len(hits) == 1 else AMBIGUOUS_SIGNATURE_SCORE
+                    gap = row_gap(s["row_count"], dbx_rows[pos])
+                    if gap is not None and gap > row_tolerance:
+                        score -= ROW_COUNT_PENALTY
+                    if score > best_score:
+                        best_idx = dbx.index[pos]
+                        best_score = score
+                        reason = kind
 
         if best_idx is None:
             continue
         best = dbx.loc[best_idx]
+        check = column_check(s, best)
 
         review_rows.append({
             "syn_catalog": s.get("catalog"),
@@ -65,6 +139,9 @@ def main() -> int:
             "dbx_type": best.get("type"),
             "confidence": float(min(0.99, max(0.0, best_score))),
             "matchReason": reason,
+            "columnCheck": check,
+            "syn_rows": s["row_count"],
+            "dbx_rows": best["row_count"],
         })
 
         if best_score >= threshold:
@@ -83,6 +160,7 @@ def main() -> int:
                 },
                 "confidence": float(min(0.99, max(0.0, best_score))),
                 "matchReason": reason,
+                "columnCheck": check,
             })
 
     review = pd.DataFrame.from_records(review_rows).sort_values("confidence", ascending=False)
@@ -100,8 +178,10 @@ def main() -> int:
 
     print(f"Wrote mapping: {mapping_path} (mappings={len(mappings)}, threshold={threshold})")
     print(f"Wrote review:  {review_path} (rows={len(review)})")
+    reasons = pd.Series([m["matchReason"] for m in mappings], dtype=object).value_counts()
+    print("Mappings by reason: " + ", ".join(f"{r}={n}" for r, n in reasons.items()))
     return 0
 
 
 if __name__ == "__main__":
-    raise SystemExit(main())
+    raise SystemExit(run_cli(main))
@@ -1,11 +1,66 @@
 ﻿import argparse
+import hashlib
 import json
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
 import pandas as pd
 
-from _common import databricks_connect, out_dir, safe_filename, synapse_connect
+from _common import (
+    FETCH_BATCH_ROWS,
+    ChunkRunner,
+    ConnectionPool,
+    APPROX_PREFIX,
+    DATABRICKS_APPROX_RSD,
+    FetchStats,
+    ResultsStore,
+    WorkQueue,
+    add_approx_bounds,
+    add_dry_run_args,
+    add_metric_diffs,
+    add_queue_args,
+    approx_bound,
+    apply_queue_options,
+    databricks_columns,
+    databricks_connect,
+    databricks_iter_arrow,
+    databricks_metadata_rowcount,
+    databricks_metadata_rowcount_sql,
+    databricks_query,
+    databricks_table_version,
+    load_settings,
+    mismatch_rows,
+    normalize_keys,
+    out_dir,
+    parse_key_types,
+    query_errors,
+    queue_options,
+    record_result,
+    result_cache,
+    results_dir,
+    results_run,
+    run_cli,
+    run_worker,
+    safe_filename,
+    show_sql,
+    synapse_columns,
+    synapse_connect,
+    synapse_iter_arrow,
+    synapse_metadata_rowcount,
+    synapse_query,
+    synapse_table_stats_sql,
+    synapse_table_version,
+    with_totals_row,
+    write_csv,
+)
+from _grains import Grains, grain_chains, grain_label, key_text, parse_grains
+from _hashdiff import DATABRICKS, SYNAPSE, Dialect, HashDiff, Side, column_class, column_classes
+from _profile import Profile
+from _serverdiff import ServerDiff
+from _stream import StreamingCompare, order_by
+
+# Per-process settings a queue worker keeps; the rest come from the coordinator.
+QUEUE_LOCAL = ("synapse", "chunk_workers")
 
 
 def load_mapping() -> list[dict]:
@@ -15,18 +70,24 @@ def load_mapping() -> list[dict]:
     return json.loads(p.read_text(encoding="utf-8")).get("mappings", [])
 
 
+def mapped_fqn(m: dict) -> str:
+    d = m["databricks"]
+    return f"{d.get('catalog')}.{d.get('schema')}.{d.get('name')}"
+
+
 def find_databricks_fqn(synapse_2part: str, mappings: list[dict]) -> str:
     schema, name = synapse_2part.split(".", 1)
     for m in mappings:
         s = m["synapse"]
         if str(s.get("schema")) == schema and str(s.get("name")) == name:
-            d = m["databricks"]
-            return f"{d.get('catalog')}.{d.get('schema')}.{d.get('name')}"
+            return mapped_fqn(m)
     raise RuntimeError(f"No mapping for {synapse_2part}. Check mapping_review.csv for best candidate.")
 
 
-def build_metrics_sql(keys: List[str], metrics: List[str]) -> str:
-    select_parts = [*keys]
+def build_metrics_sql(
+    keys: List[str], metrics: List[str], synapse: bool, sample: Optional[str] = None, grains: Optional[Grains] = None
+) -> str:
+    select_parts = []
 
     for m in metrics:
         if m == "count":
@@ -34,68 +95,586 @@ def build_metrics_sql(keys: List[str], metrics: List[str]) -> str:
         elif m.startswith("distinct:"):
             col = m.split(":", 1)[1]
             select_parts.append(f"COUNT(DISTINCT {col}) AS distinct_{col}")
+        elif m.startswith("approx_distinct:"):
+            col = m.split(":", 1)[1]
+            fn = f"APPROX_COUNT_DISTINCT({col})" if synapse else f"approx_count_distinct({col}, {DATABRICKS_APPROX_RSD})"
+            select_parts.append(f"{fn} AS {APPROX_PREFIX}{col}")
         elif m.startswith("sum:"):
             col = m.split(":", 1)[1]
             select_parts.append(f"SUM({col}) AS sum_{col}")
         else:
             raise ValueError(f"Unknown metric: {m}")
 
-    select_sql = ", ".join(select_parts)
+    source = "{table}" if sample is None else f"(SELECT * FROM {{table}} WHERE {sample}) s"
+    if grains is not None:
+        return grains.sql(select_parts, source, synapse)
+    select_sql = ", ".join([*keys, *select_parts])
     group_sql = ", ".join(keys)
-    return f"SELECT {select_sql} FROM {{table}} GROUP BY {group_sql}"
+    return f"SELECT {select_sql} FROM {source}{{where}} GROUP BY {group_sql}"
+
+
+def sample_filter(d: Dialect, keys: List[str], classes: Dict[str, Tuple[str, int]], pct: float) -> str:
+    # Keeps the key groups whose normalized key text hashes into the first `pct`
+    # percent of buckets. The hash is identical on both engines, so both sides
+    # sample exactly the same groups and their metrics still compare exactly.
+    parts = [d.norm(k, *classes[k]) for k in keys]
+    return f"{d.hash32(d.concat(parts))} % 10000 < {round(pct * 100)}"
+
+
+def metadata_equal(args: argparse.Namespace, dbx: str) -> bool:
+    # Only row counts are known from metadata, so only count-only compares can be skipped.
+    if args.force_scan or set(args.metric) != {"count"}:
+        return False
+    with synapse_connect() as syn_con:
+        syn_total = synapse_metadata_rowcount(syn_con, args.synapse)
+    if syn_total is None:
+        return False
+    with databricks_connect() as dbx_con:
+        dbx_total = databricks_metadata_rowcount(dbx_con, dbx)
+    print("Metadata row counts:", syn_total, "(synapse)", dbx_total, "(databricks)")
+    return syn_total == dbx_total
+
+
+def run_hash_diff(args: argparse.Namespace, dbx: str, out: Path) -> int:
+    with synapse_connect() as syn_con, databricks_connect() as dbx_con:
+        cols = synapse_columns(syn_con, args.synapse)
+        classes = column_classes(cols)
+        lower = {c.lower(): c for c in classes}
+
+        missing = [c for c in [*args.key, *(args.column or [])] if c.lower() not in lower]
+        if missing:
+            raise SystemExit(f"Unknown column(s) in {args.synapse}: {', '.join(missing)}")
+
+        keys = [lower[k.lower()] for k in args.key]
+        excluded = {c.lower() for c in (args.exclude_column or [])}
+        columns = [lower[c.lower()] for c in args.column] if args.column else list(classes)
+        columns = [c for c in dict.fromkeys([*keys, *columns]) if c.lower() not in excluded or c in keys]
+
+        differ = HashDiff(keys=keys, columns=columns, classes=classes, fanout=args.fanout, leaf_rows=args.leaf_rows)
+        syn = Side(SYNAPSE, args.synapse, lambda q: synapse_query(syn_con, q))
+        dbx_side = Side(DATABRICKS, dbx, lambda q: databricks_query(dbx_con, q))
+        diffs = differ.run(syn, dbx_side)
+
+    record_summary(args, dbx, "hash-diff", keys, mismatching=len(diffs))
+    out_csv = write_csv(diffs, out / f"compare_{safe_filename(args.synapse)}_{safe_filename('_'.join(args.key))}_rowdiff.csv")
+    print(f"Queries: synapse={syn.queries} databricks={dbx_side.queries}; rows fetched: synapse={syn.rows} databricks={dbx_side.rows}")
+    print("Differing rows:", len(diffs))
+    if out_csv is not None:
+        print("Wrote:", out_csv)
+    return 0
+
+
+def run_stream(args: argparse.Namespace, dbx: str, out: Path, syn_tpl: str, dbx_tpl: str) -> int:
+    base = f"compare_{safe_filename(args.synapse)}_{safe_filename('_'.join(args.key))}"
+    syn_stats = FetchStats()
+    dbx_stats = FetchStats()
+
+    with synapse_connect() as syn_con, databricks_connect() as dbx_con:
+        cols = synapse_columns(syn_con, args.synapse)
+        string_cols = {str(r["name"]).lower() for _, r in cols.iterrows() if column_class(r["type"]) in ("string", "guid")}
+        string_keys = {k for k in args.key if k.lower() in string_cols}
+
+        syn_sql = syn_tpl.format(table=args.synapse, where="") + order_by(args.key, True, string_keys)
+        dbx_sql = dbx_tpl.format(table=dbx, where="") + order_by(args.key, False)
+        syn_batches = (t.to_pandas() for t in synapse_iter_arrow(syn_con, syn_sql, args.batch_rows, syn_stats))
+        dbx_batches = (t.to_pandas() for t in databricks_iter_arrow(dbx_con, dbx_sql, args.batch_rows, dbx_stats))
+
+        merger = StreamingCompare(
+            keys=args.key,
+            out=out / f"{base}_stream",
+            fmt=args.stream_format,
+            key_types=parse_key_types(args.key_type),
+        )
+        summary = merger.run(syn_batches, dbx_batches)
+
+    print("Synapse fetch:", syn_stats)
+    print("Databricks fetch:", dbx_stats)
+    missing = int(summary.get("missing_in_databricks", 0) + summary.get("missing_in_synapse", 0))
+    record_summary(args, dbx, "stream", args.key, rows=int(summary.get("groups", 0)), mismatching=int(summary.get("mismatched", 0)) + missing)
+    summary_csv = write_csv(pd.DataFrame([summary]), out / f"{base}_stream_summary.csv")
+    print("Wrote diffs:", merger.out)
+    if summary_csv is not None:
+        print("Wrote summary:", summary_csv)
+    return 0
+
+
+def run_server_diff(args: argparse.Namespace, dbx: str, out: Path, syn_tpl: str, dbx_tpl: str) -> int:
+    settings = load_settings().get("serverDiff", {})
+    staging = args.staging_schema or settings.get("stagingSchema")
+    if not staging:
+        raise SystemExit("server-diff needs --staging-schema (or serverDiff.stagingSchema in settings.json)")
+
+    syn_stats = FetchStats()
+    differ = ServerDiff(keys=args.key, staging_schema=staging, insert_bytes=int(settings.get("insertMB", 8) * 1024 * 1024))
+    with synapse_connect() as syn_con, databricks_connect() as dbx_con:
+        syn_batches = synapse_iter_arrow(syn_con, syn_tpl.format(table=args.synapse, where=""), args.batch_rows, syn_stats)
+        rows, counts = differ.run(syn_batches, dbx_con, dbx_tpl.format(table=dbx, where=""))
+
+    print("Synapse fetch:", syn_stats)
+    print("Groups:", counts["groups"], "Mismatching:", counts["mismatching"])
+    # Every fetched group mismatches; the last row is the totals row.
+    record_result("diffs", diff_rows(rows, pd.Series(rows.index < len(rows) - 1, index=rows.index), args.key, "server-diff"), args.synapse)
+    record_summary(args, dbx, "server-diff", args.key, rows=counts["groups"], mismatching=counts["mismatching"])
+    sampled = f"_sample{args.sample:g}" if args.sample else ""
+    out_csv = write_csv(rows, out / f"compare_{safe_filename(args.synapse)}_{safe_filename('_'.join(args.key))}{sampled}.csv")
+    if out_csv is not None:
+        print("Wrote:", out_csv)
+    return 0
+
+
+def chunked_metrics(args: argparse.Namespace, out: Path, side: str, table: str, sql_tpl: str) -> pd.DataFrame:
+    # Metrics over --chunk-column ranges, concurrently, with retry and a resumable checkpoint.
+    synapse = side == "synapse"
+    connect = synapse_connect if synapse else databricks_connect
+    query = synapse_query if synapse else databricks_query
+    col = args.chunk_column
+
+    with connect() as con:
+        bounds = query(con, f"SELECT MIN({col}) AS lo, MAX({col}) AS hi FROM {table}")
+        if bounds.empty or pd.isna(bounds.iloc[0, 0]):
+            return query(con, sql_tpl.format(table=table, where=""))
+        rows = (synapse_metadata_rowcount if synapse else databricks_metadata_rowcount)(con, table)
+        if rows is None:
+            rows = int(query(con, f"SELECT {'COUNT_BIG(*)' if synapse else 'COUNT(*)'} AS cnt FROM {table}").iloc[0, 0])
+    lo, hi = int(bounds.iloc[0, 0]), int(bounds.iloc[0, 1])
+
+    key = hashlib.sha1(sql_tpl.encode("utf-8")).hexdigest()[:10]
+    with ConnectionPool(connect, args.chunk_workers) as pool:
+        runner = ChunkRunner(pool, out / "checkpoints" / f"{side}_{safe_filename(table)}_{key}", args.chunk_workers, args.chunk_retries)
+        ranges = runner.plan(lo, hi, max(1, -(-rows // args.chunk_rows)))
+        print(f"{side}: {rows} rows in {col} [{lo}, {hi}] -> {len(ranges)} ranges")
+        df = runner.run(ranges, lambda c, a, b: query(c, sql_tpl.format(table=table, where=f" WHERE {col} BETWEEN {a} AND {b}")))
+
+    if col not in args.key:
+        # Groups span ranges: re-aggregate the per-range partial counts and sums.
+        df = df.groupby(args.key, dropna=False, as_index=False, sort=False).sum(min_count=1)
+    return df
+
+
+def fetch_metrics(args: argparse.Namespace, dbx: str, syn_tpl: str, dbx_tpl: str):
+    syn_sql = syn_tpl.format(table=args.synapse, where="")
+    dbx_sql = dbx_tpl.format(table=dbx, where="")
+
+    cache = result_cache(not args.no_cache, args.refresh)
+    audit_sql = load_settings().get("cache", {}).get("synapseVersionSql")
+
+    syn_stats = FetchStats()
+    with synapse_connect() as syn_con:
+        if cache is None:
+            syn_df = synapse_query(syn_con, syn_sql, syn_stats)
+        else:
+            syn_version = synapse_table_version(syn_con, args.synapse, audit_sql)
+            syn_df = cache.fetch(syn_sql, syn_version, lambda: synapse_query(syn_con, syn_sql, syn_stats))
+    print("Synapse fetch:", syn_stats)
+
+    dbx_stats = FetchStats()
+    with databricks_connect() as dbx_con:
+        if cache is None:
+            dbx_df = databricks_query(dbx_con, dbx_sql, dbx_stats)
+        else:
+            dbx_version = databricks_table_version(dbx_con, dbx)
+            dbx_df = cache.fetch(dbx_sql, dbx_version, lambda: databricks_query(dbx_con, dbx_sql, dbx_stats))
+    print("Databricks fetch:", dbx_stats)
+    if cache is not None:
+        print("Result cache:", cache)
+    return syn_df, dbx_df
+
+
+def merge_metrics(syn_df: pd.DataFrame, dbx_df: pd.DataFrame, keys: List[str]) -> Tuple[pd.DataFrame, pd.Series]:
+    merged = syn_df.merge(dbx_df, on=keys, how="outer", suffixes=("_synapse", "_databricks"), indicator=True)
+    diff_cols = add_metric_diffs(merged)
+    add_approx_bounds(merged, diff_cols)
+    bad = mismatch_rows(merged, diff_cols)
+    return merged.drop(columns=["_merge"]), bad
+
+
+def text_values(s: pd.Series) -> pd.Series:
+    return s.map(lambda v: None if pd.isna(v) else str(v))
+
+
+def diff_rows(merged: pd.DataFrame, bad: pd.Series, keys: List[str], mode: str) -> pd.DataFrame:
+    # Results-store layout: one row per mismatching group and metric, values as text.
+    rows = merged[bad]
+    key = key_text(rows, keys)
+    frames = []
+    for c in rows.columns:
+        base = c[: -len("_diff")]
+        if not c.endswith("_diff") or base + "_synapse" not in rows.columns:
+            continue
+        syn, dbx = rows[base + "_synapse"], rows[base + "_databricks"]
+        diff = pd.to_numeric(rows[c], errors="coerce").astype("float64")
+        presence = pd.Series("both", index=rows.index).mask(dbx.isna(), "synapse_only").mask(syn.isna(), "databricks_only")
+        match = diff.abs() <= approx_bound(rows, base) if base.startswith(APPROX_PREFIX) else diff == 0
+        frames.append(pd.DataFrame({
+            "mode": mode,
+            "grain": grain_label(keys),
+            "key": key,
+            "metric": base,
+            "synapse": text_values(syn),
+            "databricks": text_values(dbx),
+            "diff": diff,
+            "match": match & (presence == "both"),
+            "presence": presence,
+        }))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def record_summary(args: argparse.Namespace, dbx: str, mode: str, keys: List[str], status: str = "scanned", **counts) -> None:
+    row = {"tool": "lake-compare", "table": args.synapse, "databricks_table": dbx, "mode": mode, "keys": grain_label(keys), "status": status}
+    record_result("summary", pd.DataFrame([{**row, **counts}]))
+
+
+def grain_args(args: argparse.Namespace) -> Grains:
+    if args.sample or args.chunk_rows:
+        raise SystemExit("--grain cannot be combined with --sample or --chunk-rows")
+    try:
+        return Grains(parse_grains(([",".join(args.key)] if args.key else []) + args.grain))
+    except ValueError as e:
+        raise SystemExit(str(e))
+
+
+def run_grains(args: argparse.Namespace, dbx: str, out: Path, grains: Grains) -> int:
+    syn_tpl = build_metrics_sql(grains.keys, args.metric, True, grains=grains)
+    dbx_tpl = build_metrics_sql(grains.keys, args.metric, False, grains=grains)
+    scans = len(grain_chains(grains.grains))
+    print(f"Grains: {', '.join(grain_label(g) for g in grains.grains)} (Databricks: 1 scan, Synapse: {scans} scan{'s' if scans > 1 else ''})")
+    syn_df, dbx_df = fetch_metrics(args, dbx, syn_tpl, dbx_tpl)
+    syn_parts = grains.split(syn_df)
+    dbx_parts = grains.split(dbx_df)
+
+    key_types = parse_key_types(args.key_type)
+    merged, bad = {}, {}
+    for g in grains.grains:
+        label = grain_label(g)
+        # Merging on the grain label as well keeps the whole-table grain (no keys) mergeable.
+        s, d = syn_parts[label], dbx_parts[label]
+        s.insert(0, "grain", label)
+        d.insert(0, "grain", label)
+        normalize_keys(s, d, g, key_types)
+        merged[label], bad[label] = merge_metrics(s, d, ["grain", *g])
+        print(f"Grain {label}: groups {len(merged[label])}, mismatching {int(bad[label].sum())}")
+        record_result("diffs", diff_rows(merged[label], bad[label], g, "metrics"), args.synapse)
+        record_summary(args, dbx, "metrics", g, rows=len(merged[label]), mismatching=int(bad[label].sum()))
+
+        rows = merged[label]
+        if args.mismatch_only:
+            rows = with_totals_row(rows[bad[label]], rows, ["grain", *g]) if g else rows[bad[label]]
+        out_csv = write_csv(rows, out / f"compare_{safe_filename(args.synapse)}_{safe_filename('_'.join(g)) or 'total'}.csv")
+        if out_csv is not None:
+            print("Wrote:", out_csv)
+
+    value_cols = [c for c in next(iter(merged.values())).columns if c != "grain" and c not in grains.keys]
+    drill = grains.drilldown(merged, bad, value_cols)
+    for g in sorted(grains.grains, key=len):
+        parent = grains.parent(g)
+        children = drill[drill["grain"] == grain_label(g)]
+        if parent is None or children.empty:
+            continue
+        # Mismatching child groups per mismatching parent group, first few parents.
+        counts = children.groupby("parent_key", sort=False).size()
+        shown = ", ".join(f"{k}: {n}" for k, n in counts.head(5).items())
+        print(f"Drill-down {grain_label(parent)} -> {grain_label(g)}: {shown}{' ...' if len(counts) > 5 else ''}")
+    drill_csv = write_csv(drill, out / f"compare_{safe_filename(args.synapse)}_grains_drilldown.csv")
+    if drill_csv is not None:
+        print("Wrote:", drill_csv)
+    return 0
+
+
+def run_profile(args: argparse.Namespace, dbx: str, out: Path) -> int:
+    with synapse_connect() as syn_con, databricks_connect() as dbx_con:
+        classes = column_classes(synapse_columns(syn_con, args.synapse))
+        dbx_names = {n.lower() for n in databricks_columns(dbx_con, dbx)["name"]}
+    lower = {c.lower(): c for c in classes}
+
+    missing = [c for c in [*(args.key or []), *(args.column or [])] if c.lower() not in lower]
+    if missing:
+        raise SystemExit(f"Unknown column(s) in {args.synapse}: {', '.join(missing)}")
+
+    keys = [lower[k.lower()] for k in args.key or []]
+    excluded = {c.lower() for c in [*(args.exclude_column or []), *keys]}
+    columns = [lower[c.lower()] for c in args.column] if args.column else list(classes)
+    columns = [c for c in dict.fromkeys(columns) if c.lower() not in excluded]
+    only_syn = [c for c in columns if c.lower() not in dbx_names]
+    only_dbx = sorted(dbx_names - set(lower))
+    if only_syn:
+        print("Only in Synapse (not profiled):", ", ".join(only_syn))
+    if only_dbx:
+        print("Only in Databricks (not profiled):", ", ".join(only_dbx))
+
+    profile = Profile(keys=keys, columns=[c for c in columns if c not in only_syn], classes=classes)
+    syn_tpl = profile.sql(SYNAPSE)
+    dbx_tpl = profile.sql(DATABRICKS)
+    print(f"Profiling {len(profile.columns)} columns, {len(profile.stats())} stats per group")
+
+    if args.chunk_rows:
+        if args.chunk_column not in keys:
+            raise SystemExit("profile mode can only be chunked when --chunk-column is one of the --key columns")
+        syn_df = chunked_metrics(args, out, "synapse", args.synapse, syn_tpl)
+        dbx_df = chunked_metrics(args, out, "databricks", dbx, dbx_tpl)
+    else:
+        syn_df, dbx_df = fetch_metrics(args, dbx, syn_tpl, dbx_tpl)
+
+    if keys:
+        normalize_keys(syn_df, dbx_df, keys, parse_key_types(args.key_type))
+    report = profile.report(syn_df, dbx_df)
+    bad = report[~report["match"]]
+    print("Stats:", len(report), "Mismatching:", len(bad))
+    for col, n in bad.groupby("column", sort=False).size().items():
+        print(f"  {col}: {n} mismatching ({', '.join(bad.loc[bad['column'] == col, 'stat'].unique())})")
+
+    record_result("diffs", pd.DataFrame({
+        "mode": "profile",
+        "grain": grain_label(keys),
+        "key": key_text(bad, keys),
+        "metric": bad["stat"] + ":" + bad["column"],
+        "synapse": text_values(bad["synapse"]),
+        "databricks": text_values(bad["databricks"]),
+        "diff": bad["diff"].astype("float64"),
+        "match": bad["match"],
+        "presence": bad["presence"],
+    }), args.synapse)
+    record_summary(args, dbx, "profile", keys, rows=len(report), mismatching=len(bad))
+
+    if args.mismatch_only:
+        report = bad
+
+    suffix = f"_{safe_filename('_'.join(keys))}" if keys else ""
+    out_csv = write_csv(report, out / f"compare_{safe_filename(args.synapse)}{suffix}_profile.csv")
+    if out_csv is not None:
+        print("Wrote:", out_csv)
+    return 0
 
 
 def main() -> int:
     ap = argparse.ArgumentParser()
-    ap.add_argument("--synapse", required=True, help="2-part name: SCHEMA.TABLE")
-    ap.add_argument("--key", action="append", required=True, help="Repeatable group key")
-    ap.add_argument("--metric", action="append", default=["count"], help="count | distinct:col | sum:col")
+    ap.add_argument("--synapse", help="2-part name: SCHEMA.TABLE (optional with --queue: default is every mapped table)")
+    ap.add_argument("--key", action="append", help="Repeatable group key (required except in profile mode or with --grain)")
+    ap.add_argument(
+        "--grain",
+        action="append",
+        help="metrics: repeatable comma-separated key set (e.g. DateID,Platform, or 'total'), all compared in one scan; --key adds one more",
+    )
+    ap.add_argument("--metric", action="append", default=["count"], help="count | distinct:col | approx_distinct:col | sum:col")
+    ap.add_argument("--key-type", action="append", help="KEY=TYPE (int64 | decimal:SCALE | float64 | date | datetime | string | string_ci); inferred if omitted")
+    ap.add_argument("--no-cache", action="store_true", help="Do not read or write the query result cache")
+    ap.add_argument("--refresh", action="store_true", help="Re-run queries and overwrite cached results")
+    ap.add_argument("--force-scan", action="store_true", help="Scan even when metadata row counts already match")
+    ap.add_argument("--sample", type=float, help="metrics / stream: compare only ~PCT%% of key groups, chosen by key hash")
+    ap.add_argument("--mismatch-only", action="store_true", help="Write only differing groups plus a totals row")
+    ap.add_argument(
+        "--mode",
+        choices=["metrics", "hash-diff", "stream", "profile", "server-diff"],
+        default="metrics",
+        help="hash-diff: bisect row hashes down to differing rows; stream: out-of-core sort-merge compare; "
+        "profile: per-column null/min/max/sum/length stats in one scan; "
+        "server-diff: join inside Databricks, fetch only mismatching groups",
+    )
+    ap.add_argument("--column", action="append", help="hash-diff / profile: columns to hash or profile (default: all)")
+    ap.add_argument("--exclude-column", action="append", help="hash-diff / profile: columns to leave out")
+    ap.add_argument("--fanout", type=int, default=16, help="hash-diff: sub-buckets per mismatching bucket")
+    ap.add_argument("--leaf-rows", type=int, default=1000, help="hash-diff: fetch rows once a bucket is this small")
+    ap.add_argument("--batch-rows", type=int, default=FETCH_BATCH_ROWS, help="stream / server-diff: rows fetched per batch")
+    ap.add_argument("--staging-schema", help="server-diff: catalog.schema for the temporary staging tables")
+    ap.add_argument("--stream-format", choices=["parquet", "csv"], default="parquet", help="stream: diff part file format")
+    ap.add_argument("--chunk-rows", type=int, default=0, help="metrics / profile: split scans into --chunk-column ranges of about this many rows (0 = off)")
+    ap.add_argument("--chunk-column", default="DateID", help="metrics: integer column to range-split on")
+    ap.add_argument("--chunk-workers", type=int, default=4, help="metrics: concurrent range queries per engine")
+    ap.add_argument("--chunk-retries", type=int, default=3, help="metrics: retries per range before it is split in half")
+    add_dry_run_args(ap)
+    add_queue_args(ap)
     args = ap.parse_args()
+    if args.worker and not args.queue:
+        ap.error("--worker needs --queue")
+    if not args.worker:
+        # A worker's compare options come from the coordinator.
+        if not args.synapse and (not args.queue or args.dry_run):
+            ap.error("--synapse is required")
+        if not args.key and not args.grain and args.mode != "profile":
+            ap.error("--key is required")
+        if args.grain and args.mode != "metrics":
+            ap.error("--grain works with --mode metrics only")
 
     out = out_dir()
     out.mkdir(parents=True, exist_ok=True)
+    if args.queue and not args.dry_run:
+        return run_queue(args, out)
 
     mappings = load_mapping()
     dbx = find_databricks_fqn(args.synapse, mappings)
 
-    sql_tpl = build_metrics_sql(args.key, args.metric)
-    syn_sql = sql_tpl.format(table=args.synapse)
-    dbx_sql = sql_tpl.format(table=dbx)
-
     print("Synapse:", args.synapse)
     print("Databricks:", dbx)
 
-    with synapse_connect() as syn_con:
-        syn_df = pd.read_sql(syn_sql, syn_con)
+    if args.dry_run:
+        return dry_run(args, dbx)
+    with results_run(results_dir()):
+        return compare(args, dbx, out)
 
-    with databricks_connect() as dbx_con:
-        with dbx_con.cursor() as cur:
-            cur.execute(dbx_sql)
-            rows = cur.fetchall()
-            dcols = [d[0] for d in cur.description]
-        dbx_df = pd.DataFrame.from_records(rows, columns=dcols)
-
-    for k in args.key:
-        syn_df[k] = syn_df[k].astype(str)
-        dbx_df[k] = dbx_df[k].astype(str)
-
-    merged = syn_df.merge(dbx_df, on=args.key, how="outer", suffixes=("_synapse", "_databricks"))
-
-    # numeric diffs
-    for c in list(merged.columns):
-        if c.endswith("_synapse"):
-            base = c[: -len("_synapse")]
-            c2 = base + "_databricks"
-            if c2 in merged.columns:
-                merged[c] = pd.to_numeric(merged[c], errors="coerce").fillna(0)
-                merged[c2] = pd.to_numeric(merged[c2], errors="coerce").fillna(0)
-                merged[base + "_diff"] = merged[c2] - merged[c]
-
-    out_csv = out / f"compare_{safe_filename(args.synapse)}_{safe_filename('_'.join(args.key))}.csv"
-    merged.to_csv(out_csv, index=False)
-    print("Wrote:", out_csv)
+
+def enqueue(queue: WorkQueue, args: argparse.Namespace) -> dict:
+    if queue.exists() and not queue.finished():
+        print(f"Resuming the unfinished queue in {queue.root}: {queue.status()}")
+        return queue.meta()
+    mappings = load_mapping()
+    if args.synapse:
+        items = [{"synapse": args.synapse, "databricks": find_databricks_fqn(args.synapse, mappings)}]
+    else:
+        items = [{"synapse": f"{m['synapse']['schema']}.{m['synapse']['name']}", "databricks": mapped_fqn(m)} for m in mappings]
+    queue.create(
+        items, args.lease_seconds, args.max_attempts,
+        tool="lake", run_id=ResultsStore(results_dir()).run_id, options=queue_options(args, QUEUE_LOCAL),
+    )
+    print(f"Queued {len(items)} tables in {queue.root}")
+    return queue.meta()
+
+
+def run_item(args: argparse.Namespace, out: Path, item: Dict[str, str]) -> Dict[str, object]:
+    # One queued table with the coordinator's options. A table that fails is
+    # recorded as an error; the worker goes on with the next one.
+    print("Synapse:", item["synapse"])
+    print("Databricks:", item["databricks"])
+    row = {"synapse_table": item["synapse"], "databricks_table": item["databricks"]}
+    try:
+        code = compare(argparse.Namespace(**{**vars(args), "synapse": item["synapse"]}), item["databricks"], out)
+    except SystemExit as e:
+        print(f"FAILED {item['synapse']}: {e.code}")
+        return {**row, "status": "error", "exit_code": 1, "error": str(e.code)}
+    except (RuntimeError, *query_errors()) as e:
+        print(f"FAILED {item['synapse']}: {e}")
+        return {**row, "status": "error", "exit_code": 1, "error": str(e)}
+    return {**row, "status": "done" if code == 0 else "failed", "exit_code": code, "error": None}
+
+
+def run_queue(args: argparse.Namespace, out: Path) -> int:
+    # Distributed run over a shared folder: the coordinator queues mapped tables,
+    # workers on any machines claim them under time-limited leases and record
+    # their results under the coordinator's run id, and the coordinator writes
+    # one summary of where each table ran and how it ended.
+    queue = WorkQueue(Path(args.queue))
+    if args.worker:
+        meta = queue.wait_ready(args.lease_seconds)
+        apply_queue_options(args, meta)
+    else:
+        meta = enqueue(queue, args)
+
+    with results_run(results_dir(), meta["run_id"]):
+        if args.worker or not args.no_work:
+            print(f"Handled {run_worker(queue, lambda item: run_item(args, out, item))} queue items")
+    if args.worker:
+        return 0
+    queue.wait()
+    rows = []
+    for e in queue.results():
+        result = e["result"] or {
+            "synapse_table": e["item"]["synapse"], "databricks_table": e["item"]["databricks"], "status": "error", "exit_code": 1, "error": e["error"],
+        }
+        rows.append({**result, "worker": e["worker"], "attempts": e["attempts"], "seconds": e["seconds"]})
+    summary = pd.DataFrame.from_records(rows)
+    out_csv = write_csv(summary, out / "compare_queue_summary.csv")
+    if out_csv is not None:
+        print("Wrote:", out_csv)
+    failed = int((summary["status"] != "done").sum()) if len(summary) else 0
+    print(f"Tables: {len(summary)}, failed: {failed}")
+    return 1 if failed else 0
+
+
+def compare(args: argparse.Namespace, dbx: str, out: Path) -> int:
+    if args.mode == "hash-diff":
+        return run_hash_diff(args, dbx, out)
+    if args.mode == "profile":
+        return run_profile(args, dbx, out)
+
+    if metadata_equal(args, dbx):
+        print("Metadata-equal: scan skipped (use --force-scan to compare per key)")
+        record_summary(args, dbx, args.mode, args.key or [], status="metadata-equal")
+        return 0
+
+    if args.grain:
+        return run_grains(args, dbx, out, grain_args(args))
+
+    syn_sample = dbx_sample = None
+    if args.sample:
+        if not 0 < args.sample < 100:
+            raise SystemExit("--sample must be a percentage between 0 and 100")
+        with synapse_connect() as syn_con:
+            classes = column_classes(synapse_columns(syn_con, args.synapse))
+        lower = {c.lower(): c for c in classes}
+        missing = [k for k in args.key if k.lower() not in lower]
+        if missing:
+            raise SystemExit(f"Unknown key column(s) in {args.synapse}: {', '.join(missing)}")
+        key_classes = {k: classes[lower[k.lower()]] for k in args.key}
+        syn_sample = sample_filter(SYNAPSE, args.key, key_classes, args.sample)
+        dbx_sample = sample_filter(DATABRICKS, args.key, key_classes, args.sample)
+        print(f"Sampling ~{args.sample:g}% of key groups (the same groups on both engines)")
+
+    syn_tpl = build_metrics_sql(args.key, args.metric, True, syn_sample)
+    dbx_tpl = build_metrics_sql(args.key, args.metric, False, dbx_sample)
+    if args.mode == "stream":
+        return run_stream(args, dbx, out, syn_tpl, dbx_tpl)
+    if args.mode == "server-diff":
+        return run_server_diff(args, dbx, out, syn_tpl, dbx_tpl)
+
+    if args.chunk_rows:
+        if args.chunk_column not in args.key and any(m.startswith(("distinct:", "approx_distinct:")) for m in args.metric):
+            raise SystemExit("distinct metrics cannot be chunked unless --chunk-column is one of the --key columns")
+        syn_df = chunked_metrics(args, out, "synapse", args.synapse, syn_tpl)
+        dbx_df = chunked_metrics(args, out, "databricks", dbx, dbx_tpl)
+    else:
+        syn_df, dbx_df = fetch_metrics(args, dbx, syn_tpl, dbx_tpl)
+
+    key_types = normalize_keys(syn_df, dbx_df, args.key, parse_key_types(args.key_type))
+    print("Key types:", ", ".join(f"{k}={t}" for k, t in key_types.items()))
+
+    merged, bad = merge_metrics(syn_df, dbx_df, args.key)
+    print("Groups:", len(merged), "Mismatching:", int(bad.sum()))
+    record_result("diffs", diff_rows(merged, bad, args.key, "metrics"), args.synapse)
+    record_summary(args, dbx, "metrics", args.key, rows=len(merged), mismatching=int(bad.sum()))
+
+    if args.mismatch_only:
+        merged = with_totals_row(merged[bad], merged, args.key)
+
+    sampled = f"_sample{args.sample:g}" if args.sample else ""
+    out_csv = write_csv(merged, out / f"compare_{safe_filename(args.synapse)}_{safe_filename('_'.join(args.key))}{sampled}.csv")
+    if out_csv is not None:
+        print("Wrote:", out_csv)
+    return 0
+
+
+def dry_run(args: argparse.Namespace, dbx: str) -> int:
+    # The statements compare() would send, printed without connecting. Modes that
+    # build their SQL from the Synapse column types cannot be shown offline.
+    if args.mode in ("hash-diff", "profile") or args.sample:
+        raise SystemExit(f"--dry-run cannot show {'--sample' if args.sample else args.mode}: its SQL is built from column types read from Synapse")
+    if not args.force_scan and set(args.metric) == {"count"}:
+        show_sql("synapse: metadata row count", synapse_table_stats_sql(args.synapse))
+        show_sql("databricks: metadata row count (Delta tables only); equal counts skip the scan", *databricks_metadata_rowcount_sql(dbx))
+
+    grains = grain_args(args) if args.grain else None
+    keys = grains.keys if grains else args.key
+    syn_tpl = build_metrics_sql(keys, args.metric, True, grains=grains)
+    dbx_tpl = build_metrics_sql(keys, args.metric, False, grains=grains)
+    syn_sql = syn_tpl.format(table=args.synapse, where="")
+    dbx_sql = dbx_tpl.format(table=dbx, where="")
+
+    if args.mode == "stream":
+        show_sql("synapse: key-ordered batches (string keys are ordered as UTF-8 text, COLLATE Latin1_General_100_BIN2_UTF8)", syn_sql + order_by(args.key, True))
+        show_sql("databricks: key-ordered batches", dbx_sql + order_by(args.key, False))
+    elif args.mode == "server-diff":
+        show_sql("synapse: groups, uploaded to a staging table in Databricks", syn_sql)
+        show_sql("databricks: groups, staged next to the upload and joined with it there", dbx_sql)
+    elif args.chunk_rows:
+        col = args.chunk_column
+        for side, table, tpl in (("synapse", args.synapse, syn_tpl), ("databricks", dbx, dbx_tpl)):
+            show_sql(
+                f"{side}: {col} bounds, then one query per range of ~{args.chunk_rows} rows",
+                f"SELECT MIN({col}) AS lo, MAX({col}) AS hi FROM {table}",
+                tpl.format(table=table, where=f" WHERE {col} BETWEEN <lo> AND <hi>"),
+            )
+    else:
+        show_sql("synapse", syn_sql)
+        show_sql("databricks", dbx_sql)
     return 0
 
 
 if __name__ == "__main__":
-    raise SystemExit(main())
+    raise SystemExit(run_cli(main))
@@ -1,43 +1,54 @@
-﻿import pandas as pd
-
-from _common import load_settings, out_dir, synapse_connect
+﻿import argparse
+
+from _common import (
+    add_catalog_args,
+    add_dry_run_args,
+    load_settings,
+    out_dir,
+    record_result,
+    refresh_catalog,
+    refresh_columns,
+    results_dir,
+    results_run,
+    run_cli,
+    show_catalog_refresh,
+    show_columns_refresh,
+    write_csv,
+)
 
 
 def main() -> int:
+    ap = argparse.ArgumentParser()
+    add_catalog_args(ap)
+    add_dry_run_args(ap)
+    args = ap.parse_args()
     settings = load_settings()
-    schemas = settings["synapse"]["schemas"]
-    in_list = ",".join([f"'{s}'" for s in schemas])
-
-    query = f"""
-SELECT TABLE_CATALOG, TABLE_SCHEMA, TABLE_NAME, 'TABLE' AS OBJECT_TYPE
-FROM INFORMATION_SCHEMA.TABLES
-WHERE TABLE_SCHEMA IN ({in_list})
-UNION ALL
-SELECT TABLE_CATALOG, TABLE_SCHEMA, TABLE_NAME, 'VIEW' AS OBJECT_TYPE
-FROM INFORMATION_SCHEMA.VIEWS
-WHERE TABLE_SCHEMA IN ({in_list})
-"""
+    schemas = set(settings["synapse"]["schemas"])
+    scope = {"schemas": sorted(schemas)}
+    if args.dry_run:
+        show_catalog_refresh("synapse", args.ttl_hours, args.refresh)
+        if not args.no_columns:
+            show_columns_refresh("synapse", scope, args.ttl_hours, args.refresh)
+        return 0
 
     out = out_dir()
     out.mkdir(parents=True, exist_ok=True)
     out_csv = out / "synapse_objects.csv"
 
-    with synapse_connect() as con:
-        df = pd.read_sql(query, con)
-
-    df.rename(
-        columns={
-            "TABLE_CATALOG": "catalog",
-            "TABLE_SCHEMA": "schema",
-            "TABLE_NAME": "name",
-            "OBJECT_TYPE": "type",
-        },
-        inplace=True,
-    )
-    df.to_csv(out_csv, index=False)
-    print(f"Wrote {len(df)} rows -> {out_csv}")
+    cache = refresh_catalog("synapse", args.ttl_hours, args.refresh)
+    df = cache.objects("synapse")
+    df = df[df["schema"].isin(schemas)]
+    if not args.no_columns:
+        df = df.merge(refresh_columns("synapse", scope, args.ttl_hours, args.refresh), on=["catalog", "schema", "name"], how="left")
+
+    with results_run(results_dir()):
+        record_result("inventory", df.assign(engine="synapse"))
+    if write_csv(df, out_csv) is not None:
+        print(f"Wrote {len(df)} rows -> {out_csv}")
+    else:
+        print(f"Recorded {len(df)} rows")
     return 0
 
 
 if __name__ == "__main__":
-    raise SystemExit(main())
+    raise SystemExit(run_cli(main))
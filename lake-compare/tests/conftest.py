@@ -0,0 +1,8 @@
+﻿import sys
+from pathlib import Path
+
+# The tests import lake-compare's modules, ../shared and the bench's localdb stand-in.
+ROOT = Path(__file__).resolve().parents[2]
+for folder in ("lake-compare", "shared", "bench"):
+    if str(ROOT / folder) not in sys.path:
+        sys.path.insert(0, str(ROOT / folder))
@@ -0,0 +1,82 @@
+﻿import pytest
+
+import localdb
+from _hashdiff import DATABRICKS, SYNAPSE, HashDiff, Side
+from _query import databricks_query, synapse_query
+
+SYNAPSE_TABLE = "dbo.fact"
+DATABRICKS_TABLE = "main.dbo.fact"
+CLASSES = {"DateID": ("int", 0), "id": ("int", 0), "city": ("string", 0), "amount": ("decimal", 2), "loaded": ("datetime", 0)}
+NON_ASCII = "Zürich – Łódź 東京"
+
+# (DateID, id, city, amount, loaded); datetime2(7) text on Synapse, microseconds on Databricks.
+SYNAPSE_ROWS = [
+    (20240101, 1, "Basel", 10.5, "2024-01-01 12:00:00.0000000"),
+    (20240101, 2, NON_ASCII, 20.0, "2024-01-01 12:00:00.0000000"),
+    (20240101, 3, "Bern", 30.25, "2024-01-01 12:00:00.0006000"),
+    (20240101, 4, "Genf", 40.0, "2024-01-01 12:00:00.0000000"),
+    (20240101, 5, "Chur", 50.0, "2024-01-01 12:00:00.0000000"),
+    (20240101, 6, "東京", 60.0, "2024-01-01 12:00:00.0000000"),
+]
+DATABRICKS_ROWS = [
+    (20240101, 1, "Basel", 10.5, "2024-01-01 12:00:00.000000"),
+    (20240101, 2, NON_ASCII, 20.0, "2024-01-01 12:00:00.000000"),
+    (20240101, 3, "Bern", 30.25, "2024-01-01 12:00:00.000600"),
+    (20240101, 4, "Genf", 41.0, "2024-01-01 12:00:00.000000"),
+    (20240101, 6, "京都", 60.0, "2024-01-01 12:00:00.000000"),
+]
+
+
+@pytest.fixture
+def engines(tmp_path):
+    for engine, table, rows in (("synapse", SYNAPSE_TABLE, SYNAPSE_ROWS), ("databricks", DATABRICKS_TABLE, DATABRICKS_ROWS)):
+        db = localdb.create(engine, tmp_path)
+        db.execute(f"CREATE TABLE {localdb.quote(table)} (DateID INTEGER, id INTEGER, city TEXT, amount REAL, loaded TEXT)")
+        db.executemany(f"INSERT INTO {localdb.quote(table)} VALUES (?, ?, ?, ?, ?)", rows)
+        db.commit()
+        db.close()
+    syn_con = localdb.Connection("synapse", localdb.db_path("synapse", tmp_path))
+    dbx_con = localdb.Connection("databricks", localdb.db_path("databricks", tmp_path))
+    yield syn_con, dbx_con
+    syn_con.close()
+    dbx_con.close()
+
+
+def run_diff(engines, keys):
+    syn_con, dbx_con = engines
+    differ = HashDiff(keys=keys, columns=list(CLASSES), classes=CLASSES, log=lambda _: None)
+    syn = Side(SYNAPSE, SYNAPSE_TABLE, lambda q: synapse_query(syn_con, q))
+    dbx = Side(DATABRICKS, DATABRICKS_TABLE, lambda q: databricks_query(dbx_con, q))
+    return differ.run(syn, dbx)
+
+
+def test_keyed_diff_reports_only_rows_that_differ(engines):
+    out = run_diff(engines, ["DateID", "id"])
+    found = {(k, status, cols) for k, status, cols in zip(out["_k"], out["status"], out["diff_columns"])}
+    # Equal rows stay quiet: the non-ASCII city (2) and the 12:00:00.0006 timestamp (3).
+    assert found == {
+        ("20240101|4", "different", "amount"),
+        ("20240101|5", "missing_in_databricks", ""),
+        ("20240101|6", "different", "city"),
+    }
+
+
+def test_unkeyed_diff_reports_changed_rows_on_both_sides(engines):
+    out = run_diff(engines, ["DateID"])
+    found = sorted((status, int(i)) for status, i in zip(out["status"], out["id_synapse"].fillna(out["id_databricks"])))
+    assert found == [
+        ("missing_in_databricks", 4),
+        ("missing_in_databricks", 5),
+        ("missing_in_databricks", 6),
+        ("missing_in_synapse", 4),
+        ("missing_in_synapse", 6),
+    ]
+
+
+@pytest.mark.parametrize("column", ["city", "loaded"])
+def test_both_engines_render_the_same_text(engines, column):
+    syn_con, dbx_con = engines
+    cls, scale = CLASSES[column]
+    syn = synapse_query(syn_con, f"SELECT id, {SYNAPSE.norm(column, cls, scale)} AS v FROM {SYNAPSE_TABLE} WHERE id IN (2, 3)")
+    dbx = databricks_query(dbx_con, f"SELECT id, {DATABRICKS.norm(column, cls, scale)} AS v FROM {DATABRICKS_TABLE} WHERE id IN (2, 3)")
+    assert syn.sort_values("id")["v"].tolist() == dbx.sort_values("id")["v"].tolist()
@@ -0,0 +1,100 @@
+﻿import decimal
+import math
+
+import pyarrow as pa
+import pytest
+
+import localdb
+from _serverdiff import ServerDiff, column_literals, sql_literal
+
+KEYS = ["DateID", "region"]
+DATABRICKS_AGG = "main.dbo.agg"
+INF = float("inf")
+
+# The Synapse aggregate as fetched, and the Databricks one it is matched against.
+SYNAPSE_GROUPS = [
+    (1, "a", 10.0),
+    (None, "b", 5.0),  # NULL key: matches its Databricks twin
+    (2, None, INF),  # inf on both sides is equal
+    (3, "c", math.nan),  # NaN uploads as NULL, which counts as 0
+    (4, "d", 1.0),
+    (5, "e", 7.0),  # Synapse only
+    (7, "it's", -INF),
+]
+DATABRICKS_GROUPS = [
+    (1, "a", 10.0),
+    (None, "b", 5.0),
+    (2, None, INF),
+    (3, "c", None),
+    (4, "d", 2.0),
+    (6, "f", 3.0),  # Databricks only
+    (7, "it's", 0.0),
+]
+
+
+@pytest.fixture
+def dbx_con(tmp_path):
+    db = localdb.create("databricks", tmp_path)
+    db.execute(f"CREATE TABLE {localdb.quote(DATABRICKS_AGG)} (DateID INTEGER, region TEXT, sum_amount REAL)")
+    db.executemany(f"INSERT INTO {localdb.quote(DATABRICKS_AGG)} VALUES (?, ?, ?)", DATABRICKS_GROUPS)
+    db.commit()
+    db.close()
+    con = localdb.Connection("databricks", localdb.db_path("databricks", tmp_path))
+    yield con
+    con.close()
+
+
+def synapse_batches(batch_rows: int):
+    table = pa.table({
+        "DateID": pa.array([r[0] for r in SYNAPSE_GROUPS], pa.int64()),
+        "region": pa.array([r[1] for r in SYNAPSE_GROUPS], pa.string()),
+        "sum_amount": pa.array([r[2] for r in SYNAPSE_GROUPS], pa.float64()),
+    })
+    return iter(table.to_batches(batch_rows))
+
+
+@pytest.mark.parametrize("insert_bytes", [1, 8 * 1024 * 1024])
+def test_server_diff_reports_mismatching_groups(dbx_con, insert_bytes):
+    differ = ServerDiff(keys=KEYS, staging_schema="main.scratch", insert_bytes=insert_bytes, log=lambda _: None)
+    batches = (pa.Table.from_batches([b]) for b in synapse_batches(3))
+    rows, counts = differ.run(batches, dbx_con, f"SELECT DateID, region, sum_amount FROM {DATABRICKS_AGG}")
+
+    assert counts == {"groups": 8, "mismatching": 4}
+    groups = rows[rows["DateID"] != "TOTAL"]
+    found = {(int(d), r): (s, x) for d, r, s, x in zip(groups["DateID"], groups["region"], groups["sum_amount_synapse"], groups["sum_amount_databricks"])}
+    # A side without the group reads as 0, as in the client-side merge.
+    assert found == {(4, "d"): (1.0, 2.0), (5, "e"): (7.0, 0.0), (6, "f"): (0.0, 3.0), (7, "it's"): (-INF, 0.0)}
+    # Staging tables are dropped again.
+    left = dbx_con.cursor().execute("SELECT name FROM sqlite_master WHERE name LIKE 'main.scratch.%'").fetchall()
+    assert left == []
+
+
+def test_totals_on_an_empty_match_are_zero(dbx_con):
+    differ = ServerDiff(keys=KEYS, staging_schema="main.scratch", log=lambda _: None)
+    empty = pa.table({"DateID": pa.array([], pa.int64()), "region": pa.array([], pa.string()), "sum_amount": pa.array([], pa.float64())})
+    rows, counts = differ.run(iter([empty]), dbx_con, f"SELECT DateID, region, sum_amount FROM {DATABRICKS_AGG} WHERE DateID < 0")
+    assert counts == {"groups": 0, "mismatching": 0}
+    assert list(rows["DateID"]) == ["TOTAL"]
+
+
+@pytest.mark.parametrize("value", [None, math.nan, INF, -INF, 1.5, 42, True, decimal.Decimal("-12.50"), "it's a \\ path", "Zürich"])
+def test_sql_literal_reads_back_as_the_value(dbx_con, value):
+    (got,) = dbx_con.cursor().execute(f"SELECT {sql_literal(value)}").fetchall()[0]
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        assert got is None
+    elif isinstance(value, decimal.Decimal):
+        assert decimal.Decimal(str(got)) == value
+    else:
+        assert got == value
+
+
+@pytest.mark.parametrize("array", [
+    pa.array([1, None, -7], pa.int64()),
+    pa.array([decimal.Decimal("1.50"), None, decimal.Decimal("-0.01")], pa.decimal128(18, 2)),
+    pa.array(["it's", None, "a \\ b", "Zürich"], pa.string()),
+    pa.array([1.5, None, INF, math.nan], pa.float64()),
+    pa.array([True, None, False], pa.bool_()),
+])
+def test_column_literals_match_sql_literal(array):
+    column = pa.chunked_array([array])
+    assert column_literals(column).to_pylist() == [sql_literal(v) for v in array.to_pylist()]
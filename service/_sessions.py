@@ -0,0 +1,145 @@
+﻿import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+
+def _close(con: Any) -> None:
+    try:
+        con.close()
+    except Exception:
+        pass
+
+
+def alive(con: Any) -> bool:
+    try:
+        cur = con.cursor()
+        cur.execute("SELECT 1")
+        cur.fetchall()
+        cur.close()
+        return True
+    except Exception:
+        return False
+
+
+class Lease:
+    # A warm connection lent to job code. close() and the end of a `with` block
+    # hand it back to the WarmSessions instead of closing it.
+
+    def __init__(self, sessions: "WarmSessions", engine: str, con: Any):
+        self._sessions = sessions
+        self._engine = engine
+        self._con = con
+        self._returned = False
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._con, name)
+
+    def close(self) -> None:
+        if not self._returned:
+            self._returned = True
+            self._sessions.release(self._engine, self._con)
+
+    def __enter__(self) -> "Lease":
+        return self
+
+    def __exit__(self, exc_type, *exc) -> None:
+        # A pyodbc connection commits on a clean `with` exit; keep that.
+        if exc_type is None and hasattr(self._con, "commit"):
+            self._con.commit()
+        self.close()
+
+
+class WarmSessions:
+    # Idle connections per engine, kept across jobs so the interactive Synapse
+    # login and the Databricks session setup happen once per service rather than
+    # once per run. A session idle for more than `validate_after` seconds is
+    # checked with SELECT 1 before it is lent out and replaced when dead (expired
+    # token, dropped session); keepalive() does the same for all idle sessions.
+
+    def __init__(self, connect: Dict[str, Callable[[], Any]], max_idle: int = 4, validate_after: float = 60.0):
+        self._connect = connect
+        self.max_idle = max_idle
+        self.validate_after = validate_after
+        self._idle: Dict[str, List[Tuple[Any, float]]] = {e: [] for e in connect}
+        self._stats = {e: {"created": 0, "reused": 0, "replaced": 0, "leased": 0} for e in connect}
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def _new(self, engine: str) -> Any:
+        con = self._connect[engine]()
+        with self._lock:
+            self._stats[engine]["created"] += 1
+        return con
+
+    def lease(self, engine: str) -> Lease:
+        while True:
+            with self._lock:
+                if self._closed:
+                    raise RuntimeError("Compare service sessions are closed")
+                if not self._idle[engine]:
+                    break
+                con, used = self._idle[engine].pop()
+            if time.monotonic() - used < self.validate_after or alive(con):
+                with self._lock:
+                    self._stats[engine]["reused"] += 1
+                    self._stats[engine]["leased"] += 1
+                return Lease(self, engine, con)
+            _close(con)
+            with self._lock:
+                self._stats[engine]["replaced"] += 1
+        con = self._new(engine)
+        with self._lock:
+            self._stats[engine]["leased"] += 1
+        return Lease(self, engine, con)
+
+    def release(self, engine: str, con: Any) -> None:
+        with self._lock:
+            self._stats[engine]["leased"] -= 1
+            if not self._closed and len(self._idle[engine]) < self.max_idle:
+                self._idle[engine].append((con, time.monotonic()))
+                return
+        _close(con)
+
+    def warm(self, n: int) -> None:
+        # Open n sessions per engine up front, so any login prompt shows at startup.
+        for engine in self._connect:
+            leases = [self.lease(engine) for _ in range(n)]
+            for lease in leases:
+                lease.close()
+
+    def keepalive(self) -> None:
+        for engine in self._connect:
+            with self._lock:
+                idle, self._idle[engine] = self._idle[engine], []
+            kept = []
+            for con, _ in idle:
+                if alive(con):
+                    kept.append(con)
+                    continue
+                _close(con)
+                with self._lock:
+                    self._stats[engine]["replaced"] += 1
+                try:
+                    kept.append(self._new(engine))
+                except Exception as e:
+                    print(f"keepalive: could not reconnect to {engine}: {e}")
+            now = time.monotonic()
+            for con in kept:
+                with self._lock:
+                    closed = self._closed
+                    if not closed:
+                        self._idle[engine].append((con, now))
+                if closed:
+                    _close(con)
+
+    def status(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {e: {**s, "idle": len(self._idle[e])} for e, s in self._stats.items()}
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            idle = [con for cons in self._idle.values() for con, _ in cons]
+            self._idle = {e: [] for e in self._connect}
+        for con in idle:
+            _close(con)
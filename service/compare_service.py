@@ -0,0 +1,372 @@
+﻿import argparse
+import datetime
+import hmac
+import http.client
+import importlib
+import io
+import json
+import os
+import secrets
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager, redirect_stderr, redirect_stdout
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from _sessions import WarmSessions
+
+HERE = Path(__file__).resolve().parent
+# Connections, SESSIONS and the client side of the job protocol live in ../shared,
+# imported once here and by both tools, so every script sees the same SESSIONS.
+sys.path.insert(0, str(HERE.parent / "shared"))
+import _base
+TOOLS = {
+    "ddr": (HERE.parent / "ddr-compare", ["compare_table_by_dateid", "compare_many_tables_by_dateid"]),
+    "lake": (HERE.parent / "lake-compare", ["compare", "inventory_synapse", "inventory_databricks", "build_mapping"]),
+}
+# Client settings a job runs with; connection settings (SYNAPSE_*, DATABRICKS_*,
+# COMPARE_BACKEND) are the service's own.
+ENV_PREFIXES = _base.SERVICE_ENV_PREFIXES
+
+
+@dataclass
+class Tool:
+    common: ModuleType
+    scripts: Dict[str, ModuleType]
+
+
+def load_tool(folder: Path, scripts: List[str]) -> Tool:
+    # ddr-compare and lake-compare each have their own _common. Import one folder
+    # at a time and take its modules back out of sys.modules, so the scripts keep
+    # references to their own helpers and the next folder loads fresh. The
+    # ../shared modules stay loaded and are common to both.
+    local = {p.stem for p in folder.glob("*.py")}
+    saved = {m: sys.modules.pop(m) for m in local if m in sys.modules}
+    sys.path.insert(0, str(folder))
+    try:
+        modules = {s: importlib.import_module(s) for s in scripts}
+        common = sys.modules["_common"]
+    finally:
+        for m in local:
+            sys.modules.pop(m, None)
+        sys.path.remove(str(folder))
+        sys.modules.update(saved)
+    return Tool(common, modules)
+
+
+class JobStream(io.TextIOBase):
+    # stdout / stderr of a running job, relayed to the client as JSON lines.
+
+    def __init__(self, send: Callable[[Dict[str, Any]], None], name: str):
+        self._send = send
+        self.name = name
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, s: str) -> int:
+        if s:
+            self._send({"stream": self.name, "text": s})
+        return len(s)
+
+
+class Service:
+    # Runs the CLIs' main() in this process on warm sessions. Jobs run one at a
+    # time: they share stdout, the working directory and os.environ (each job may
+    # still use --parallel etc. inside).
+
+    def __init__(self, tools: Dict[str, Tool], sessions: WarmSessions):
+        self.tools = tools
+        self.sessions = sessions
+        self.env_prefixes = ENV_PREFIXES
+        self.backend = os.getenv("COMPARE_BACKEND")
+        self.started = datetime.datetime.now().isoformat(timespec="seconds")
+        self.done = 0
+        self.waiting = 0
+        self.running: Optional[str] = None
+        self._lock = threading.Lock()
+        self._job_lock = threading.Lock()
+
+    def check(self, job: Dict[str, Any]) -> Optional[str]:
+        # Why a job cannot run here, or None.
+        tool = self.tools.get(job.get("tool"))
+        if tool is None or job.get("script") not in tool.scripts:
+            return f"unknown job {job.get('tool')}/{job.get('script')}"
+        if job.get("backend") != self.backend:
+            return f"client COMPARE_BACKEND={job.get('backend')} but the service uses {self.backend}"
+        return None
+
+    @contextmanager
+    def _job_context(self, label: str, env: Dict[str, str], cwd: Optional[str]) -> Iterator[None]:
+        with self._job_lock:
+            with self._lock:
+                self.waiting -= 1
+                self.running = label
+            saved_env = {k: v for k, v in os.environ.items() if k.startswith(self.env_prefixes)}
+            saved_cwd = os.getcwd()
+            for k in saved_env:
+                del os.environ[k]
+            os.environ.update(env)
+            try:
+                if cwd:
+                    os.chdir(cwd)
+                yield
+            finally:
+                os.chdir(saved_cwd)
+                for k in [k for k in os.environ if k.startswith(self.env_prefixes)]:
+                    del os.environ[k]
+                os.environ.update(saved_env)
+                with self._lock:
+                    self.running = None
+                    self.done += 1
+
+    def run_job(self, job: Dict[str, Any], send: Callable[[Dict[str, Any]], None]) -> int:
+        module = self.tools[job["tool"]].scripts[job["script"]]
+        label = f"{job['tool']}/{job['script']} {' '.join(job.get('argv') or [])}".strip()
+        with self._lock:
+            self.waiting += 1
+            if self.running:
+                send({"stream": "err", "text": f"Queued behind: {self.running}\n"})
+        started = time.perf_counter()
+        with self._job_context(label, job.get("env") or {}, job.get("cwd")):
+            argv = sys.argv
+            sys.argv = [module.__file__, *(job.get("argv") or [])]
+            try:
+                with redirect_stdout(JobStream(send, "out")), redirect_stderr(JobStream(send, "err")):
+                    code = self._call(module.main)
+            finally:
+                sys.argv = argv
+        print(f"{datetime.datetime.now():%H:%M:%S} {label} -> exit {code} in {time.perf_counter() - started:.1f}s")
+        return code
+
+    @staticmethod
+    def _call(main: Callable[[], Optional[int]]) -> int:
+        try:
+            return main() or 0
+        except SystemExit as e:
+            if isinstance(e.code, int) or e.code is None:
+                return e.code or 0
+            print(e.code, file=sys.stderr)
+            return 1
+        except Exception:
+            traceback.print_exc()
+            return 1
+
+    def lookup(self, synapse_2part: str, env: Dict[str, str], cwd: Optional[str]) -> Dict[str, str]:
+        # mapping.json first (what lake compare.py uses), then the ddr name
+        # heuristic over the cached Databricks object list.
+        with self._lock:
+            self.waiting += 1
+        with self._job_context(f"lookup {synapse_2part}", env, cwd):
+            lake, ddr = self.tools["lake"], self.tools["ddr"]
+            if os.getenv("LAKE_COMPARE_OUT_DIR") and (lake.common.out_dir() / "mapping.json").exists():
+                try:
+                    mappings = lake.scripts["compare"].load_mapping()
+                    return {"databricks": lake.scripts["compare"].find_databricks_fqn(synapse_2part, mappings), "source": "mapping"}
+                except RuntimeError:
+                    pass
+            with ddr.common.databricks_connect() as con:
+                catalog = ddr.common.monitoring_catalog(con)
+            return {"databricks": ddr.common.best_match_databricks_fqn(catalog, synapse_2part), "source": "catalog"}
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "started": self.started,
+                "backend": self.backend,
+                "jobs_done": self.done,
+                "running": self.running,
+                "waiting": self.waiting,
+                "sessions": self.sessions.status(),
+            }
+
+
+class Handler(BaseHTTPRequestHandler):
+    server: "ServiceServer"
+
+    def log_message(self, fmt: str, *args) -> None:
+        pass
+
+    def _reply(self, status: int, body: Any) -> None:
+        data = (json.dumps(body) + "\n").encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _authorized(self) -> bool:
+        if hmac.compare_digest(self.headers.get("X-Compare-Token", ""), self.server.token):
+            return True
+        self._reply(403, {"error": "bad token"})
+        return False
+
+    def _body(self) -> Dict[str, Any]:
+        return json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+
+    def do_GET(self) -> None:
+        if not self._authorized():
+            return
+        if self.path == "/status":
+            self._reply(200, self.server.service.status())
+        else:
+            self._reply(404, {"error": f"no such endpoint {self.path}"})
+
+    def do_POST(self) -> None:
+        if not self._authorized():
+            return
+        service = self.server.service
+        if self.path == "/jobs":
+            job = self._body()
+            problem = service.check(job)
+            if problem:
+                self._reply(409, {"error": problem})
+                return
+            self._stream_job(job)
+        elif self.path == "/lookup":
+            req = self._body()
+            try:
+                self._reply(200, service.lookup(req["synapse"], req.get("env") or {}, req.get("cwd")))
+            except Exception as e:
+                self._reply(500, {"error": f"{type(e).__name__}: {e}"})
+        elif self.path == "/shutdown":
+            self._reply(200, {"stopping": True})
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+        else:
+            self._reply(404, {"error": f"no such endpoint {self.path}"})
+
+    def _stream_job(self, job: Dict[str, Any]) -> None:
+        # JSON lines: {"stream": "out" | "err", "text": ...} while the job runs,
+        # then {"exit": code}. The job finishes even if the client goes away.
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        lock = threading.Lock()
+        gone = False
+
+        def send(msg: Dict[str, Any]) -> None:
+            nonlocal gone
+            with lock:
+                if gone:
+                    return
+                try:
+                    self.wfile.write((json.dumps(msg) + "\n").encode())
+                    self.wfile.flush()
+                except OSError:
+                    gone = True
+
+        send({"exit": self.server.service.run_job(job, send)})
+
+
+class ServiceServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int, service: Service, token: str):
+        super().__init__(("127.0.0.1", port), Handler)
+        self.service = service
+        self.token = token
+
+
+def request(method: str, path: str, body: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    try:
+        info = json.loads(_base.service_file().read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        raise SystemExit(f"No compare service running ({_base.service_file()} not found)")
+    con = http.client.HTTPConnection("127.0.0.1", info["port"], timeout=600)
+    try:
+        con.request(method, path, json.dumps(body) if body is not None else None, {"X-Compare-Token": info["token"]})
+        resp = con.getresponse()
+        data = json.loads(resp.read() or b"{}")
+    except OSError as e:
+        raise SystemExit(f"Compare service on port {info['port']} is not answering ({e}); remove {_base.service_file()} if it is gone")
+    finally:
+        con.close()
+    if resp.status != 200:
+        raise SystemExit(f"Compare service: {data.get('error', resp.status)}")
+    return data
+
+
+def start(args: argparse.Namespace) -> int:
+    path = _base.service_file()
+    if path.exists():
+        try:
+            request("GET", "/status")
+        except SystemExit:
+            path.unlink(missing_ok=True)  # left behind by a service that is gone
+        else:
+            raise SystemExit(f"A compare service is already running ({path})")
+
+    tools = {name: load_tool(folder, scripts) for name, (folder, scripts) in TOOLS.items()}
+    sessions = WarmSessions(
+        {"synapse": _base._synapse_connect, "databricks": _base._databricks_connect},
+        max_idle=args.max_idle,
+        validate_after=args.validate_after,
+    )
+    _base.SESSIONS = sessions
+    print(f"Opening {args.warm} warm session(s) per engine...")
+    sessions.warm(args.warm)
+
+    service = Service(tools, sessions)
+    token = secrets.token_hex(16)
+    server = ServiceServer(args.port, service, token)
+    port = server.server_address[1]
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps({"pid": os.getpid(), "port": port, "token": token, "started": service.started}), encoding="utf-8")
+    os.chmod(path, 0o600)
+
+    def keepalive() -> None:
+        while True:
+            time.sleep(args.keepalive)
+            sessions.keepalive()
+
+    threading.Thread(target=keepalive, name="keepalive", daemon=True).start()
+    print(f"Compare service on 127.0.0.1:{port} ({path}); the CLIs now submit here. Ctrl+C or `stop` to end.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        sessions.close()
+        path.unlink(missing_ok=True)
+        print("Compare service stopped")
+    return 0
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("start", help="Run the service in the foreground")
+    p.add_argument("--port", type=int, default=0, help="Local port (default: any free port, written to the service file)")
+    p.add_argument("--warm", type=int, default=1, help="Sessions per engine opened at startup")
+    p.add_argument("--max-idle", type=int, default=4, help="Idle sessions kept per engine")
+    p.add_argument("--validate-after", type=float, default=60.0, help="Check a session with SELECT 1 when idle this many seconds")
+    p.add_argument("--keepalive", type=float, default=300.0, help="Seconds between keepalive checks of idle sessions")
+    sub.add_parser("status", help="Print jobs and session counts")
+    p = sub.add_parser("lookup", help="Databricks name for a Synapse table")
+    p.add_argument("synapse_table", help="2-part: SCHEMA.TABLE")
+    sub.add_parser("stop", help="Stop the running service")
+    args = ap.parse_args()
+
+    if args.command == "start":
+        return start(args)
+    if args.command == "status":
+        print(json.dumps(request("GET", "/status"), indent=2))
+    elif args.command == "lookup":
+        env = {k: v for k, v in os.environ.items() if k.startswith(ENV_PREFIXES)}
+        r = request("POST", "/lookup", {"synapse": args.synapse_table, "env": env, "cwd": os.getcwd()})
+        print(f"{r['databricks']}  ({r['source']})")
+    elif args.command == "stop":
+        request("POST", "/shutdown", {})
+        print("Stopping compare service")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,416 @@
+﻿from __future__ import annotations
+
+import contextvars
+import cProfile
+import datetime
+import http.client
+import importlib
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Iterator, List, Optional, Tuple
+
+# Stdlib only: the unified CLI imports this module before it knows which tool
+# (and so whether pandas) is needed. The drivers are imported on first connect.
+if TYPE_CHECKING:
+    import pyodbc
+    from databricks import sql as dbsql
+
+
+def require_env(name: str) -> str:
+    v = os.getenv(name)
+    if not v:
+        raise RuntimeError(f"Missing env var: {name}")
+    return v
+
+
+def peak_rss_mb() -> Optional[float]:
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class Counters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD), ("PeakWorkingSetSize", ctypes.c_size_t)]
+            _fields_ += [(f"_{i}", ctypes.c_size_t) for i in range(7)]
+
+        c = Counters()
+        c.cb = ctypes.sizeof(c)
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(c), c.cb):
+            return None
+        return round(c.PeakWorkingSetSize / 2**20, 1)
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in bytes on macOS, kilobytes elsewhere
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+
+class Trace:
+    # JSONL span log for one run, shared by all threads. Each line: phase, table,
+    # wall seconds, optional rows/bytes/engine, and process peak RSS so far.
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.run = path.stem
+        self._lock = threading.Lock()
+        self._f = path.open("a", encoding="utf-8")
+
+    def emit(self, phase: str, seconds: float, **fields) -> None:
+        rec = {
+            "run": self.run,
+            "ts": datetime.datetime.now().isoformat(timespec="milliseconds"),
+            "phase": phase,
+            "table": fields.pop("table", None) or _TRACE_TABLE.get(),
+            "seconds": round(seconds, 4),
+            **fields,
+            "peak_rss_mb": peak_rss_mb(),
+            "thread": threading.current_thread().name,
+        }
+        line = json.dumps(rec, default=str)
+        with self._lock:
+            self._f.write(line + "\n")
+            self._f.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._f.close()
+
+
+_TRACE: Optional[Trace] = None
+_TRACE_TABLE: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("trace_table", default=None)
+
+
+def trace_event(phase: str, seconds: float, **fields) -> None:
+    if _TRACE is not None:
+        _TRACE.emit(phase, seconds, **fields)
+
+
+@contextmanager
+def span(phase: str, table: Optional[str] = None, **fields) -> Iterator[dict]:
+    # Times the block; the yielded dict can be filled with rows/bytes. `table`
+    # is inherited by spans nested on the same thread.
+    token = _TRACE_TABLE.set(table) if table else None
+    started = time.perf_counter()
+    try:
+        yield fields
+    except BaseException as e:
+        fields["error"] = type(e).__name__
+        raise
+    finally:
+        if token is not None:
+            _TRACE_TABLE.reset(token)
+        trace_event(phase, time.perf_counter() - started, table=table, **fields)
+
+
+@contextmanager
+def trace_run(out: Path, name: str, profile: bool = False) -> Iterator[Trace]:
+    # <out>/<name>_trace_<timestamp>.jsonl; with profile, also a cProfile dump of the run.
+    global _TRACE
+    stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    trace = Trace(out / f"{name}_trace_{stamp}.jsonl")
+    _TRACE = trace
+    profiler = cProfile.Profile() if profile else None
+    try:
+        with span("run"):
+            if profiler is not None:
+                profiler.enable()
+            try:
+                yield trace
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+    finally:
+        _TRACE = None
+        trace.close()
+        print("Wrote trace:", trace.path)
+        if profiler is not None:
+            prof_path = out / f"{name}_profile_{stamp}.prof"
+            profiler.dump_stats(prof_path)
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+            print("Wrote profile:", prof_path)
+
+
+def add_trace_args(ap) -> None:
+    ap.add_argument("--profile", action="store_true", help="Run under cProfile and write a .prof next to the trace")
+
+
+def add_dry_run_args(ap) -> None:
+    ap.add_argument("--dry-run", action="store_true", help="Print the SQL each engine would be sent and exit without connecting")
+
+
+def show_sql(label: str, *statements: str) -> None:
+    # --dry-run output: a comment naming the step, then its statements as sent.
+    print(f"-- {label}")
+    for sql in statements:
+        print(sql.strip() + ";")
+    print()
+
+
+def backend_connect(engine: str) -> Optional[Any]:
+    # COMPARE_BACKEND=<module> swaps the real drivers for a stand-in module exposing
+    # connect(engine) -> DB-API connection, e.g. bench/localdb.py.
+    name = os.getenv("COMPARE_BACKEND")
+    if not name:
+        return None
+    return importlib.import_module(name).connect(engine)
+
+
+# Warm sessions lent by service/compare_service.py while it runs a job; None in a normal run.
+SESSIONS: Optional[Any] = None
+
+# Client settings a service job runs with; connection settings are the service's own.
+SERVICE_ENV_PREFIXES = ("DDR_COMPARE_", "LAKE_COMPARE_", "COMPARE_CATALOG_CACHE", "COMPARE_RESULTS_DIR", "COMPARE_CSV")
+
+
+def service_file() -> Path:
+    return Path(os.getenv("COMPARE_SERVICE_FILE") or Path.home() / ".compare_service.json")
+
+
+def submit_to_service(tool: str, script: str, argv: List[str]) -> Optional[int]:
+    # Runs a CLI inside a running compare service and relays its output. None
+    # when no service is up (or COMPARE_SERVICE=off): the caller then runs locally.
+    if os.getenv("COMPARE_SERVICE", "").lower() == "off":
+        return None
+    if "--watch" in argv and "--once" not in argv:
+        return None  # a watch loop would hold the service's one job slot for good
+    try:
+        info = json.loads(service_file().read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    job = {
+        "tool": tool,
+        "script": script,
+        "argv": argv,
+        "cwd": os.getcwd(),
+        "backend": os.getenv("COMPARE_BACKEND"),
+        "env": {k: v for k, v in os.environ.items() if k.startswith(SERVICE_ENV_PREFIXES)},
+    }
+    con = http.client.HTTPConnection("127.0.0.1", info["port"], timeout=5)
+    try:
+        con.connect()
+        # Only the connect is bounded: a job may print nothing for a long time.
+        con.sock.settimeout(None)
+        con.request("POST", "/jobs", json.dumps(job), {"Content-Type": "application/json", "X-Compare-Token": info["token"]})
+        resp = con.getresponse()
+    except OSError:
+        return None
+    if resp.status != 200:
+        print(f"Compare service refused the job ({resp.status}: {resp.read().decode(errors='replace').strip()}), running locally", file=sys.stderr)
+        con.close()
+        return None
+    code = None
+    for line in resp:
+        msg = json.loads(line)
+        if "exit" in msg:
+            code = msg["exit"]
+            continue
+        stream = sys.stderr if msg["stream"] == "err" else sys.stdout
+        stream.write(msg["text"])
+        stream.flush()
+    con.close()
+    if code is None:
+        print("Compare service closed the connection before the job finished", file=sys.stderr)
+        return 1
+    return code
+
+
+def run_cli(main: Callable[[], Optional[int]], tool: str) -> int:
+    # Script entry point: hand the run to the compare service when one is running.
+    code = submit_to_service(tool, Path(sys.argv[0]).stem, sys.argv[1:])
+    if code is None:
+        code = main()
+    return code or 0
+
+
+def synapse_connect() -> pyodbc.Connection:
+    with span("connect", engine="synapse"):
+        if SESSIONS is not None:
+            return SESSIONS.lease("synapse")
+        return _synapse_connect()
+
+
+def _synapse_connect() -> pyodbc.Connection:
+    con = backend_connect("synapse")
+    if con is not None:
+        return con
+    import pyodbc
+
+    server = require_env("SYNAPSE_SERVER")
+    db = require_env("SYNAPSE_DB")
+    uid = os.getenv("SYNAPSE_UID", "")
+
+    # Matches SSMS: Azure Active Directory - Universal with MFA
+    conn_str = (
+        "Driver={ODBC Driver 18 for SQL Server};"
+        f"Server=tcp:{server},1433;"
+        f"Database={db};"
+        "Encrypt=yes;TrustServerCertificate=no;"
+        "Connection Timeout=30;"
+        "Authentication=ActiveDirectoryInteractive;"
+        + (f"UID={uid};" if uid else "")
+    )
+    return pyodbc.connect(conn_str)
+
+
+def databricks_connect() -> dbsql.Connection:
+    with span("connect", engine="databricks"):
+        if SESSIONS is not None:
+            return SESSIONS.lease("databricks")
+        return _databricks_connect()
+
+
+def _databricks_connect() -> dbsql.Connection:
+    con = backend_connect("databricks")
+    if con is not None:
+        return con
+    from databricks import sql as dbsql
+
+    host = require_env("DATABRICKS_SERVER_HOSTNAME")
+    http_path = require_env("DATABRICKS_HTTP_PATH")
+    auth_type = os.getenv("DATABRICKS_AUTH_TYPE", "azure-cli")
+    return dbsql.connect(server_hostname=host, http_path=http_path, auth_type=auth_type)
+
+
+def query_errors() -> Tuple[type, ...]:
+    # The drivers' error types, for `except query_errors():`. Only evaluated once
+    # something has raised, so catching them never imports a driver up front. A
+    # driver that cannot load (no ODBC stack on a bench host) cannot have raised,
+    # and a COMPARE_BACKEND stand-in adds the errors it raises in its place.
+    errors: List[type] = []
+    try:
+        import pyodbc
+
+        errors.append(pyodbc.Error)
+    except ImportError:
+        pass
+    try:
+        from databricks.sql.exc import Error as DatabricksError
+
+        errors.append(DatabricksError)
+    except ImportError:
+        pass
+    name = os.getenv("COMPARE_BACKEND")
+    if name:
+        errors.extend(getattr(importlib.import_module(name), "ERRORS", ()))
+    return tuple(errors)
+
+
+class ConnectionPool:
+    # Thread-safe pool over synapse_connect / databricks_connect. Connections are
+    # created lazily up to `size` and handed out exclusively: neither pyodbc
+    # connections nor Databricks sessions may be shared between threads.
+
+    def __init__(self, connect: Callable[[], Any], size: int):
+        if size < 1:
+            raise ValueError(f"Pool size must be >= 1, got {size}")
+        self._connect = connect
+        self._size = size
+        self._idle: List[Any] = []
+        self._created = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def _checkout(self) -> Any:
+        with self._cond:
+            while not self._idle and self._created >= self._size:
+                if self._closed:
+                    raise RuntimeError("Connection pool is closed")
+                self._cond.wait()
+            if self._closed:
+                raise RuntimeError("Connection pool is closed")
+            if self._idle:
+                return self._idle.pop()
+            self._created += 1
+        try:
+            return self._connect()
+        except BaseException:
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            raise
+
+    def _checkin(self, con: Any, discard: bool = False) -> None:
+        with self._cond:
+            if not self._closed and not discard:
+                self._idle.append(con)
+                self._cond.notify()
+                return
+            self._created -= 1
+            self._cond.notify()
+        try:
+            con.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self, discard_on_error: bool = False) -> Iterator[Any]:
+        # discard_on_error: a connection whose work raised is closed rather than
+        # reused (e.g. after a dropped Databricks session); the next checkout reconnects.
+        con = self._checkout()
+        try:
+            yield con
+        except BaseException:
+            self._checkin(con, discard=discard_on_error)
+            raise
+        self._checkin(con)
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+            self._cond.notify_all()
+        for con in idle:
+            try:
+                con.close()
+            except Exception:
+                pass
+
+    def __enter__(self) -> ConnectionPool:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def safe_filename(s: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_]+", "_", s)
+
+
+def csv_enabled() -> bool:
+    return os.getenv("COMPARE_CSV", "").lower() != "off"
+
+
+def catalog_cache_path(out: Path) -> Path:
+    # COMPARE_CATALOG_CACHE lets ddr-compare and lake-compare share one cache file.
+    return Path(os.getenv("COMPARE_CATALOG_CACHE") or Path(out) / "catalog_cache.sqlite")
+
+
+def _yyyymmdd(v: int) -> Optional[datetime.date]:
+    try:
+        return datetime.datetime.strptime(str(v), "%Y%m%d").date()
+    except ValueError:
+        return None
+
+
+def dateid_ranges(lo: int, hi: int, n: int) -> List[Tuple[int, int]]:
+    # Up to n inclusive ranges covering [lo, hi]. yyyymmdd values are split by
+    # calendar day so each range spans a similar stretch of time.
+    d_lo, d_hi = _yyyymmdd(lo), _yyyymmdd(hi)
+    if d_lo and d_hi:
+        days = (d_hi - d_lo).days + 1
+        n = max(1, min(n, days))
+        starts = [int((d_lo + datetime.timedelta(days=days * i // n)).strftime("%Y%m%d")) for i in range(n)]
+    else:
+        width = hi - lo + 1
+        n = max(1, min(n, width))
+        starts = [lo + width * i // n for i in range(n)]
+    bounds = [*starts, hi + 1]
+    return [(bounds[i], bounds[i + 1] - 1) for i in range(n)]
@@ -0,0 +1,279 @@
+﻿from __future__ import annotations
+
+import datetime
+import functools
+import hashlib
+import json
+import re
+import sqlite3
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+COLUMNS = ["catalog", "schema", "name", "type", "modified"]
+COLUMN_FIELDS = ["catalog", "schema", "name", "column", "type"]
+ROW_COUNT_FIELDS = ["catalog", "schema", "name", "rows"]
+SIGNATURE_FIELDS = ["catalog", "schema", "name", "n_columns", "row_count", "signature", "names_signature"]
+
+# Synapse and Databricks spellings of the same kind of value; anything else is text.
+TYPE_FAMILIES = {
+    "int": ("tinyint", "smallint", "int", "integer", "bigint", "byte", "short", "long"),
+    "decimal": ("decimal", "numeric", "dec", "money", "smallmoney"),
+    "float": ("float", "real", "double"),
+    "bool": ("bit", "boolean"),
+    "date": ("date",),
+    "datetime": ("datetime", "datetime2", "smalldatetime", "datetimeoffset", "timestamp", "timestamp_ntz"),
+    "binary": ("binary", "varbinary", "image"),
+}
+TYPE_FAMILY = {t: family for family, types in TYPE_FAMILIES.items() for t in types}
+
+
+@dataclass
+class CatalogSource:
+    # fetch(since) returns COLUMNS for every object, or only those modified after
+    # `since` when the source has a change timestamp (incremental=True); count()
+    # is a cheap object count used to notice drops between full refreshes.
+    fetch: Callable[[Optional[str]], pd.DataFrame]
+    count: Callable[[], int]
+    incremental: bool = False
+
+
+@dataclass
+class ColumnSource:
+    # columns() returns COLUMN_FIELDS for every column of every object in scope,
+    # in one bulk query; row_counts() returns ROW_COUNT_FIELDS for the objects
+    # the engine keeps an approximate count for (possibly none).
+    columns: Callable[[], pd.DataFrame]
+    row_counts: Callable[[], pd.DataFrame]
+
+
+@functools.lru_cache(maxsize=None)
+def type_family(data_type: str) -> str:
+    # "decimal(18,2)", "DECIMAL" and "numeric" -> "decimal"
+    base = re.split(r"[(<\s]", str(data_type).strip().lower(), maxsplit=1)[0]
+    return TYPE_FAMILY.get(base, "string")
+
+
+@functools.lru_cache(maxsize=65536)
+def column_key(name: str) -> str:
+    # CustomerID, customer_id and CUSTOMERID are the same column on the other side.
+    return re.sub(r"[^a-z0-9]", "", str(name).lower())
+
+
+def _digest(parts: List[str]) -> str:
+    return hashlib.sha1("\n".join(sorted(parts)).encode("utf-8")).hexdigest()[:16]
+
+
+def column_signatures(columns: List[Tuple[str, str]]) -> Tuple[str, str]:
+    # (name:type-family signature, names-only signature) of an object's columns,
+    # independent of column order, so equal shapes hash equal across engines.
+    return (
+        _digest([f"{column_key(c)}:{type_family(t)}" for c, t in columns]),
+        _digest([column_key(c) for c, _ in columns]),
+    )
+
+
+class CatalogCache:
+    # Object names per engine in SQLite, with only the columns name resolution
+    # needs, indexed by catalog and schema. A snapshot younger than
+    # `ttl_hours` is used without touching the warehouse; an older one is
+    # refreshed incrementally (objects modified since the high-water mark, then
+    # an object count to catch drops) or, without a change column, in full.
+    # Column lists and signatures for the mapper are kept alongside, refreshed
+    # on the same ttl.
+
+    def __init__(self, path: Path, ttl_hours: float = 24.0):
+        self.path = Path(path)
+        self.ttl = datetime.timedelta(hours=ttl_hours)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS objects ("
+                " engine TEXT NOT NULL, catalog TEXT, schema TEXT, name TEXT NOT NULL, type TEXT, modified TEXT,"
+                " fqn TEXT NOT NULL, name_lower TEXT NOT NULL, PRIMARY KEY (engine, fqn))"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS objects_scope ON objects (engine, catalog, schema)")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS snapshots ("
+                " engine TEXT PRIMARY KEY, refreshed_at TEXT NOT NULL, high_water TEXT, objects INTEGER NOT NULL)"
+            )
+            # Column-level inventory, one row per object: the column list as compact
+            # JSON plus its two signatures, indexed for lookups by shape.
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS columns ("
+                " engine TEXT NOT NULL, fqn TEXT NOT NULL, catalog TEXT, schema TEXT, name TEXT NOT NULL,"
+                " columns TEXT NOT NULL, n_columns INTEGER NOT NULL, row_count INTEGER,"
+                " signature TEXT NOT NULL, names_signature TEXT NOT NULL, PRIMARY KEY (engine, fqn))"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS columns_signature ON columns (engine, signature)")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS column_snapshots ("
+                " engine TEXT PRIMARY KEY, refreshed_at TEXT NOT NULL, scope TEXT NOT NULL, objects INTEGER NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=60)
+
+    def _snapshot(self, db: sqlite3.Connection, engine: str) -> Optional[tuple]:
+        return db.execute("SELECT refreshed_at, high_water FROM snapshots WHERE engine = ?", (engine,)).fetchone()
+
+    def _upsert(self, db: sqlite3.Connection, engine: str, df: pd.DataFrame) -> None:
+        import pandas as pd
+
+        rows = []
+        for r in df[COLUMNS].itertuples(index=False):
+            catalog, schema, name, typ, modified = (None if pd.isna(v) else str(v) for v in r)
+            if not name:
+                continue
+            fqn = f"{catalog}.{schema}.{name}"
+            rows.append((engine, catalog, schema, name, typ, modified, fqn, name.lower()))
+        # Update in place so an object keeps its first position (ties in the
+        # name matcher go to the earlier object, as in the source listing).
+        db.executemany(
+            "INSERT INTO objects VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (engine, fqn) DO UPDATE SET type = excluded.type, modified = excluded.modified",
+            rows,
+        )
+
+    def _save(self, db: sqlite3.Connection, engine: str, high_water: Optional[str]) -> int:
+        n = db.execute("SELECT COUNT(*) FROM objects WHERE engine = ?", (engine,)).fetchone()[0]
+        now = datetime.datetime.now().isoformat(timespec="seconds")
+        db.execute("INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?)", (engine, now, high_water, n))
+        return n
+
+    def _fresh(self, snap: Optional[tuple]) -> bool:
+        return bool(snap) and datetime.datetime.now() - datetime.datetime.fromisoformat(snap[0]) < self.ttl
+
+    def snapshot(self, engine: str) -> Optional[tuple[str, Optional[str], bool]]:
+        # (refreshed_at, high-water mark, still within ttl) of the last refresh; None before the first.
+        with self._connect() as db:
+            snap = self._snapshot(db, engine)
+        return None if snap is None else (snap[0], snap[1], self._fresh(snap))
+
+    def refresh(self, engine: str, make_source: Callable[[], CatalogSource], force: bool = False) -> str:
+        # Returns "cached", "incremental" or "full"; the source is only built when needed.
+        with self._connect() as db:
+            snap = self._snapshot(db, engine)
+            if not force and self._fresh(snap):
+                return "cached"
+
+            source = make_source()
+            if snap and not force and source.incremental and snap[1]:
+                changed = source.fetch(snap[1])
+                self._upsert(db, engine, changed)
+                high_water = max([snap[1], *changed["modified"].dropna().astype(str)])
+                cached = db.execute("SELECT COUNT(*) FROM objects WHERE engine = ?", (engine,)).fetchone()[0]
+                if source.count() == cached:
+                    self._save(db, engine, high_water)
+                    return "incremental"
+
+            df = source.fetch(None)
+            db.execute("DELETE FROM objects WHERE engine = ?", (engine,))
+            self._upsert(db, engine, df)
+            modified = df["modified"].dropna().astype(str)
+            self._save(db, engine, modified.max() if len(modified) else None)
+            return "full"
+
+    def column_snapshot(self, engine: str) -> Optional[tuple[str, str, bool]]:
+        # (refreshed_at, scope, still within ttl) of the last column listing; None before the first.
+        with self._connect() as db:
+            snap = db.execute("SELECT refreshed_at, scope FROM column_snapshots WHERE engine = ?", (engine,)).fetchone()
+        return None if snap is None else (snap[0], snap[1], self._fresh(snap))
+
+    def refresh_columns(self, engine: str, make_source: Callable[[], ColumnSource], scope: str = "", force: bool = False) -> str:
+        # Returns "cached" or "full". Column lists have no change marker, so an
+        # expired listing (or one taken for a different scope, e.g. other
+        # schemas) is replaced by a fresh bulk read.
+        with self._connect() as db:
+            snap = db.execute("SELECT refreshed_at, scope FROM column_snapshots WHERE engine = ?", (engine,)).fetchone()
+            if not force and self._fresh(snap) and snap[1] == scope:
+                return "cached"
+
+            import pandas as pd
+
+            source = make_source()
+            cols = source.columns()
+            counts = source.row_counts()
+            rows = {}
+            for *key, r in counts[ROW_COUNT_FIELDS].itertuples(index=False):
+                if pd.notna(r):
+                    catalog, schema, name = (None if pd.isna(v) else str(v) for v in key)
+                    rows[f"{catalog}.{schema}.{name}"] = int(r)
+            records = []
+            # One pass over plain lists: per-object DataFrame slices cost more than the query.
+            objects: dict = {}
+            for *key, column, typ in cols[COLUMN_FIELDS].itertuples(index=False):
+                objects.setdefault(tuple(None if pd.isna(v) else str(v) for v in key), []).append((str(column), str(typ)))
+            for (catalog, schema, name), pairs in objects.items():
+                if name is None:
+                    continue
+                fqn = f"{catalog}.{schema}.{name}"
+                signature, names_signature = column_signatures(pairs)
+                records.append((
+                    engine, fqn, catalog, schema, name, json.dumps(pairs, separators=(",", ":")),
+                    len(pairs), rows.get(fqn), signature, names_signature,
+                ))
+            db.execute("DELETE FROM columns WHERE engine = ?", (engine,))
+            db.executemany("INSERT OR REPLACE INTO columns VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", records)
+            now = datetime.datetime.now().isoformat(timespec="seconds")
+            db.execute("INSERT OR REPLACE INTO column_snapshots VALUES (?, ?, ?, ?)", (engine, now, scope, len(records)))
+            return "full"
+
+    def signatures(self, engine: str) -> pd.DataFrame:
+        import pandas as pd
+
+        # SIGNATURE_FIELDS per object from the last column listing.
+        with self._connect() as db:
+            df = pd.read_sql_query(
+                f"SELECT {', '.join(SIGNATURE_FIELDS)} FROM columns WHERE engine = ? ORDER BY rowid",
+                db,
+                params=(engine,),
+            )
+        return df.astype({"n_columns": "Int64", "row_count": "Int64"})
+
+    def objects(self, engine: str) -> pd.DataFrame:
+        import pandas as pd
+
+        with self._connect() as db:
+            return pd.read_sql_query(
+                "SELECT catalog, schema, name, type FROM objects WHERE engine = ? ORDER BY rowid",
+                db,
+                params=(engine,),
+            )
+
+    def size(self, engine: str) -> int:
+        with self._connect() as db:
+            return db.execute("SELECT COUNT(*) FROM objects WHERE engine = ?", (engine,)).fetchone()[0]
+
+    def _scope(self, catalog: Optional[str], schema: Optional[str]) -> tuple[str, list]:
+        conds, params = [], []
+        if catalog is not None:
+            conds.append("catalog = ?")
+            params.append(catalog)
+        if schema is not None:
+            conds.append("schema = ?")
+            params.append(schema)
+        return "".join(f" AND {c}" for c in conds), params
+
+    def exists(self, engine: str, catalog: Optional[str] = None, schema: Optional[str] = None) -> bool:
+        where, params = self._scope(catalog, schema)
+        with self._connect() as db:
+            return db.execute(f"SELECT 1 FROM objects WHERE engine = ?{where} LIMIT 1", (engine, *params)).fetchone() is not None
+
+    def longest_containing(self, engine: str, text: str, catalog: Optional[str] = None, schema: Optional[str] = None) -> Optional[str]:
+        where, params = self._scope(catalog, schema)
+        with self._connect() as db:
+            row = db.execute(
+                f"SELECT fqn FROM objects WHERE engine = ? AND instr(name_lower, ?) > 0{where}"
+                " ORDER BY length(name) DESC, fqn LIMIT 1",
+                (engine, text.lower(), *params),
+            ).fetchone()
+        return row[0] if row else None
+
+    def names(self, engine: str, catalog: Optional[str] = None, schema: Optional[str] = None) -> list[tuple[str, str]]:
+        where, params = self._scope(catalog, schema)
+        with self._connect() as db:
+            return db.execute(f"SELECT name, fqn FROM objects WHERE engine = ?{where} ORDER BY rowid", (engine, *params)).fetchall()
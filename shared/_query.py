@@ -0,0 +1,658 @@
+﻿from __future__ import annotations
+
+import datetime
+import decimal
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional, Tuple
+
+from _base import _TRACE_TABLE, ConnectionPool, csv_enabled, dateid_ranges, query_errors, span, trace_event
+from _catalog import ROW_COUNT_FIELDS, CatalogSource, ColumnSource
+from _results import ResultsStore
+
+# pandas and pyarrow load with the first fetch, cache or chunk read, not with
+# this module, so dry runs and --help stay on the standard library.
+if TYPE_CHECKING:
+    import pandas as pd
+    import pyarrow as pa
+    import pyodbc
+    from databricks import sql as dbsql
+
+FETCH_BATCH_ROWS = 100_000
+
+
+@dataclass
+class FetchStats:
+    rows: int = 0
+    bytes: int = 0
+    seconds: float = 0.0
+
+    def add(self, table: pa.Table, seconds: float) -> None:
+        self.rows += table.num_rows
+        self.bytes += table.nbytes
+        self.seconds += seconds
+
+    def __str__(self) -> str:
+        secs = max(self.seconds, 1e-9)
+        return (
+            f"{self.rows} rows, {self.bytes / 1e6:.1f} MB in {self.seconds:.2f}s "
+            f"({self.rows / secs:,.0f} rows/s, {self.bytes / 1e6 / secs:.1f} MB/s)"
+        )
+
+
+def _arrow_type(desc: tuple) -> Optional[pa.DataType]:
+    import pyarrow as pa
+
+    # pyodbc cursor.description: (name, type_code, display_size, internal_size, precision, scale, null_ok)
+    type_code, precision, scale = desc[1], desc[4], desc[5]
+    if type_code is int:
+        return pa.int64()
+    if type_code is float:
+        return pa.float64()
+    if type_code is decimal.Decimal:
+        return pa.decimal128(min(int(precision or 38), 38), int(scale or 0))
+    if type_code is bool:
+        return pa.bool_()
+    if type_code is str:
+        return pa.string()
+    if type_code is datetime.datetime:
+        return pa.timestamp("us")
+    if type_code is datetime.date:
+        return pa.date32()
+    if type_code is bytes:
+        return pa.binary()
+    return None
+
+
+def _empty_table(names: List[str]) -> pa.Table:
+    import pyarrow as pa
+
+    return pa.table({n: pa.array([], type=pa.null()) for n in names})
+
+
+def _timed_batches(engine: str, next_batch: Callable[[], Optional[pa.Table]], names: List[str], started: float, stats: Optional[FetchStats]) -> Iterator[pa.Table]:
+    # Called right after execute returned. `stats` counts execute time into the
+    # first batch; the trace has execute (queueing and execution: both drivers
+    # block until the first result is ready) and fetch (transfer plus Arrow
+    # assembly, not the time a streaming consumer spends between batches).
+    executed = time.perf_counter()
+    trace_event("execute", executed - started, engine=engine)
+    fetched = FetchStats()
+    while True:
+        table = next_batch()
+        now = time.perf_counter()
+        if table is None:
+            fetched.seconds += now - max(started, executed)
+            break
+        if stats is not None:
+            stats.add(table, now - started)
+        fetched.add(table, now - max(started, executed))
+        yield table
+        started = time.perf_counter()
+    trace_event("fetch", fetched.seconds, engine=engine, rows=fetched.rows, bytes=fetched.bytes)
+    if not fetched.rows:
+        yield _empty_table(names)
+
+
+def synapse_iter_arrow(con: pyodbc.Connection, sql: str, batch_rows: int = FETCH_BATCH_ROWS, stats: Optional[FetchStats] = None) -> Iterator[pa.Table]:
+    import pyarrow as pa
+
+    # fetchmany + per-column Arrow assembly: only one batch of row tuples is alive
+    # at a time. Always yields at least one (possibly empty) table.
+    cur = con.cursor()
+    try:
+        started = time.perf_counter()
+        cur.arraysize = batch_rows
+        cur.execute(sql)
+        names = [d[0] for d in cur.description]
+        types = [_arrow_type(d) for d in cur.description]
+
+        def next_batch() -> Optional[pa.Table]:
+            rows = cur.fetchmany(batch_rows)
+            if not rows:
+                return None
+            return pa.table({n: pa.array(v, type=t) for n, t, v in zip(names, types, zip(*rows))})
+
+        yield from _timed_batches("synapse", next_batch, names, started, stats)
+    finally:
+        cur.close()
+
+
+def databricks_iter_arrow(con: dbsql.Connection, sql: str, batch_rows: int = FETCH_BATCH_ROWS, stats: Optional[FetchStats] = None) -> Iterator[pa.Table]:
+    with con.cursor() as cur:
+        started = time.perf_counter()
+        cur.execute(sql)
+        names = [d[0] for d in cur.description]
+
+        def next_batch() -> Optional[pa.Table]:
+            table = cur.fetchmany_arrow(batch_rows)
+            return table if table.num_rows else None
+
+        yield from _timed_batches("databricks", next_batch, names, started, stats)
+
+
+def _concat(tables: List[pa.Table]) -> pa.Table:
+    import pyarrow as pa
+
+    if len(tables) == 1:
+        return tables[0]
+    return pa.concat_tables([t for t in tables if t.num_rows], promote_options="default")
+
+
+def synapse_fetch_arrow(con: pyodbc.Connection, sql: str, batch_rows: int = FETCH_BATCH_ROWS, stats: Optional[FetchStats] = None) -> pa.Table:
+    return _concat(list(synapse_iter_arrow(con, sql, batch_rows, stats)))
+
+
+def databricks_fetch_arrow(con: dbsql.Connection, sql: str, batch_rows: int = FETCH_BATCH_ROWS, stats: Optional[FetchStats] = None) -> pa.Table:
+    return _concat(list(databricks_iter_arrow(con, sql, batch_rows, stats)))
+
+
+def synapse_query(con: pyodbc.Connection, sql: str, stats: Optional[FetchStats] = None) -> pd.DataFrame:
+    return synapse_fetch_arrow(con, sql, stats=stats).to_pandas()
+
+
+def databricks_query(con: dbsql.Connection, sql: str, stats: Optional[FetchStats] = None) -> pd.DataFrame:
+    return databricks_fetch_arrow(con, sql, stats=stats).to_pandas()
+
+
+class ResultCache:
+    # Query results stored as Parquet under `root`, keyed by a hash of the SQL text
+    # plus the source table's version token, so a reload invalidates them. Least
+    # recently used files are evicted once the directory exceeds max_bytes.
+    # Objects without a version token (views) are never cached.
+
+    def __init__(self, root: Path, max_bytes: int, refresh: bool = False):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+        self.uncacheable = 0
+        self._lock = threading.Lock()
+
+    def _path(self, sql: str, version: str) -> Path:
+        h = hashlib.sha256(f"{version}\n{sql}".encode("utf-8")).hexdigest()
+        return self.root / f"{h}.parquet"
+
+    def _count(self, attr: str) -> None:
+        with self._lock:
+            setattr(self, attr, getattr(self, attr) + 1)
+
+    def fetch(self, sql: str, version: Optional[str], run: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+        import pandas as pd
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if version is None:
+            self._count("uncacheable")
+            return run()
+
+        path = self._path(sql, version)
+        if not self.refresh and path.exists():
+            try:
+                df = pd.read_parquet(path)
+                os.utime(path)
+                self._count("hits")
+                return df
+            except (OSError, pa.ArrowException):
+                pass
+
+        self._count("misses")
+        df = run()
+        tmp = path.with_name(f"{path.stem}.{threading.get_ident()}.tmp")
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp, compression="zstd")
+        os.replace(tmp, path)
+        self._evict()
+        return df
+
+    def _evict(self) -> None:
+        with self._lock:
+            files = []
+            for p in self.root.glob("*.parquet"):
+                try:
+                    st = p.stat()
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, p))
+            total = sum(f[1] for f in files)
+            for _, size, p in sorted(files, key=lambda f: f[0]):
+                if total <= self.max_bytes:
+                    break
+                p.unlink(missing_ok=True)
+                total -= size
+
+    def __str__(self) -> str:
+        return f"{self.hits} hits, {self.misses} misses, {self.uncacheable} uncacheable"
+
+
+def synapse_table_stats_sql(table_2part: str) -> str:
+    schema, name = table_2part.split(".", 1)
+    return f"""
+SELECT SUM(ps.row_count) AS cnt, CONVERT(VARCHAR(30), MAX(t.modify_date), 126) AS modified
+FROM sys.schemas s
+JOIN sys.tables t ON t.schema_id = s.schema_id
+JOIN sys.pdw_table_mappings tm ON tm.object_id = t.object_id
+JOIN sys.pdw_nodes_tables nt ON nt.name = tm.physical_name
+JOIN sys.dm_pdw_nodes_db_partition_stats ps
+  ON ps.object_id = nt.object_id AND ps.pdw_node_id = nt.pdw_node_id AND ps.distribution_id = nt.distribution_id
+WHERE s.name = '{schema}' AND t.name = '{name}' AND ps.index_id < 2
+"""
+
+
+def synapse_table_stats(con: pyodbc.Connection, table_2part: str) -> Optional[Tuple[int, str]]:
+    import pandas as pd
+
+    # (row count from distribution partition stats, last DDL modify date); None for views.
+    df = synapse_query(con, synapse_table_stats_sql(table_2part))
+    if df.empty or pd.isna(df.iloc[0, 0]):
+        return None
+    return int(df.iloc[0, 0]), str(df.iloc[0, 1])
+
+
+def synapse_metadata_rowcount(con: pyodbc.Connection, table_2part: str) -> Optional[int]:
+    stats = synapse_table_stats(con, table_2part)
+    return None if stats is None else stats[0]
+
+
+def synapse_table_version(con: pyodbc.Connection, table_2part: str, audit_sql: Optional[str] = None) -> Optional[str]:
+    # Dedicated pools keep no DML timestamp: DDL modify date + row count stand in,
+    # optionally refined by a load-audit query (formatted with {schema} and
+    # {name}, returning one value; each tool has its own setting for it).
+    stats = synapse_table_stats(con, table_2part)
+    if stats is None:
+        return None
+    token = f"synapse:{stats[1]}:{stats[0]}"
+    if audit_sql:
+        schema, name = table_2part.split(".", 1)
+        audit = synapse_query(con, audit_sql.format(schema=schema, name=name))
+        token += f":{audit.iloc[0, 0] if len(audit) else None}"
+    return token
+
+
+def databricks_table_version(con: dbsql.Connection, table_3part: str) -> Optional[str]:
+    try:
+        hist = databricks_query(con, f"DESCRIBE HISTORY {table_3part} LIMIT 1")
+    except query_errors():
+        return None
+    if hist.empty:
+        return None
+    return f"databricks:{hist.iloc[0]['version']}:{hist.iloc[0]['timestamp']}"
+
+
+def databricks_metadata_rowcount_sql(table_3part: str) -> List[str]:
+    # An unfiltered COUNT(*) on Delta is answered from the numRecords stats in the Delta log, not a scan.
+    return [f"DESCRIBE DETAIL {table_3part}", f"SELECT COUNT(*) AS cnt FROM {table_3part}"]
+
+
+def databricks_metadata_rowcount(con: dbsql.Connection, table_3part: str) -> Optional[int]:
+    # None unless the object is a Delta table (DESCRIBE DETAIL fails on views).
+    detail_sql, count_sql = databricks_metadata_rowcount_sql(table_3part)
+    try:
+        detail = databricks_query(con, detail_sql)
+    except query_errors():
+        return None
+    if detail.empty or str(detail.iloc[0].get("format", "")).lower() != "delta":
+        return None
+    df = databricks_query(con, count_sql)
+    return int(df.iloc[0, 0])
+
+
+class ChunkRunner:
+    # Runs query(con, lo, hi) over ranges of an integer (DateID-style) column on
+    # pooled connections. Failed ranges are retried with exponential backoff,
+    # then split in half; finished ranges are checkpointed as Parquet under
+    # `root` (with the range list in plan.json) so a rerun after a crash only
+    # queries what is missing. The checkpoint is removed once every range has
+    # completed.
+
+    def __init__(self, pool: ConnectionPool, root: Path, workers: int, retries: int = 3, backoff: float = 2.0):
+        self.pool = pool
+        self.root = root
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self._lock = threading.Lock()
+        self._plan: List[Tuple[int, int]] = []
+
+    def _part(self, lo: int, hi: int) -> Path:
+        return self.root / f"{lo}_{hi}.parquet"
+
+    def _save_plan(self) -> None:
+        tmp = self.root / "plan.json.tmp"
+        tmp.write_text(json.dumps(self._plan), encoding="utf-8")
+        os.replace(tmp, self.root / "plan.json")
+
+    def plan(self, lo: int, hi: int, n: int) -> List[Tuple[int, int]]:
+        # Resume the saved plan when there is one, extended to cover a range that has grown since.
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self.root / "plan.json"
+        if not path.exists():
+            self._plan = dateid_ranges(lo, hi, n)
+        else:
+            self._plan = [tuple(r) for r in json.loads(path.read_text(encoding="utf-8"))]
+            old_lo, old_hi = self._plan[0][0], self._plan[-1][1]
+            if lo < old_lo:
+                self._plan.insert(0, (lo, old_lo - 1))
+            if hi > old_hi:
+                self._plan.append((old_hi + 1, hi))
+            done = sum(self._part(a, b).exists() for a, b in self._plan)
+            print(f"Resuming {self.root.name}: {done}/{len(self._plan)} ranges already done")
+        self._save_plan()
+        return list(self._plan)
+
+    def _attempt(self, query: Callable, lo: int, hi: int) -> pd.DataFrame:
+        for attempt in range(self.retries + 1):
+            try:
+                with self.pool.connection(discard_on_error=True) as con:
+                    return query(con, lo, hi)
+            except query_errors() as e:
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff * 2**attempt * random.uniform(0.5, 1.0)
+                print(f"{self.root.name} [{lo}, {hi}] failed ({e}); retry {attempt + 1}/{self.retries} in {delay:.1f}s")
+                time.sleep(delay)
+
+    def _run_range(self, query: Callable, lo: int, hi: int) -> pd.DataFrame:
+        import pandas as pd
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        part = self._part(lo, hi)
+        if part.exists():
+            return pq.read_table(part).to_pandas()
+        try:
+            with span("chunk", lo=lo, hi=hi) as s:
+                df = self._attempt(query, lo, hi)
+                s["rows"] = len(df)
+        except query_errors():
+            halves = dateid_ranges(lo, hi, 2)
+            if len(halves) < 2:
+                raise
+            print(f"{self.root.name} [{lo}, {hi}] still failing; splitting into {halves}")
+            with self._lock:
+                i = self._plan.index((lo, hi))
+                self._plan[i:i + 1] = halves
+                self._save_plan()
+            return pd.concat([self._run_range(query, a, b) for a, b in halves], ignore_index=True)
+
+        tmp = part.with_suffix(".tmp")
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp)
+        os.replace(tmp, part)
+        return df
+
+    def run(self, ranges: List[Tuple[int, int]], query: Callable) -> pd.DataFrame:
+        import pandas as pd
+
+        table = _TRACE_TABLE.get()
+
+        def one(r: Tuple[int, int]) -> pd.DataFrame:
+            token = _TRACE_TABLE.set(table)
+            try:
+                return self._run_range(query, *r)
+            finally:
+                _TRACE_TABLE.reset(token)
+
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="chunk") as ex:
+            parts = list(ex.map(one, ranges))
+        df = pd.concat([p for p in parts if len(p)] or parts[:1], ignore_index=True)
+        for p in self.root.iterdir():
+            p.unlink()
+        self.root.rmdir()
+        return df
+
+
+def write_csv(df: pd.DataFrame, path: Path) -> Optional[Path]:
+    # CSV files are a view over the results store; COMPARE_CSV=off skips them.
+    if not csv_enabled():
+        return None
+    with span("write", rows=len(df)) as s:
+        df.to_csv(path, index=False)
+        s["bytes"] = path.stat().st_size
+    return path
+
+
+_RESULTS: Optional[ResultsStore] = None
+
+
+@contextmanager
+def results_run(root: Path, run_id: Optional[str] = None) -> Iterator[ResultsStore]:
+    # One run id for everything recorded inside the block (given, for the
+    # workers of a distributed run to share the coordinator's).
+    global _RESULTS
+    store = ResultsStore(root, run_id)
+    _RESULTS = store
+    try:
+        yield store
+    finally:
+        _RESULTS = None
+        print("Results:", store)
+
+
+def record_result(name: str, df: pd.DataFrame, table: Optional[str] = None) -> None:
+    if _RESULTS is not None:
+        with span("record", rows=len(df)):
+            _RESULTS.append(name, df, table)
+
+
+MONITORING_TABLE = "main.monitoring.tables"
+# Columns that, when present, let the catalog cache fetch only changed objects.
+MONITORING_CHANGE_COLUMNS = ("last_altered", "last_modified", "modified_at", "updated_at")
+# Approximate row count per table, when the monitoring job records one.
+MONITORING_ROWCOUNT_COLUMNS = ("num_rows", "row_count", "num_records", "rows")
+DATABRICKS_COLUMNS_TABLE = "system.information_schema.columns"
+
+
+def monitoring_probe_sql() -> str:
+    return f"SELECT * FROM {MONITORING_TABLE} LIMIT 0"
+
+
+def monitoring_columns(con: dbsql.Connection) -> Callable[..., Optional[str]]:
+    # Probe the column names once; pick(*candidates) returns the first present, quoted.
+    lower = {c.lower(): c for c in databricks_query(con, monitoring_probe_sql()).columns}
+    def pick(*names: str) -> Optional[str]:
+        for n in names:
+            if n in lower:
+                return f"`{lower[n]}`"
+        return None
+    return pick
+
+
+def monitoring_key_columns(pick: Callable[..., Optional[str]]) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    return (
+        pick("catalog", "table_catalog"),
+        pick("schema", "table_schema", "database", "table_database"),
+        pick("name", "table_name"),
+    )
+
+
+def databricks_catalog_source(con: dbsql.Connection) -> CatalogSource:
+    # Select only what name resolution needs.
+    pick = monitoring_columns(con)
+    c_catalog, c_schema, c_name = monitoring_key_columns(pick)
+    c_type = pick("type", "table_type")
+    c_changed = pick(*MONITORING_CHANGE_COLUMNS)
+    if c_name is None:
+        raise RuntimeError(f"{MONITORING_TABLE} has no name / table_name column")
+
+    select = ", ".join([
+        f"{c_catalog or repr('main')} AS `catalog`",
+        f"{c_schema or 'NULL'} AS `schema`",
+        f"{c_name} AS `name`",
+        f"{c_type or 'NULL'} AS `type`",
+        f"CAST({c_changed} AS STRING) AS `modified`" if c_changed else "NULL AS `modified`",
+    ])
+
+    def fetch(since: Optional[str]) -> pd.DataFrame:
+        where = f" WHERE {c_changed} > '{since}'" if since is not None else ""
+        return databricks_query(con, f"SELECT {select} FROM {MONITORING_TABLE}{where}")
+
+    def count() -> int:
+        # Distinct names, as the cache keeps one row per fully qualified name.
+        keys = ", ".join(c for c in (c_catalog, c_schema, c_name) if c)
+        return int(databricks_query(con, f"SELECT COUNT(*) AS n FROM (SELECT DISTINCT {keys} FROM {MONITORING_TABLE}) t").iloc[0, 0])
+
+    return CatalogSource(fetch, count, incremental=c_changed is not None)
+
+
+SYNAPSE_OBJECTS_SQL = """
+SELECT DB_NAME() AS [catalog], s.name AS [schema], o.name AS [name],
+       CASE WHEN o.type = 'V' THEN 'VIEW' ELSE 'TABLE' END AS [type],
+       CONVERT(VARCHAR(23), o.modify_date, 126) AS [modified]
+FROM sys.objects o
+JOIN sys.schemas s ON s.schema_id = o.schema_id
+WHERE o.type IN ('U', 'V')
+"""
+SYNAPSE_OBJECT_COUNT_SQL = "SELECT COUNT(*) AS n FROM sys.objects WHERE type IN ('U', 'V')"
+
+
+def synapse_objects_sql(since: Optional[str] = None) -> str:
+    return SYNAPSE_OBJECTS_SQL + (f" AND o.modify_date > '{since}'" if since is not None else "")
+
+
+def synapse_catalog_source(con: pyodbc.Connection) -> CatalogSource:
+    # sys.objects.modify_date moves on create and ALTER, so later refreshes only
+    # list what changed since the last snapshot.
+    def fetch(since: Optional[str]) -> pd.DataFrame:
+        return synapse_query(con, synapse_objects_sql(since))
+
+    def count() -> int:
+        return int(synapse_query(con, SYNAPSE_OBJECT_COUNT_SQL).iloc[0, 0])
+
+    return CatalogSource(fetch, count, incremental=True)
+
+
+def _in_list(column: str, values: Optional[List[str]]) -> Optional[str]:
+    if not values:
+        return None
+    return f"{column} IN ({', '.join(repr(str(v)) for v in values)})"
+
+
+def databricks_columns_sql(catalogs: Optional[List[str]] = None, schemas: Optional[List[str]] = None) -> str:
+    conds = [c for c in (_in_list("table_catalog", catalogs), _in_list("table_schema", schemas)) if c]
+    where = f" WHERE {' AND '.join(conds)}" if conds else ""
+    return (
+        "SELECT table_catalog AS `catalog`, table_schema AS `schema`, table_name AS `name`,"
+        f" column_name AS `column`, data_type AS `type` FROM {DATABRICKS_COLUMNS_TABLE}{where}"
+        " ORDER BY table_catalog, table_schema, table_name, ordinal_position"
+    )
+
+
+def databricks_column_source(con: dbsql.Connection, catalogs: Optional[List[str]] = None, schemas: Optional[List[str]] = None) -> ColumnSource:
+    # Every column in scope from the information schema in one query, instead of
+    # a DESCRIBE per table; row counts only if the monitoring table keeps them.
+    def columns() -> pd.DataFrame:
+        return databricks_query(con, databricks_columns_sql(catalogs, schemas))
+
+    def row_counts() -> pd.DataFrame:
+        pick = monitoring_columns(con)
+        c_catalog, c_schema, c_name = monitoring_key_columns(pick)
+        c_rows = pick(*MONITORING_ROWCOUNT_COLUMNS)
+        if c_name is None or c_rows is None:
+            import pandas as pd
+
+            return pd.DataFrame(columns=ROW_COUNT_FIELDS)
+        return databricks_query(
+            con,
+            f"SELECT {c_catalog or repr('main')} AS `catalog`, {c_schema or 'NULL'} AS `schema`, {c_name} AS `name`,"
+            f" {c_rows} AS `rows` FROM {MONITORING_TABLE}",
+        )
+
+    return ColumnSource(columns, row_counts)
+
+
+SYNAPSE_COLUMNS_SQL = """
+SELECT DB_NAME() AS [catalog], TABLE_SCHEMA AS [schema], TABLE_NAME AS [name], COLUMN_NAME AS [column], DATA_TYPE AS [type]
+FROM INFORMATION_SCHEMA.COLUMNS
+"""
+SYNAPSE_ROW_COUNTS_SQL = """
+SELECT DB_NAME() AS [catalog], s.name AS [schema], t.name AS [name], SUM(ps.row_count) AS [rows]
+FROM sys.schemas s
+JOIN sys.tables t ON t.schema_id = s.schema_id
+JOIN sys.pdw_table_mappings tm ON tm.object_id = t.object_id
+JOIN sys.pdw_nodes_tables nt ON nt.name = tm.physical_name
+JOIN sys.dm_pdw_nodes_db_partition_stats ps
+  ON ps.object_id = nt.object_id AND ps.pdw_node_id = nt.pdw_node_id AND ps.distribution_id = nt.distribution_id
+WHERE ps.index_id < 2
+"""
+
+
+def synapse_columns_sql(schemas: Optional[List[str]] = None) -> List[str]:
+    # [columns of every table and view, partition-stats row count per table]
+    cols_where = _in_list("TABLE_SCHEMA", schemas)
+    rows_where = _in_list("s.name", schemas)
+    return [
+        SYNAPSE_COLUMNS_SQL + (f"WHERE {cols_where}\n" if cols_where else "") + "ORDER BY TABLE_SCHEMA, TABLE_NAME, ORDINAL_POSITION",
+        SYNAPSE_ROW_COUNTS_SQL + (f"  AND {rows_where}\n" if rows_where else "") + "GROUP BY s.name, t.name",
+    ]
+
+
+def synapse_column_source(con: pyodbc.Connection, schemas: Optional[List[str]] = None) -> ColumnSource:
+    cols_sql, rows_sql = synapse_columns_sql(schemas)
+    return ColumnSource(lambda: synapse_query(con, cols_sql), lambda: synapse_query(con, rows_sql))
+
+
+# Change indicators for many tables at once (watch mode). Per table the same
+# signals as synapse_table_version / databricks_table_version, but one query
+# per engine instead of one or two per table.
+SYNAPSE_CHANGES_SQL = """
+SELECT s.name AS [schema], t.name AS [name], SUM(ps.row_count) AS [rows],
+       CONVERT(VARCHAR(30), MAX(t.modify_date), 126) AS [modified]
+FROM sys.schemas s
+JOIN sys.tables t ON t.schema_id = s.schema_id
+JOIN sys.pdw_table_mappings tm ON tm.object_id = t.object_id
+JOIN sys.pdw_nodes_tables nt ON nt.name = tm.physical_name
+JOIN sys.dm_pdw_nodes_db_partition_stats ps
+  ON ps.object_id = nt.object_id AND ps.pdw_node_id = nt.pdw_node_id AND ps.distribution_id = nt.distribution_id
+WHERE ps.index_id < 2
+"""
+DATABRICKS_TABLES_TABLE = "system.information_schema.tables"
+
+
+def synapse_changes_sql(schemas: Optional[List[str]] = None) -> str:
+    where = _in_list("s.name", schemas)
+    return SYNAPSE_CHANGES_SQL + (f"  AND {where}\n" if where else "") + "GROUP BY s.name, t.name"
+
+
+def synapse_changes(con: pyodbc.Connection, tables: List[str], audit_sql: Optional[str] = None) -> Dict[str, Optional[str]]:
+    # {SCHEMA.TABLE: token}; None where there is no indicator (views). A dedicated
+    # pool keeps no DML timestamp, so the token is DDL modify date + row count, plus
+    # the `loaded` value of an optional load-audit query returning schema, name and
+    # loaded for every table (in-place UPDATEs change neither of the first two).
+    schemas = sorted({t.split(".", 1)[0] for t in tables})
+    df = synapse_query(con, synapse_changes_sql(schemas))
+    tokens = {f"{r.schema}.{r.name}".lower(): f"synapse:{r.modified}:{r.rows}" for r in df.itertuples(index=False)}
+    if audit_sql:
+        audit = synapse_query(con, audit_sql)
+        for r in audit.itertuples(index=False):
+            key = f"{r.schema}.{r.name}".lower()
+            if key in tokens:
+                tokens[key] += f":{r.loaded}"
+    return {t: tokens.get(t.lower()) for t in tables}
+
+
+def databricks_changes_sql(catalogs: Optional[List[str]] = None, schemas: Optional[List[str]] = None) -> str:
+    conds = [c for c in (_in_list("table_catalog", catalogs), _in_list("table_schema", schemas)) if c]
+    where = f" WHERE {' AND '.join(conds)}" if conds else ""
+    return (
+        "SELECT table_catalog AS `catalog`, table_schema AS `schema`, table_name AS `name`,"
+        f" last_altered AS `modified` FROM {DATABRICKS_TABLES_TABLE}{where}"
+    )
+
+
+def databricks_changes(con: dbsql.Connection, tables: List[str]) -> Dict[str, Optional[str]]:
+    # {catalog.schema.name: token}. Unity Catalog moves last_altered with every
+    # Delta commit, so one information-schema query covers all tables; tables it
+    # does not list (hive_metastore) fall back to DESCRIBE HISTORY each.
+    parts = [t.split(".") for t in tables]
+    df = databricks_query(con, databricks_changes_sql(sorted({p[0] for p in parts}), sorted({p[1] for p in parts})))
+    tokens = {f"{r.catalog}.{r.schema}.{r.name}".lower(): f"databricks:{r.modified}" for r in df.itertuples(index=False)}
+    return {t: tokens[t.lower()] if t.lower() in tokens else databricks_table_version(con, t) for t in tables}
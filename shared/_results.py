@@ -0,0 +1,205 @@
+﻿from __future__ import annotations
+
+import datetime
+import functools
+import os
+import uuid
+from functools import reduce
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Optional
+from urllib.parse import quote
+
+if TYPE_CHECKING:
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+# Append-only Parquet datasets, shared by ddr-compare and lake-compare:
+#   <root>/<dataset>/run_date=YYYY-MM-DD[/table=<synapse table>]/<run_id>_<part>.parquet
+# Each append is a new file written under a dot name and renamed into place, so
+# readers never see a partial file and existing files are never rewritten.
+
+# Column name -> pyarrow type name; pyarrow itself loads with the first read or write.
+SCHEMAS = {
+    # ddr-compare: per-DateID counts, every DateID of every compared table.
+    "counts": [
+        ("run_id", "string"),
+        ("DateID", "int64"),
+        ("cnt_synapse", "int64"),
+        ("cnt_databricks", "int64"),
+        ("diff", "int64"),
+    ],
+    # lake-compare: mismatching groups only, one row per group and metric (values as text).
+    "diffs": [
+        ("run_id", "string"),
+        ("mode", "string"),
+        ("grain", "string"),
+        ("key", "string"),
+        ("metric", "string"),
+        ("synapse", "string"),
+        ("databricks", "string"),
+        ("diff", "float64"),
+        ("match", "bool_"),
+        ("presence", "string"),
+    ],
+    # Both tools: one row per compared table (per grain in lake-compare).
+    "summary": [
+        ("run_id", "string"),
+        ("tool", "string"),
+        ("table", "string"),
+        ("databricks_table", "string"),
+        ("mode", "string"),
+        ("keys", "string"),
+        ("status", "string"),
+        ("rows", "int64"),
+        ("mismatching", "int64"),
+        ("syn_total", "int64"),
+        ("dbx_total", "int64"),
+        ("syn_min", "int64"),
+        ("syn_max", "int64"),
+        ("dbx_min", "int64"),
+        ("dbx_max", "int64"),
+        ("missing_in_dbx", "int64"),
+        ("missing_in_syn", "int64"),
+        ("error", "string"),
+    ],
+    # lake-compare inventories: the filtered object lists mapping is built from,
+    # with each object's column-signature hashes and approximate row count.
+    "inventory": [
+        ("run_id", "string"),
+        ("engine", "string"),
+        ("catalog", "string"),
+        ("schema", "string"),
+        ("name", "string"),
+        ("type", "string"),
+        ("n_columns", "int64"),
+        ("row_count", "int64"),
+        ("signature", "string"),
+        ("names_signature", "string"),
+    ],
+}
+
+# Datasets with a table=... directory under each run date; summary and inventory
+# are small enough to keep one file per run.
+BY_TABLE = {"counts", "diffs"}
+
+MISMATCH = {
+    "counts": lambda f: f("diff") != 0,
+    "diffs": lambda f: ~f("match"),
+    "summary": lambda f: (f("mismatching") > 0) | (f("status") == "error"),
+}
+
+
+@functools.lru_cache(maxsize=None)
+def schema(name: str) -> pa.Schema:
+    import pyarrow as pa
+
+    return pa.schema([(column, getattr(pa, typ)()) for column, typ in SCHEMAS[name]])
+
+
+def run_date(run_id: str) -> str:
+    # 20250101T020000_ab12cd -> 2025-01-01
+    return f"{run_id[:4]}-{run_id[4:6]}-{run_id[6:8]}"
+
+
+class ResultsStore:
+    def __init__(self, root: Path, run_id: Optional[str] = None):
+        self.root = Path(root)
+        self.run_id = run_id or f"{datetime.datetime.now():%Y%m%dT%H%M%S}_{uuid.uuid4().hex[:6]}"
+
+    def __str__(self) -> str:
+        return f"{self.root} (run {self.run_id})"
+
+    def append(self, name: str, df: pd.DataFrame, table: Optional[str] = None) -> Optional[Path]:
+        if df.empty:
+            return None
+        if name in BY_TABLE and not table:
+            raise ValueError(f"{name} results need a table")
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        fields = schema(name)
+        df = df.assign(run_id=self.run_id)
+        df = df.reindex(columns=fields.names)
+        data = pa.Table.from_pandas(df, schema=fields, preserve_index=False)
+
+        folder = self.root / name / f"run_date={run_date(self.run_id)}"
+        if name in BY_TABLE:
+            folder = folder / f"table={quote(table, safe='')}"
+        folder.mkdir(parents=True, exist_ok=True)
+        path = folder / f"{self.run_id}_{uuid.uuid4().hex[:8]}.parquet"
+        tmp = folder / f".{path.name}.tmp"
+        pq.write_table(data, tmp)
+        os.replace(tmp, path)
+        return path
+
+    def dataset(self, name: str) -> Optional[ds.Dataset]:
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+
+        path = self.root / name
+        if not path.is_dir():
+            return None
+        parts = [pa.field("run_date", pa.string())]
+        if name in BY_TABLE:
+            parts.append(pa.field("table", pa.string()))
+        fields = pa.schema([*schema(name), *parts])
+        return ds.dataset(path, schema=fields, format="parquet", partitioning=ds.partitioning(pa.schema(parts), flavor="hive"))
+
+    def _filter(self, name: str, table: Optional[str], since: Optional[str], where: Optional[ds.Expression]) -> Optional[ds.Expression]:
+        import pyarrow.dataset as ds
+
+        conds = []
+        if table:
+            conds.append(ds.field("table") == table)
+        if since:
+            conds.append(ds.field("run_date") >= since)
+        if where is not None:
+            conds.append(where)
+        return reduce(lambda a, b: a & b, conds) if conds else None
+
+    def runs(self, name: str, table: Optional[str] = None, since: Optional[str] = None, where: Optional[ds.Expression] = None) -> List[str]:
+        # Oldest first. Without a row filter the run ids come from file names alone.
+        if where is None and (not table or name in BY_TABLE):
+            ids = set()
+            for day in (self.root / name).glob("run_date=*"):
+                if since and day.name.split("=", 1)[1] < since:
+                    continue
+                files = day.glob(f"table={quote(table, safe='')}/*.parquet" if table else "**/*.parquet")
+                ids.update(p.name.rsplit("_", 1)[0] for p in files)
+            return sorted(ids)
+        data = self.dataset(name)
+        if data is None:
+            return []
+        found = data.to_table(columns=["run_id"], filter=self._filter(name, table, since, where)).column("run_id")
+        return sorted(set(found.to_pylist()))
+
+    def read(
+        self,
+        name: str,
+        table: Optional[str] = None,
+        since: Optional[str] = None,
+        last_runs: Optional[int] = None,
+        columns: Optional[List[str]] = None,
+        mismatch_only: bool = False,
+        where: Optional[ds.Expression] = None,
+    ) -> pd.DataFrame:
+        import pandas as pd
+        import pyarrow.dataset as ds
+
+        # Table and run-date filters prune partition directories; only `columns` are read.
+        data = self.dataset(name)
+        empty = pd.DataFrame(columns=columns or [*(column for column, _ in SCHEMAS[name]), "run_date"])
+        if data is None:
+            return empty
+        if last_runs:
+            ids = self.runs(name, table, since, where)[-last_runs:]
+            if not ids:
+                return empty
+            # The oldest wanted run bounds the run-date partitions that are opened at all.
+            since = max(since or "", run_date(ids[0]))
+            where = ds.field("run_id").isin(ids) if where is None else where & ds.field("run_id").isin(ids)
+        if mismatch_only and name in MISMATCH:
+            mismatch = MISMATCH[name](ds.field)
+            where = mismatch if where is None else where & mismatch
+        return data.to_table(columns=columns, filter=self._filter(name, table, since, where)).to_pandas()
@@ -0,0 +1,283 @@
+﻿from __future__ import annotations
+
+import datetime
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# Work queue in a shared directory, for spreading one compare run over any
+# number of processes and machines without a server. Each state is a folder
+# and each transition an atomic rename, so exactly one process wins a claim:
+#
+#   pending/<id>.json   waiting; ids sort in the coordinator's schedule order
+#   leased/<id>.json    claimed; its modification time is the lease, renewed by
+#                       a heartbeat thread while the item runs
+#   done/<id>.json      finished, with the worker's result or error
+#
+# A lease not renewed for lease_seconds (crashed, killed or cut-off worker) is
+# renamed back to pending by whichever process notices first; an item claimed
+# more than max_attempts times is given up with an error. Expiry compares file
+# times with the local clock, so keep the machines' clocks in sync and the lease
+# well above any skew. This module is stdlib-only, like _base.
+
+STATES = ("pending", "leased", "done")
+QUEUE_FILE = "queue.json"
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}"
+
+
+def process_tag() -> str:
+    # Per worker process and safe in file names, for its traces in a shared out dir.
+    return f"{socket.gethostname()}_{os.getpid()}"
+
+
+def _now() -> str:
+    return datetime.datetime.now().isoformat(timespec="seconds")
+
+
+def _write_json(path: Path, data: Any) -> None:
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+    tmp.write_text(json.dumps(data), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _read_json(path: Path) -> Optional[Any]:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return None
+
+
+@dataclass
+class Lease:
+    id: str
+    item: Dict[str, Any]
+    attempts: int
+    path: Path
+    worker: str
+    lost: bool = False
+
+
+class WorkQueue:
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.meta_path = self.root / QUEUE_FILE
+
+    def _dir(self, state: str) -> Path:
+        return self.root / state
+
+    def exists(self) -> bool:
+        return self.meta_path.exists()
+
+    def meta(self) -> Dict[str, Any]:
+        meta = _read_json(self.meta_path)
+        if meta is None:
+            raise RuntimeError(f"No work queue at {self.root}")
+        return meta
+
+    def create(self, items: List[Dict[str, Any]], lease_seconds: float = 300.0, max_attempts: int = 3, **meta: Any) -> None:
+        # Replaces whatever queue was there; items are claimed in list order.
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.meta_path.unlink(missing_ok=True)
+        for state in STATES:
+            folder = self._dir(state)
+            folder.mkdir(exist_ok=True)
+            for p in folder.glob("*.json"):
+                p.unlink(missing_ok=True)
+        for i, item in enumerate(items):
+            _write_json(self._dir("pending") / f"{i:06d}.json", {"item": item, "attempts": 0})
+        # Written last: workers wait for the queue file before claiming.
+        _write_json(self.meta_path, {
+            "created": _now(),
+            "items": len(items),
+            "lease_seconds": lease_seconds,
+            "max_attempts": max_attempts,
+            **meta,
+        })
+
+    def wait_ready(self, timeout: float, poll: float = 1.0) -> Dict[str, Any]:
+        # For workers started before the coordinator has written the queue.
+        deadline = time.monotonic() + timeout
+        while not self.exists():
+            if time.monotonic() > deadline:
+                raise SystemExit(f"No work queue appeared at {self.root} within {timeout:g}s")
+            time.sleep(poll)
+        return self.meta()
+
+    def status(self) -> Dict[str, int]:
+        return {state: sum(1 for _ in self._dir(state).glob("*.json")) for state in STATES}
+
+    def finished(self) -> bool:
+        s = self.status()
+        return s["pending"] == 0 and s["leased"] == 0
+
+    def reclaim(self) -> int:
+        # Expired leases go back to pending; returns how many.
+        cutoff = time.time() - self.meta()["lease_seconds"]
+        n = 0
+        for path in self._dir("leased").glob("*.json"):
+            try:
+                if path.stat().st_mtime >= cutoff:
+                    continue
+                os.rename(path, self._dir("pending") / path.name)
+            except OSError:
+                continue  # renewed, finished or reclaimed by someone else meanwhile
+            print(f"Reclaimed queue item {path.stem} (lease expired)", file=sys.stderr)
+            n += 1
+        return n
+
+    def claim(self) -> Optional[Lease]:
+        meta = self.meta()
+        self.reclaim()
+        for path in sorted(self._dir("pending").glob("*.json")):
+            if (self._dir("done") / path.name).exists():
+                # Finished by a worker whose lease had already expired.
+                path.unlink(missing_ok=True)
+                continue
+            leased = self._dir("leased") / path.name
+            try:
+                # Touch first: the lease starts now, not when the item was queued.
+                os.utime(path)
+                os.rename(path, leased)
+            except OSError:
+                continue  # another worker won it
+            entry = _read_json(leased)
+            if entry is None:
+                continue  # reclaimed already; only possible with a very short lease
+            entry["attempts"] += 1
+            entry["worker"] = worker_id()
+            _write_json(leased, entry)
+            lease = Lease(path.stem, entry["item"], entry["attempts"], leased, entry["worker"])
+            if lease.attempts > meta["max_attempts"]:
+                self.complete(lease, error=f"Gave up after {meta['max_attempts']} attempts whose worker stopped renewing its lease")
+                continue
+            return lease
+        return None
+
+    def renew(self, lease: Lease) -> bool:
+        try:
+            os.utime(lease.path)
+            return True
+        except FileNotFoundError:
+            lease.lost = True
+            return False
+
+    @contextmanager
+    def hold(self, lease: Lease) -> Iterator[Lease]:
+        # Renews the lease every third of lease_seconds while the block runs.
+        stop = threading.Event()
+        interval = self.meta()["lease_seconds"] / 3
+
+        def beat() -> None:
+            while not stop.wait(interval):
+                if not self.renew(lease):
+                    print(f"Lost the lease on queue item {lease.id}; another worker may redo it", file=sys.stderr)
+                    return
+
+        thread = threading.Thread(target=beat, name=f"lease-{lease.id}", daemon=True)
+        thread.start()
+        try:
+            yield lease
+        finally:
+            stop.set()
+            thread.join()
+
+    def complete(self, lease: Lease, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None, seconds: Optional[float] = None) -> None:
+        # The result is kept even when the lease was lost: the work is done either way.
+        _write_json(self._dir("done") / f"{lease.id}.json", {
+            "item": lease.item,
+            "attempts": lease.attempts,
+            "worker": worker_id(),
+            "finished": _now(),
+            "seconds": None if seconds is None else round(seconds, 3),
+            "result": result,
+            "error": error,
+        })
+        self._release(lease)
+
+    def _release(self, lease: Lease) -> None:
+        # Drops the leased file only while it is still this claim: `lost` is only
+        # noticed at a heartbeat, and a lease reclaimed and claimed again between
+        # two of them now belongs to the new holder, whose file names its claim.
+        if lease.lost:
+            return
+        entry = _read_json(lease.path)
+        if entry is not None and entry.get("worker") == lease.worker and entry.get("attempts") == lease.attempts:
+            lease.path.unlink(missing_ok=True)
+
+    def results(self) -> List[Dict[str, Any]]:
+        # Finished entries in queue order.
+        out = []
+        for path in sorted(self._dir("done").glob("*.json")):
+            entry = _read_json(path)
+            if entry is not None:
+                out.append({"id": path.stem, **entry})
+        return out
+
+    def wait(self, poll: float = 1.0, report_every: float = 60.0) -> None:
+        # Blocks until every item is done, reclaiming expired leases meanwhile.
+        last = time.monotonic()
+        while True:
+            self.reclaim()
+            s = self.status()
+            if s["pending"] == 0 and s["leased"] == 0:
+                return
+            if time.monotonic() - last >= report_every:
+                print(f"Queue: {s['done']} done, {s['leased']} running, {s['pending']} waiting")
+                last = time.monotonic()
+            time.sleep(poll)
+
+
+# Options a queue worker never takes from the coordinator.
+QUEUE_LOCAL_OPTIONS = ("queue", "worker", "lease_seconds", "max_attempts", "no_work", "dry_run", "profile")
+
+
+def add_queue_args(ap) -> None:
+    ap.add_argument("--queue", help="Distributed run: shared folder for a work queue. Without --worker this process creates it, works on it and merges the results")
+    ap.add_argument("--worker", action="store_true", help="Queue: only claim and run items from --queue (start any number, on any machine)")
+    ap.add_argument("--no-work", action="store_true", help="Queue: the coordinator only enqueues, waits and merges")
+    ap.add_argument("--lease-seconds", type=float, default=300.0, help="Queue: an item whose worker stops renewing its lease for this long goes to another worker")
+    ap.add_argument("--max-attempts", type=int, default=3, help="Queue: give an item up after this many claims")
+
+
+def queue_options(args, local: tuple = ()) -> Dict[str, Any]:
+    # The coordinator's options, for workers to run every item the same way;
+    # `local` names per-process settings (concurrency, inputs) workers keep.
+    skip = set(QUEUE_LOCAL_OPTIONS) | set(local)
+    return {k: v for k, v in vars(args).items() if k not in skip}
+
+
+def apply_queue_options(args, meta: Dict[str, Any]) -> None:
+    for k, v in meta.get("options", {}).items():
+        setattr(args, k, v)
+
+
+def run_worker(queue: WorkQueue, handle: Callable[[Dict[str, Any]], Dict[str, Any]], stay: bool = True, poll: float = 5.0) -> int:
+    # Claims and handles items until none are left. With `stay`, keeps polling
+    # until the whole queue is done, to take over items of workers that die.
+    # An exception from `handle` ends this worker; its lease then expires and
+    # the item is retried elsewhere, up to max_attempts.
+    handled = 0
+    while True:
+        lease = queue.claim()
+        if lease is None:
+            if not stay or queue.finished():
+                return handled
+            time.sleep(poll)
+            continue
+        print(f"Queue item {lease.id} (attempt {lease.attempts}) on {worker_id()}")
+        started = time.perf_counter()
+        with queue.hold(lease):
+            result = handle(lease.item)
+        queue.complete(lease, result, seconds=time.perf_counter() - started)
+        handled += 1